@@ -2,9 +2,8 @@ import sys
 
 from musicau import analysis, tools
 
-from musicau.analysis.actions import getFiguredBassAtOffset, getOffsetOfElement
-
-import music21
+from musicau.analysis.actions import getMeasureTimeline, splitMeasureAndBeatString
+from musicau.analysis.patterns import FigurePattern, FigurePatternMatcher, FigureStep, FigureStream
 
 
 class FiguredBass798(analysis.AnalysisMethod):
@@ -13,6 +12,11 @@ class FiguredBass798(analysis.AnalysisMethod):
     The results will contain any result in which a 7 is found, meaning the filtering for 9 and 8 is done manually.
     """
 
+    def __init__(self):
+        super().__init__()
+        # A figure containing 7, followed by a bass note a half step higher
+        self._matcher = FigurePatternMatcher([FigurePattern("7-9-8", [FigureStep(figures=["7"]), FigureStep(bassInterval=1)])])
+
     def analyze(self, filePath):
         # Retrieve score, measure map, and required parts for the analysis
         score, measureMap = tools.parsing.parsePieceByPath(filePath, True)
@@ -20,49 +24,44 @@ class FiguredBass798(analysis.AnalysisMethod):
         bassPart = tools.parsing.getPartStreamFromScoreStream(score, 1)
         figuredBassPart = tools.parsing.getPartStreamFromScoreStream(score, 2)
 
-        # Get positions of closures
-        bHasFermata = lambda n: \
-            True if (hasattr(n, 'expressions') and n.expressions and any(isinstance(e, music21.expressions.Fermata) for e in n.expressions)) else False
-        melodyFermatas = melodyPart.recurse().notes.addFilter(bHasFermata)
-        fermataPositions = list(map(lambda n: getOffsetOfElement(n), melodyFermatas))
-
-        # Iterate over the bass part to check for specific pitch and figure sequences
-        bassIterator = bassPart.flatten().notes
-        figuredBassIterator = figuredBassPart.flatten().notes
+        # Match the pattern against the bass notes and their figures in a single pass
+        figureStream = FigureStream(bassPart, figuredBassPart, melodyPart)
+        measureTimeline = getMeasureTimeline(bassPart, measureMap)
         outResult = []
-        for note in bassIterator:
-            previousNote = note.previous('Note')
-            if previousNote is None or music21.interval.Interval(previousNote, note).semitones != 1:
-                continue
-
-            previousFigure = getFiguredBassAtOffset(previousNote.offset, figuredBassPart)
-            if "7" not in previousFigure:
-                continue
+        for match in self._matcher.findMatches(figureStream):
+            previousEvent, event = match.events
 
-            if note.next('Note') is not None and note.next('Note').offset in fermataPositions:
+            if event.index + 1 < len(figureStream) and figureStream.events[event.index + 1].bIsClosure:
                 locationOfFermata = "3"
             else:
-                locationOfFermata = "2" if note.offset in fermataPositions else "N/A"
+                locationOfFermata = "2" if event.bIsClosure else "N/A"
 
-            nextFigure = "N/A"
-            for figure in figuredBassIterator:
-                if figure.offset > note.offset and hasattr(figure, 'lyric') and figure.lyric is not None:
-                    nextFigure = figure.lyric
-                    break
+            nextFigure = figureStream.getNextFigureAfterOffset(event.offset)
+            if nextFigure is None:
+                nextFigure = "N/A"
 
-            currentFigure = getFiguredBassAtOffset(note.offset, figuredBassPart)
-
-            measure = analysis.actions.makeMeasureAndBeatStringByMeasureMap(note, measureMap)
-            outResult.append((measure, previousFigure, currentFigure, nextFigure, locationOfFermata))
+            measure = measureTimeline.makeMeasureAndBeatString(event.offset)
+            outResult.append((measure, previousEvent.figure, event.figure, nextFigure, locationOfFermata))
 
         return outResult
 
     def getOutputHeader(self):
         return ["(Position, Marking 1, Marking 2, Marking 3, Fermata on 2 / 3?) 1", "... 2", "... 3", "... 4", "... 5", "... 6"]
 
+    def getResultColumns(self):
+        return [("position", "TEXT"), ("measure", "TEXT"), ("beat", "REAL"), ("figure1", "TEXT"), ("figure2", "TEXT"), ("figure3", "TEXT"),
+                ("fermataLocation", "TEXT")]
+
+    def createResultRows(self, resultData):
+        return [(position,) + splitMeasureAndBeatString(position) + (figure1, figure2, figure3, locationOfFermata)
+                for position, figure1, figure2, figure3, locationOfFermata in resultData]
+
+    def getIndexedResultColumns(self):
+        return ["position"]
+
 
 if __name__ == '__main__':
     corpusName = sys.argv[1] if len(sys.argv) > 1 else ""
 
-    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"])
+    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"], bUseResultCache=True)
     analysis.procedures.analyseCatalogueCorpus(corpusName, FiguredBass798(), True, "798Search", params)
@@ -2,7 +2,7 @@ import sys
 
 from musicau import analysis, tools
 
-import music21
+from musicau.analysis.actions import getClosureIndex
 
 
 class CountClosures(analysis.AnalysisMethod):
@@ -15,22 +15,21 @@ class CountClosures(analysis.AnalysisMethod):
         score, measureMap = tools.parsing.parsePieceByPath(filePath, False)
         melodyPart = tools.parsing.getPartStreamFromScoreStream(score, 0)
 
-        # Create a filter that checks if the current element possesses an expression of type Fermata.
-        bHasFermata = lambda n: \
-            True if (hasattr(n, 'expressions') and n.expressions and any(isinstance(e, music21.expressions.Fermata) for e in n.expressions)) else False
-
-        # Apply filters to the streams to receive just the notes that have fermatas.
-        notesWithFermata = melodyPart.recurse().addFilter(bHasFermata)
-
-        # Return the length of the list of notes with a fermata.
-        return [len(notesWithFermata)]
+        # Return the amount of notes with a fermata, as found by the closure index of the melody.
+        return [len(getClosureIndex(melodyPart).closureNotes)]
 
     def getOutputHeader(self):
         return ["# of closures"]
 
+    def getResultColumns(self):
+        return [("closureCount", "INTEGER")]
+
+    def createResultRows(self, resultData):
+        return [tuple(resultData)]
+
 
 if __name__ == '__main__':
     corpusName = sys.argv[1] if len(sys.argv) > 1 else ""
 
-    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"])
+    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"], bUseResultCache=True)
     analysis.procedures.analyseCatalogueCorpus(corpusName, CountClosures(), True, "ClosureCount", params)
@@ -2,9 +2,7 @@ import sys
 
 from musicau import analysis, tools
 
-from musicau.analysis.actions import getFiguredBassAtOffset, getOffsetOfElement
-
-import music21
+from musicau.analysis.actions import getFigureDensityIndex, getOffsetOfNoteInPart, getClosureIndex
 
 from datetime import datetime
 import os.path
@@ -25,9 +23,7 @@ class FigureCount(analysis.AnalysisMethod):
         melodyNotes = melodyPart.recurse().notes
 
         # Get positions of closures
-        bHasFermata = lambda n: \
-            True if (hasattr(n, 'expressions') and n.expressions and any(isinstance(e, music21.expressions.Fermata) for e in n.expressions)) else False
-        fermataOffsets = list(map(lambda n: getOffsetOfElement(n), melodyNotes.addFilter(bHasFermata)))
+        closureIndex = getClosureIndex(melodyPart)
 
         # Figure out which note value (length) is the predominant one
         noteValueMap = {}
@@ -43,34 +39,17 @@ class FigureCount(analysis.AnalysisMethod):
         for note in melodyNotes:
             if not note.offset % mainNoteValue == 0.0:
                 continue
-            notesToProcess.append(getOffsetOfElement(note))
-
-        # For figured bass marking, find out how many figures are placed in the figured bass beneath it
-        fbMarkingToOffsetMap = {}
-        for marking in figuredBassPart.recurse().notes:
-            offset = getOffsetOfElement(marking)
-            fig = getFiguredBassAtOffset(offset, figuredBassPart)
-            if fig != '':
-                fbMarkingToOffsetMap[offset] = len(fig.split(","))
-            else:
-                fbMarkingToOffsetMap[offset] = 0
+            notesToProcess.append(getOffsetOfNoteInPart(note, melodyPart))
 
-        # Process results depending on whether a signature is close to a fermata or not
+        # Sum up all figures within the span between the first and last note in each group of three
+        figureDensityIndex = getFigureDensityIndex(figuredBassPart)
         resultsFermata = []
         resultsOther = []
         for i in range(len(notesToProcess) - 2):
-            # Sum up all signatures within the span between the first and last note in the given group of three
-            specificResult = 0
-            fbOffset = notesToProcess[i]
-            while fbOffset <= notesToProcess[i + 2]:
-                if fbOffset in fbMarkingToOffsetMap:
-                    specificResult += fbMarkingToOffsetMap[fbOffset]
-                else:
-                    print("WARNING: offset", fbOffset, "not in marking map!")
-                fbOffset += 0.25
+            specificResult = figureDensityIndex.getFigureSum(notesToProcess[i], notesToProcess[i + 2])
 
             # Only if there is a fermata on the last note of a group do we attribute the result to the fermata result list
-            if notesToProcess[i + 2] in fermataOffsets:
+            if closureIndex.isClosureAtOffset(notesToProcess[i + 2]):
                 resultsFermata.append(specificResult)
             else:
                 resultsOther.append(specificResult)
@@ -90,12 +69,18 @@ class FigureCount(analysis.AnalysisMethod):
     def createOutputEntry(self, resultData):
         return [resultData[0], resultData[1], resultData[2], resultData[3]]
 
+    def getResultColumns(self):
+        return [("totalOnFermata", "INTEGER"), ("totalOnNonFermata", "INTEGER"), ("averageOnFermata", "REAL"), ("averageOnNonFermata", "REAL")]
+
+    def createResultRows(self, resultData):
+        return [tuple(resultData)]
+
 
 if __name__ == '__main__':
     corpusName = sys.argv[1] if len(sys.argv) > 1 else ""
 
     outputName = "FigureCount"
-    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"])
+    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"], bUseResultCache=True)
     catalogues, results = analysis.procedures.analyseCatalogueCorpus(corpusName, FigureCount(), True, outputName, params)
 
     # Here we demonstrate how the results can be processed further by calculating values across the entire catalogues
@@ -2,9 +2,8 @@ import sys
 
 from musicau import analysis, tools
 
-from musicau.analysis.actions import makeMeasureAndBeatStringByMeasureMap, getFiguredBassAtOffset
-
-import music21
+from musicau.analysis.actions import makeMeasureAndBeatStringOfNote, getFiguredBassAtOffset, getClosureIndex, getOffsetOfNoteInPart, \
+    splitMeasureAndBeatString
 
 
 class Find9or4(analysis.AnalysisMethod):
@@ -18,30 +17,35 @@ class Find9or4(analysis.AnalysisMethod):
         melodyPart = tools.parsing.getPartStreamFromScoreStream(score, 0)
         figuredBassPart = tools.parsing.getPartStreamFromScoreStream(score, 2)
 
-        # Get notes with fermatas
-        bHasFermata = lambda n: \
-            True if (hasattr(n, 'expressions') and n.expressions and any(isinstance(e, music21.expressions.Fermata) for e in n.expressions)) else False
-        notesWithFermata = melodyPart.recurse().addFilter(bHasFermata)
-
         # Iterate over the notes with fermatas and determine the figured bass underneath them (including on previous notes in certain cases)
         outResult = []
-        for note in notesWithFermata:
-            figure = getFiguredBassAtOffset(notesWithFermata.currentHierarchyOffset(), figuredBassPart)
+        for note in getClosureIndex(melodyPart).closureNotes:
+            figure = getFiguredBassAtOffset(getOffsetOfNoteInPart(note, melodyPart), figuredBassPart)
             if "9" in figure or "4" in figure:
-                outResult.append((makeMeasureAndBeatStringByMeasureMap(note, measureMap), figure, False))
+                outResult.append((makeMeasureAndBeatStringOfNote(note, melodyPart, measureMap), figure, False))
             elif note.previous('Note').pitch == note.pitch:
                 figure = getFiguredBassAtOffset(note.previous('Note').activeSite.offset + note.previous('Note').offset, figuredBassPart)
                 if "9" in figure or "4" in figure:
-                    outResult.append((makeMeasureAndBeatStringByMeasureMap(note, measureMap), figure, True))
+                    outResult.append((makeMeasureAndBeatStringOfNote(note, melodyPart, measureMap), figure, True))
 
         return outResult
 
     def getOutputHeader(self):
         return ["Position, Marking, Detected with preceding melody note?"]
 
+    def getResultColumns(self):
+        return [("position", "TEXT"), ("measure", "TEXT"), ("beat", "REAL"), ("figure", "TEXT"), ("onPrecedingNote", "INTEGER")]
+
+    def createResultRows(self, resultData):
+        return [(position,) + splitMeasureAndBeatString(position) + (figure, bWithPrecedingNote)
+                for position, figure, bWithPrecedingNote in resultData]
+
+    def getIndexedResultColumns(self):
+        return ["position"]
+
 
 if __name__ == '__main__':
     corpusName = sys.argv[1] if len(sys.argv) > 1 else ""
 
-    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"])
+    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"], bUseResultCache=True)
     analysis.procedures.analyseCatalogueCorpus(corpusName, Find9or4(), True, "9or4OnClosure", params)
@@ -2,13 +2,22 @@ import sys
 
 from musicau import analysis, tools
 
-from musicau.analysis.actions import testConditionAtOffset, getOffsetOfElement
-
-import music21
+from musicau.analysis.actions import testConditionAtOffset, getOffsetOfNoteInPart, getClosureIndex, splitMeasureAndBeatString
 
 from music21 import interval
 
 
+def isStepFromPreviousNote(note, semitones: int) -> bool:
+    """
+    Checks whether a note is reached from the previous note of its part by an interval of the given size.
+    @param note: The music21 Note to check.
+    @param semitones: The size of the interval in semitones, negative for descending intervals.
+    @return: True if there is a previous note and the interval matches, otherwise False.
+    """
+    previousNote = note.previous('Note')
+    return previousNote is not None and interval.Interval(previousNote, note).semitones == semitones
+
+
 class FindPhrygianClosures(analysis.AnalysisMethod):
     """
     Analysis method to find phrygian closures.
@@ -21,29 +30,34 @@ class FindPhrygianClosures(analysis.AnalysisMethod):
         bassPart = tools.parsing.getPartStreamFromScoreStream(score, 1)
 
         # Get positions of closures
-        bHasFermata = lambda n: \
-            True if (hasattr(n, 'expressions') and n.expressions and any(isinstance(e, music21.expressions.Fermata) for e in n.expressions)) else False
-        melodyFermatas = melodyPart.recurse().notes.addFilter(bHasFermata)
-        fermataPositions = list(map(lambda n: getOffsetOfElement(n), melodyFermatas))
+        closureIndex = getClosureIndex(melodyPart)
 
-        bHasHalfStep = lambda n: \
-            getOffsetOfElement(n) in fermataPositions and n.previous('Note') is not None and interval.Interval(n.previous('Note'), n).semitones == -1
+        bHasHalfStep = lambda n: closureIndex.isClosureAtOffset(getOffsetOfNoteInPart(n, bassPart)) and isStepFromPreviousNote(n, -1)
 
-        bHasCorrespondingWholeStep = lambda offset, part: \
-            testConditionAtOffset(offset, part, lambda n: n.previous('Note') is not None and interval.Interval(n.previous('Note'), n).semitones == 2)
+        bHasCorrespondingWholeStep = lambda offset, part: testConditionAtOffset(offset, part, lambda n: isStepFromPreviousNote(n, 2))
 
         bassHalfSteps = bassPart.recurse().notes.addFilter(bHasHalfStep)
 
         # Iterate over the notes found to have half step for additional data (like whether there is a corresponding whole step in the melody part)
         outResult = [len(bassHalfSteps),
                      list(map(lambda n:
-                              [analysis.actions.makeMeasureAndBeatStringByMeasureMap(n, measureMap),
-                               bHasCorrespondingWholeStep(getOffsetOfElement(n), melodyPart)], bassHalfSteps))]
+                              [analysis.actions.makeMeasureAndBeatStringOfNote(n, bassPart, measureMap),
+                               bHasCorrespondingWholeStep(getOffsetOfNoteInPart(n, bassPart), melodyPart)], bassHalfSteps))]
         return outResult
 
     def getOutputHeader(self):
         return ["# of closures", "List of all closures (Position, Whole Step in Melody?)"]
 
+    def getResultColumns(self):
+        return [("position", "TEXT"), ("measure", "TEXT"), ("beat", "REAL"), ("wholeStepInMelody", "INTEGER")]
+
+    def createResultRows(self, resultData):
+        # One row per closure, the amount of closures is the amount of rows
+        return [(position,) + splitMeasureAndBeatString(position) + (bHasWholeStep,) for position, bHasWholeStep in resultData[1]]
+
+    def getIndexedResultColumns(self):
+        return ["position"]
+
     def createOutputEntry(self, resultData):
         return [resultData[0], resultData[1]]
 
@@ -51,5 +65,5 @@ class FindPhrygianClosures(analysis.AnalysisMethod):
 if __name__ == '__main__':
     corpusName = sys.argv[1] if len(sys.argv) > 1 else ""
 
-    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"])
+    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"], bUseResultCache=True)
     analysis.procedures.analyseCatalogueCorpus(corpusName, FindPhrygianClosures(), True, "PhrygianClosures", params)
@@ -33,6 +33,14 @@ class CustomQuery(analysis.AnalysisMethod):
         # Remove or add any columns you may need
         return [resultData[0], resultData[1], resultData[2]]
 
+    def getResultColumns(self):
+        # Only needed when writing results to a database: remove or add any columns you may need
+        return [("column1", "TEXT"), ("column2", "INTEGER"), ("column3", "REAL")]
+
+    def createResultRows(self, resultData):
+        # Only needed when writing results to a database: return one tuple per row, matching the columns above
+        return [(resultData[0], resultData[1], resultData[2])]
+
 
 if __name__ == '__main__':
     corpusName = sys.argv[1] if len(sys.argv) > 1 else ""
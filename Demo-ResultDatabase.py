@@ -0,0 +1,54 @@
+import sys
+
+from musicau import analysis, tools
+
+import importlib.util
+import os.path
+
+
+# Query combining the results of both analysis methods: phrygian closures that carry a figure of 9 or 4
+PHRYGIAN_CLOSURES_WITH_9_OR_4 = """
+    SELECT closures.catalogue, closures.pieceNumber, closures.specifiers, closures.position, closures.wholeStepInMelody, figures.figure
+    FROM PhrygianClosures AS closures
+    JOIN Find9or4 AS figures
+        ON closures.catalogue = figures.catalogue AND closures.pieceNumber = figures.pieceNumber AND closures.specifiers = figures.specifiers
+        AND closures.position = figures.position
+    ORDER BY closures.catalogue, closures.pieceNumber, closures.specifiers, closures.rowIndex
+"""
+
+
+def loadAnalysisMethod(scriptName: str, className: str) -> analysis.AnalysisMethod:
+    """
+    Loads an analysis method from one of the analysis scripts.
+    @param scriptName: File name of the script, located next to this one.
+    @param className: Name of the AnalysisMethod subclass within the script.
+    @return: An instance of the analysis method.
+    """
+    moduleName = os.path.splitext(scriptName)[0].replace("-", "_")
+    moduleSpec = importlib.util.spec_from_file_location(moduleName, os.path.join(os.path.dirname(os.path.abspath(__file__)), scriptName))
+    module = importlib.util.module_from_spec(moduleSpec)
+    # The module has to be registered so that the analysis method can be sent to worker processes
+    sys.modules[moduleName] = module
+    moduleSpec.loader.exec_module(module)
+    return getattr(module, className)()
+
+
+if __name__ == '__main__':
+    # Usage: Demo-ResultDatabase.py [corpus name]
+    corpusName = sys.argv[1] if len(sys.argv) > 1 else ""
+    databasePath = "Results.sqlite"
+
+    # Run both analysis methods in a single pass over the corpus, writing their results to one table each
+    analysisMethods = [loadAnalysisMethod("Analysis-PhrygianClosures.py", "FindPhrygianClosures"),
+                       loadAnalysisMethod("Analysis-Find9or4OnClosures.py", "Find9or4")]
+    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"], bUseResultCache=True, databasePath=databasePath)
+    analysis.procedures.analyseCatalogueCorpusWithMethods(corpusName, analysisMethods, False, ["PhrygianClosures", "Find9or4"], params)
+
+    database = tools.resultDatabase.ResultDatabase(databasePath)
+    rows = database.query(PHRYGIAN_CLOSURES_WITH_9_OR_4)
+    database.close()
+
+    print("Phrygian closures with a figure of 9 or 4: " + str(len(rows)))
+    for catalogue, pieceNumber, specifiers, position, bHasWholeStep, figure in rows:
+        print("  " + catalogue + " " + pieceNumber + (" (" + specifiers + ")" if specifiers != "" else "") + " at " + position + ": " + figure +
+              (", whole step in melody" if bHasWholeStep else ""))
@@ -9,7 +9,7 @@ def main():
         for directory in newCorpus.directoryPaths:
             newCorpus.removePath(directory)
 
-    newCorpus.addPath(os.path.dirname(os.path.abspath(__file__)) + "\\__Example Corpus__\\")
+    newCorpus.addPath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "__Example Corpus__"))
     newCorpus.cacheMetadata(useMultiprocessing=False, verbose=True)
     newCorpus.save()
 
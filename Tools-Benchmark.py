@@ -0,0 +1,450 @@
+import sys
+
+from musicau import tools
+
+import music21
+
+from contextlib import redirect_stdout
+from datetime import datetime
+import csv
+import io
+import importlib.util
+import json
+import os.path
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+
+# Directory containing the example corpus the benchmark is run on.
+CORPUS_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__Example Corpus__")
+
+# Amount of pieces in the fixed subset of the corpus.
+SUBSET_SIZE = 12
+
+# Layouts of repeat barlines and endings that are checked in addition to the random ones (see makeRandomRepeatLayout), by name.
+REPEAT_TEST_LAYOUTS = {
+    # The second ending starts with a forward repeat, so both endings overlap and music21 fails with a ValueError
+    "overlapping endings": [
+        {},
+        {"left": '<ending number="1" type="start"/><repeat direction="backward"/>',
+         "right": '<ending number="1" type="stop"/><repeat direction="backward"/>'},
+        {"left": '<ending number="2" type="start"/><repeat direction="forward"/>',
+         "right": '<ending number="2" type="discontinue"/><repeat direction="backward"/>'},
+    ],
+}
+
+# Analysis methods to benchmark as tuples of the script they are defined in and their class name.
+BENCHMARKED_METHODS = [
+    ("Analysis-CountClosures.py", "CountClosures"),
+    ("Analysis-PhrygianClosures.py", "FindPhrygianClosures"),
+    ("Analysis-Find9or4OnClosures.py", "Find9or4"),
+    ("Analysis-789Search.py", "FiguredBass798"),
+    ("Analysis-FigureCount.py", "FigureCount"),
+    ("Tools-CheckForDiminishedOverFiguredBass.py", "CheckForDiminishedBass"),
+    ("Tools-PhraseDetection.py", "PhraseDetector"),
+]
+
+# Modules and scripts whose import time is measured, to notice when heavy dependencies are imported eagerly again.
+BENCHMARKED_IMPORTS = [
+    "musicau",
+    "musicau.analysis",
+    "musicau.analysis.procedures",
+    "musicau.tools.eventTables",
+    "Tools-PhraseDetection.py",
+]
+
+# Amount of fresh interpreters each import is measured in, of which the fastest is reported.
+IMPORT_REPETITIONS = 5
+
+
+def getBenchmarkFiles(bShouldUseSubset: bool) -> list[os.path]:
+    """
+    Retrieves the pieces of the example corpus to run the benchmark on.
+    @param bShouldUseSubset: Whether only the fixed subset of the corpus should be used instead of the full corpus.
+    @return: Sorted list of paths to the MusicXML files.
+    """
+    filePaths = sorted(os.path.join(CORPUS_DIRECTORY, fileName) for fileName in os.listdir(CORPUS_DIRECTORY)
+                       if fileName.endswith(".musicxml") and "_META" not in fileName and not tools.corpusManagement.isGeneratedFile(fileName))
+    if bShouldUseSubset:
+        filePaths = filePaths[::max(1, len(filePaths) // SUBSET_SIZE)][:SUBSET_SIZE]
+    return filePaths
+
+
+def createAnalysisMethod(scriptName: str, className: str, filePaths: list[os.path]):
+    """
+    Loads an analysis method from its script and creates an instance of it.
+    @param scriptName: File name of the script the method is defined in.
+    @param className: Name of the class of the method.
+    @param filePaths: The pieces the benchmark is run on. The phrase detection uses the first of them as its source phrase.
+    @return: The AnalysisMethod instance.
+    """
+    scriptPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), scriptName)
+    moduleSpec = importlib.util.spec_from_file_location(os.path.splitext(scriptName)[0].replace("-", "_"), scriptPath)
+    module = importlib.util.module_from_spec(moduleSpec)
+    moduleSpec.loader.exec_module(module)
+    if className == "PhraseDetector":
+        return module.PhraseDetector(filePaths[0], 0.25, 0.5, 0.7)
+    return getattr(module, className)()
+
+
+def runMethodBenchmark(scriptName: str, className: str, filePaths: list[os.path], outputFilePath: os.path) -> dict:
+    """
+    Runs a single analysis method over the given pieces and measures the time spent in each stage.
+    @param scriptName: File name of the script the method is defined in.
+    @param className: Name of the class of the method.
+    @param filePaths: The pieces to analyse.
+    @param outputFilePath: Path to the CSV file the results are written to.
+    @return: Dictionary containing the total wall time and the times of all stages.
+    """
+    recorder = tools.profiling.StageRecorder()
+    startTime = time.perf_counter()
+    with tools.profiling.recordingStages(recorder):
+        with tools.profiling.measureStage("setup"):
+            analysisMethod = createAnalysisMethod(scriptName, className, filePaths)
+
+        with open(outputFilePath, 'w', newline='') as file:
+            csvWriter = csv.writer(file)
+            csvWriter.writerow(["Path"] + analysisMethod.getOutputHeader())
+            for filePath in filePaths:
+                with tools.profiling.measureStage("analyze"):
+                    resultData = analysisMethod.analyze(filePath)
+                with tools.profiling.measureStage("output"):
+                    csvWriter.writerow([filePath] + analysisMethod.createOutputEntry(resultData))
+
+    return {"totalWallTime": time.perf_counter() - startTime, "stages": recorder.toDict()}
+
+
+def measureImportTime(importTarget: str) -> dict:
+    """
+    Measures the time needed to import a module or to load a script, each time in a fresh interpreter.
+    @param importTarget: Name of the module, or file name of the script.
+    @return: Dictionary containing the fastest import time in seconds and whether music21 and numpy were loaded by the import.
+    """
+    if importTarget.endswith(".py"):
+        scriptPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), importTarget)
+        statement = ("import importlib.util\n"
+                     "moduleSpec = importlib.util.spec_from_file_location('benchmarkedScript', " + repr(scriptPath) + ")\n"
+                     "moduleSpec.loader.exec_module(importlib.util.module_from_spec(moduleSpec))")
+    else:
+        statement = "import " + importTarget
+    # Lazily imported modules are only counted as loaded once they have been replaced by the actual module
+    code = ("import sys, time\n"
+            "startTime = time.perf_counter()\n" + statement + "\n"
+            "importTime = time.perf_counter() - startTime\n"
+            "print(importTime, type(sys.modules.get('music21')) is type(sys), type(sys.modules.get('numpy')) is type(sys))")
+
+    outResults = {"time": None, "music21": False, "numpy": False}
+    for _ in range(IMPORT_REPETITIONS):
+        output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)), check=True, capture_output=True,
+                                text=True).stdout.split()
+        importTime = float(output[0])
+        if outResults["time"] is None or importTime < outResults["time"]:
+            outResults["time"] = importTime
+        outResults["music21"] = output[1] == "True"
+        outResults["numpy"] = output[2] == "True"
+    return outResults
+
+
+def measureImportTimes() -> dict:
+    """
+    Measures the import times of all benchmarked modules and scripts.
+    @return: Dictionary matching each module or script to its results, as returned by measureImportTime.
+    """
+    outResults = {}
+    for importTarget in BENCHMARKED_IMPORTS:
+        print("Measuring import time of " + importTarget + "...")
+        outResults[importTarget] = measureImportTime(importTarget)
+    return outResults
+
+
+def runBenchmark(bShouldUseSubset: bool, methodNames: list[str]) -> dict:
+    """
+    Runs the benchmark of all given analysis methods. Every method is run twice in a separate process each: once with an empty cache directory
+    and once with the cache directory filled by the first run.
+    @param bShouldUseSubset: Whether only the fixed subset of the corpus should be used instead of the full corpus.
+    @param methodNames: Class names of the methods to benchmark, all methods if empty.
+    @return: Dictionary containing information on the environment and the results of each method and cache state.
+    """
+    filePaths = getBenchmarkFiles(bShouldUseSubset)
+    outResults = {"version": 1,
+                  "timestamp": datetime.now().isoformat(timespec="seconds"),
+                  "python": platform.python_version(),
+                  "music21": music21.VERSION_STR,
+                  "platform": platform.platform(),
+                  "corpus": "subset" if bShouldUseSubset else "full",
+                  "pieceCount": len(filePaths),
+                  "imports": measureImportTimes(),
+                  "methods": {}}
+
+    for scriptName, className in BENCHMARKED_METHODS:
+        if len(methodNames) > 0 and className not in methodNames:
+            continue
+        temporaryDirectory = tempfile.mkdtemp(prefix="musicau-benchmark-")
+        try:
+            outResults["methods"][className] = {}
+            for cacheState in ["cold", "warm"]:
+                print("Benchmarking " + className + " (" + cacheState + " cache, " + str(len(filePaths)) + " pieces)...")
+                resultFilePath = os.path.join(temporaryDirectory, className + "." + cacheState + ".json")
+                environment = dict(os.environ, MUSICAU_CACHE_DIR=os.path.join(temporaryDirectory, "cache"))
+                subprocess.run([sys.executable, os.path.abspath(__file__), "run", scriptName, className, outResults["corpus"], resultFilePath],
+                               env=environment, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+                with open(resultFilePath) as file:
+                    outResults["methods"][className][cacheState] = json.load(file)
+        finally:
+            shutil.rmtree(temporaryDirectory, ignore_errors=True)
+    return outResults
+
+
+def validateEventTables(bShouldUseSubset: bool, bShouldExpandRepeats: bool = False) -> int:
+    """
+    Parses every piece both with the streaming MusicXML parser and with music21, and compares the resulting event tables. Differences are printed
+    per piece.
+    @param bShouldUseSubset: Whether only the fixed subset of the corpus should be used instead of the full corpus.
+    @param bShouldExpandRepeats: Whether repeats should be expanded, comparing the playback order of the streaming parser to music21's
+    expandRepeats.
+    @return: The amount of pieces whose event tables differ.
+    """
+    filePaths = getBenchmarkFiles(bShouldUseSubset)
+    streamingTime = 0.0
+    music21Time = 0.0
+    differingPieceCount = 0
+    for filePath in filePaths:
+        startTime = time.perf_counter()
+        streamedEventTable = tools.parsing.parseEventTableByPath(filePath, bShouldExpandRepeats)
+        streamingTime += time.perf_counter() - startTime
+
+        startTime = time.perf_counter()
+        score, measureMap = tools.parsing.parsePieceByPath(filePath, bShouldExpandRepeats)
+        music21EventTable = tools.eventTables.makeEventTableFromScore(score, measureMap)
+        music21Time += time.perf_counter() - startTime
+
+        differences = tools.eventTables.compareEventTables(streamedEventTable, music21EventTable)
+        if len(differences) > 0:
+            differingPieceCount += 1
+            print("WARNING: Event tables differ for " + os.path.basename(filePath) + ": " + "; ".join(differences))
+
+    print(str(len(filePaths) - differingPieceCount) + " of " + str(len(filePaths)) + " event tables are equal. Streaming parser: " +
+          format(streamingTime, ".2f") + "s, music21: " + format(music21Time, ".2f") + "s")
+    return differingPieceCount
+
+
+def makeRandomRepeatLayout(generator: random.Random, measureCount: int) -> list[dict[str, str]]:
+    """
+    Generates a random layout of repeat barlines and endings, including incoherent ones that cannot be expanded.
+    @param generator: The random number generator to use. The global one is not used, as music21 reseeds it when parsing.
+    @param measureCount: Amount of measures in the layout.
+    @return: List containing a dictionary per measure, matching the location of each of its barlines ('left' or 'right') to the MusicXML
+    contents of the barline.
+    """
+    endingElements = [{"left": [], "right": []} for _ in range(measureCount)]
+    repeatElements = [{"left": [], "right": []} for _ in range(measureCount)]
+    for measureIndex in range(measureCount):
+        randomValue = generator.random()
+        if randomValue < 0.15:
+            repeatElements[measureIndex]["left"].append('<repeat direction="forward"/>')
+        elif randomValue < 0.18:
+            repeatElements[measureIndex]["left"].append('<repeat direction="backward"/>')
+        if generator.random() < 0.15:
+            times = generator.choice(['', ' times="3"', ' times="1"'])
+            repeatElements[measureIndex]["right"].append('<repeat direction="backward"' + times + '/>')
+
+    if generator.random() < 0.6:
+        for _ in range(generator.randint(1, 2)):
+            startIndex = generator.randrange(measureCount)
+            endingCount = generator.randint(1, 3)
+            for endingIndex in range(endingCount):
+                if startIndex >= measureCount:
+                    break
+                stopIndex = min(measureCount - 1, startIndex + generator.randint(0, 1))
+                endingNumber = generator.choice([str(endingIndex + 1), str(endingIndex + 1), "1, 2"])
+                endingElements[startIndex]["left"].append('<ending number="' + endingNumber + '" type="start"/>')
+                endingType = generator.choice(["stop", "stop", "discontinue"])
+                endingElements[stopIndex]["right"].append('<ending number="' + str(endingIndex + 1) + '" type="' + endingType + '"/>')
+                if endingIndex < endingCount - 1 and generator.random() < 0.7:
+                    repeatElements[stopIndex]["right"].append('<repeat direction="backward"/>')
+                startIndex = stopIndex + 1
+
+    # Endings precede repeats within a barline, as required by the MusicXML schema
+    return [{location: "".join(endingElements[i][location] + repeatElements[i][location]) for location in ["left", "right"]
+             if len(endingElements[i][location] + repeatElements[i][location]) > 0} for i in range(measureCount)]
+
+
+def makeRepeatLayoutScore(layout: list[dict[str, str]]) -> str:
+    """
+    Creates a MusicXML file containing a single part with a note per measure and the given barlines.
+    @param layout: The barlines of each measure, as returned by makeRandomRepeatLayout.
+    @return: The contents of the MusicXML file.
+    """
+    measureElements = []
+    for measureIndex, barlines in enumerate(layout):
+        attributes = '<attributes><divisions>1</divisions><time><beats>2</beats><beat-type>4</beat-type></time></attributes>'
+        measureElements.append('<measure number="' + str(measureIndex + 1) + '">' + (attributes if measureIndex == 0 else "") +
+                               ('<barline location="left">' + barlines["left"] + '</barline>' if "left" in barlines else "") +
+                               '<note><pitch><step>C</step><octave>4</octave></pitch><duration>2</duration><type>half</type></note>' +
+                               ('<barline location="right">' + barlines["right"] + '</barline>' if "right" in barlines else "") +
+                               '</measure>')
+    return ('<?xml version="1.0" encoding="UTF-8"?><score-partwise version="3.1"><part-list><score-part id="P1"><part-name>Part</part-name>'
+            '</score-part></part-list><part id="P1">' + "".join(measureElements) + '</part></score-partwise>')
+
+
+def expandRepeatLayout(filePath: os.path) -> tuple[list[str], list[str]]:
+    """
+    Expands the repeats of a single part both with music21's expandRepeats and with the streaming MusicXML parser.
+    @param filePath: Path to the MusicXML file containing the part.
+    @return: A tuple of the measure names played according to music21 and according to the streaming parser. If the repeats cannot be expanded,
+    the name of the exception raised (or 'ExpanderException' if the streaming parser left the part unexpanded with a warning) is given instead.
+    """
+    part = music21.converter.parse(filePath, forceSource=True).parts[0]
+    try:
+        music21MeasureNames = [measure.measureNumberWithSuffix() for measure in part.expandRepeats().getElementsByClass("Measure")]
+    except (music21.repeat.ExpanderException, ValueError) as e:
+        music21MeasureNames = type(e).__name__
+
+    # Layouts that cannot be expanded are reported by a warning and left unexpanded, except for overlapping endings which raise a ValueError
+    parserOutput = io.StringIO()
+    try:
+        with redirect_stdout(parserOutput):
+            streamedEventTable = tools.parsing.parseEventTableByPath(filePath, True)
+        streamedMeasureNames = "ExpanderException" if "WARNING" in parserOutput.getvalue() else \
+            [label.split(" (")[0] for label in streamedEventTable.measureLabels]
+    except ValueError as e:
+        streamedMeasureNames = type(e).__name__
+    return music21MeasureNames, streamedMeasureNames
+
+
+def validateRepeatExpansion(layoutCount: int, seed: int) -> int:
+    """
+    Expands the repeats of randomly generated layouts of repeat barlines and endings both with the streaming MusicXML parser (see
+    repeatExpansion.RepeatStructure) and with music21's expandRepeats, and compares the order in which the measures are played. Layouts that
+    cannot be expanded must be rejected by both in the same way. The fixed layouts in REPEAT_TEST_LAYOUTS are always checked first. Differences
+    are printed per layout.
+    @param layoutCount: Amount of layouts to generate.
+    @param seed: Seed of the random number generator, so that differing layouts can be reproduced.
+    @return: The amount of layouts whose expansions differ.
+    """
+    generator = random.Random(seed)
+    layouts = list(REPEAT_TEST_LAYOUTS.items()) + \
+        [(str(layoutIndex), makeRandomRepeatLayout(generator, generator.randint(2, 8))) for layoutIndex in range(layoutCount)]
+    differingLayoutCount = 0
+    rejectedLayoutCount = 0
+    with tempfile.TemporaryDirectory() as directory:
+        filePath = os.path.join(directory, "layout.musicxml")
+        for layoutName, layout in layouts:
+            layoutScore = makeRepeatLayoutScore(layout)
+            with open(filePath, 'w') as file:
+                file.write(layoutScore)
+
+            music21MeasureNames, streamedMeasureNames = expandRepeatLayout(filePath)
+            if isinstance(music21MeasureNames, str):
+                rejectedLayoutCount += 1
+            if streamedMeasureNames != music21MeasureNames:
+                differingLayoutCount += 1
+                print("WARNING: Expansions differ for layout " + layoutName + ": music21 " + str(music21MeasureNames) + ", streaming parser " +
+                      str(streamedMeasureNames) + "\n" + layoutScore)
+
+    print(str(len(layouts) - differingLayoutCount) + " of " + str(len(layouts)) + " repeat layouts are expanded equally (" +
+          str(rejectedLayoutCount) + " cannot be expanded), seed " + str(seed))
+    return differingLayoutCount
+
+
+def printBenchmarkResults(results: dict):
+    """
+    Prints the results of a benchmark as a table of the time spent in each stage.
+    @param results: The results as returned by runBenchmark.
+    """
+    print("music21 " + results["music21"] + ", Python " + results["python"] + ", " + str(results["pieceCount"]) + " pieces (" +
+          results["corpus"] + ")")
+    printImportTimes(results["imports"])
+    for className, cacheStates in results["methods"].items():
+        for cacheState, methodResults in cacheStates.items():
+            stageStrings = [stageName + " " + format(stage["wallTime"], ".2f") + "s" for stageName, stage in methodResults["stages"].items()]
+            print(className + " (" + cacheState + "): " + format(methodResults["totalWallTime"], ".2f") + "s total, " + ", ".join(stageStrings))
+
+
+def printImportTimes(importTimes: dict):
+    """
+    Prints the import time of each module or script along with the heavy dependencies it loads.
+    @param importTimes: The import times, as returned by measureImportTimes.
+    """
+    for importTarget, importResults in importTimes.items():
+        loadedModules = [moduleName for moduleName in ["music21", "numpy"] if importResults[moduleName]]
+        print("import " + importTarget + ": " + format(importResults["time"], ".3f") + "s" +
+              ("" if len(loadedModules) == 0 else " (loads " + ", ".join(loadedModules) + ")"))
+
+
+def compareBenchmarkResults(previousResults: dict, currentResults: dict):
+    """
+    Prints the change of the time spent in each stage between two benchmarks.
+    @param previousResults: The results of the earlier benchmark, as returned by runBenchmark.
+    @param currentResults: The results of the later benchmark, as returned by runBenchmark.
+    """
+    if previousResults["corpus"] != currentResults["corpus"] or previousResults["pieceCount"] != currentResults["pieceCount"]:
+        print("WARNING: The benchmarks were run on different pieces and may not be comparable.")
+    print("music21 " + previousResults["music21"] + " -> " + currentResults["music21"])
+
+    # Results of earlier versions of the benchmark do not contain import times
+    for importTarget, importResults in currentResults.get("imports", {}).items():
+        previousImportResults = previousResults.get("imports", {}).get(importTarget)
+        if previousImportResults is None:
+            continue
+        change = (importResults["time"] / previousImportResults["time"] - 1) * 100 if previousImportResults["time"] > 0 else 0.0
+        print("import " + importTarget + ": " + format(previousImportResults["time"], ".3f") + "s -> " + format(importResults["time"], ".3f") +
+              "s (" + format(change, "+.1f") + "%)")
+
+    for className, cacheStates in currentResults["methods"].items():
+        if className not in previousResults["methods"]:
+            continue
+        for cacheState, methodResults in cacheStates.items():
+            previousMethodResults = previousResults["methods"][className].get(cacheState)
+            if previousMethodResults is None:
+                continue
+            times = [("total", previousMethodResults["totalWallTime"], methodResults["totalWallTime"])]
+            for stageName, stage in methodResults["stages"].items():
+                if stageName in previousMethodResults["stages"]:
+                    times.append((stageName, previousMethodResults["stages"][stageName]["wallTime"], stage["wallTime"]))
+            for name, previousTime, currentTime in times:
+                change = (currentTime / previousTime - 1) * 100 if previousTime > 0 else 0.0
+                print(className + " (" + cacheState + ") " + name + ": " + format(previousTime, ".2f") + "s -> " + format(currentTime, ".2f") +
+                      "s (" + format(change, "+.1f") + "%)")
+
+
+if __name__ == '__main__':
+    # Usage: Tools-Benchmark.py [subset|full] [method class names...]
+    #        Tools-Benchmark.py imports
+    #        Tools-Benchmark.py eventtables [subset|full] [expanded]
+    #        Tools-Benchmark.py repeats [layout count] [seed]
+    #        Tools-Benchmark.py compare [previous results file] [current results file]
+    mode = sys.argv[1] if len(sys.argv) > 1 else "subset"
+
+    if mode == "run":
+        # Internal mode used to run a single method in a separate process
+        scriptName, className, corpus, resultFilePath = sys.argv[2:6]
+        methodResults = runMethodBenchmark(scriptName, className, getBenchmarkFiles(corpus == "subset"),
+                                           os.path.splitext(resultFilePath)[0] + ".csv")
+        with open(resultFilePath, 'w') as resultFile:
+            json.dump(methodResults, resultFile)
+    elif mode == "compare":
+        if len(sys.argv) < 4:
+            raise Exception("Two results files are required for comparison.")
+        with open(sys.argv[2]) as previousFile, open(sys.argv[3]) as currentFile:
+            compareBenchmarkResults(json.load(previousFile), json.load(currentFile))
+    elif mode == "imports":
+        printImportTimes(measureImportTimes())
+    elif mode == "eventtables":
+        validateEventTables((sys.argv[2] if len(sys.argv) > 2 else "subset") == "subset", "expanded" in sys.argv[3:])
+    elif mode == "repeats":
+        validateRepeatExpansion(int(sys.argv[2]) if len(sys.argv) > 2 else 2000, int(sys.argv[3]) if len(sys.argv) > 3 else 0)
+    elif mode in ["subset", "full"]:
+        results = runBenchmark(mode == "subset", sys.argv[2:])
+        printBenchmarkResults(results)
+
+        fileName = "Benchmark_" + mode + "_" + datetime.now().strftime("%Y%m%d-%H%M%S") + ".json"
+        with open(fileName, 'w') as file:
+            json.dump(results, file, indent=2)
+        print("Results written to " + fileName)
+    else:
+        raise Exception("Unknown mode: " + mode)
@@ -0,0 +1,28 @@
+import sys
+
+from musicau import analysis
+
+import time
+
+
+if __name__ == '__main__':
+    # Usage: Tools-BuildFeatureStore.py [corpus name] [feature store path]
+    corpusName = sys.argv[1] if len(sys.argv) > 1 else ""
+    featureStorePath = sys.argv[2] if len(sys.argv) > 2 else "Features.sqlite"
+
+    # Only new or changed pieces are parsed, so running this again after changing the corpus is fast
+    startTime = time.perf_counter()
+    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"], workerCount=0)
+    storedCount, removedCount = analysis.features.ingestCatalogueCorpus(corpusName, featureStorePath, params)
+    print("Stored " + str(storedCount) + " and removed " + str(removedCount) + " piece versions in " +
+          str(round(time.perf_counter() - startTime, 1)) + "s.")
+
+    # Example queries, which are answered from the feature store alone
+    startTime = time.perf_counter()
+    featureQuery = analysis.features.FeatureQuery(featureStorePath)
+    closureCounts = featureQuery.countClosures()
+    figuresOnClosures = set(featureQuery.findFigures("9", True) + featureQuery.findFigures("4", True))
+    featureQuery.close()
+    print("Closures in " + str(len(closureCounts)) + " pieces: " + str(sum(closureCount for _, _, _, closureCount in closureCounts)))
+    print("Figures containing 9 or 4 on closures: " + str(len(figuresOnClosures)))
+    print("Queries took " + str(round(time.perf_counter() - startTime, 3)) + "s.")
@@ -1,8 +1,10 @@
+import pickle
 import sys
+from collections import OrderedDict
 
 from musicau import analysis, tools
 
-from musicau.analysis.actions import getFiguredBassAtOffset, makeMeasureAndBeatStringByMeasureMap
+from musicau.analysis.actions import getFiguredBassAtOffset, makeMeasureAndBeatStringOfNote, splitMeasureAndBeatString
 
 import music21
 
@@ -10,12 +12,157 @@ from music21 import interval
 from music21.figuredBass import realizer
 
 
+# Simple name of the interval counted in the realizations (see music21.interval.Interval.simpleName). Change this for detecting other intervals.
+DETECTED_INTERVAL = 'd5'
+
+# Maximum amount of realizations kept in the realization cache before the least recently used ones are discarded.
+REALIZATION_CACHE_MAX_ENTRIES = 20000
+
+# Amount of new realizations after which the realization cache is persisted, so that worker processes share their realizations early.
+REALIZATION_CACHE_SAVE_INTERVAL = 100
+
+
+class RealizationCache:
+    """
+    Persisted, bounded memo of the amount of occurrences of an interval in the realizations of bass notes with figures. Realizations only depend
+    on the key, the bass pitch and the figure, which repeat throughout the corpus, so each distinct combination has to be realized only once.
+    """
+    def __init__(self, intervalName: str, methodVersion: int, maxEntries: int = REALIZATION_CACHE_MAX_ENTRIES):
+        """
+        @param intervalName: Simple name of the counted interval. Counts of different intervals are persisted separately.
+        @param methodVersion: Version of the analysis method using the cache. Counts of previous versions are not reused.
+        @param maxEntries: Maximum amount of realizations kept before the least recently used ones are discarded.
+        """
+        self.maxEntries: int = maxEntries
+        self.entries: OrderedDict[tuple[str, str, str], int] = OrderedDict()
+        self.__newEntries: dict[tuple[str, str, str], int] = {}
+        self.__fileCache = tools.caching.FileCache("realizations")
+        # Realizations may differ between versions of music21
+        self.__entryName = intervalName + ".v" + str(methodVersion) + ".m21-" + music21.VERSION_STR + ".p"
+        self.load()
+
+    def load(self):
+        """
+        Loads the persisted realizations, discarding any realizations that have not been saved yet.
+        """
+        self.entries = OrderedDict()
+        self.__newEntries = {}
+        data = self.__fileCache.read(self.__entryName)
+        if data is None:
+            return
+        try:
+            self.entries = OrderedDict(pickle.loads(data))
+        except Exception:
+            print("WARNING: Stored realizations are invalid and will be discarded.")
+
+    def save(self):
+        """
+        Persists all realizations added since the cache was loaded. Realizations stored by other processes in the meantime are kept.
+        """
+        if len(self.__newEntries) == 0:
+            return
+
+        newEntries = self.__newEntries
+        self.load()
+        for key, value in newEntries.items():
+            self.__setEntry(key, value)
+        try:
+            self.__fileCache.write(self.__entryName, pickle.dumps(list(self.entries.items())))
+        except OSError:
+            print("WARNING: Unable to write realizations to cache directory " + str(tools.caching.getCacheDirectory()))
+
+    def hasEntry(self, key: tuple[str, str, str]) -> bool:
+        """
+        Checks whether the realization of a combination is cached.
+        @param key: Tuple of the key, the bass pitch with octave and the figure.
+        @return: True if the realization is cached, otherwise False.
+        """
+        return key in self.entries
+
+    def getEntry(self, key: tuple[str, str, str]) -> int:
+        """
+        Retrieves the cached realization of a combination and marks it as recently used.
+        @param key: Tuple of the key, the bass pitch with octave and the figure.
+        @return: The amount of occurrences of the interval in the realization, or None if the figure could not be realized.
+        """
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def storeEntry(self, key: tuple[str, str, str], value: int):
+        """
+        Adds the realization of a combination to the cache, persisting the cache once enough new realizations have been added.
+        @param key: Tuple of the key, the bass pitch with octave and the figure.
+        @param value: The amount of occurrences of the interval in the realization, or None if the figure could not be realized.
+        """
+        self.__setEntry(key, value)
+        self.__newEntries[key] = value
+        if len(self.__newEntries) >= REALIZATION_CACHE_SAVE_INTERVAL:
+            self.save()
+
+    def __setEntry(self, key: tuple[str, str, str], value: int):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxEntries:
+            self.entries.popitem(last=False)
+
+
+_realizationCache: RealizationCache = None
+
+
+def getRealizationCache() -> RealizationCache:
+    """
+    Retrieves the realization cache of this process, loading it on first use. New realizations have to be saved explicitly, as worker processes
+    exit without running exit handlers.
+    @return: The RealizationCache.
+    """
+    global _realizationCache
+    if _realizationCache is None:
+        _realizationCache = RealizationCache(DETECTED_INTERVAL, CheckForDiminishedBass.version)
+    return _realizationCache
+
+
+def countIntervalsInRealization(keyOfNote: music21.key.Key, bassPitch: str, figure: str, intervalName: str) -> int:
+    """
+    Uses music21 to generate a solution to a given bass note with figure and counts the occurrences of an interval within it. The solution is
+    always the first one found by music21, so that the result only depends on the given parameters.
+    @param keyOfNote: The key the bass note is set in.
+    @param bassPitch: The pitch of the bass note with octave (i.e. 'B2').
+    @param figure: The figure of the bass note.
+    @param intervalName: Simple name of the interval to count (i.e. 'd5').
+    @return: The amount of ordered pairs of notes forming the interval, or None if there are no valid solutions.
+    """
+    # The bass note is created anew, as adding it to the figured bass line adds the figure to its lyrics
+    figuredLine = realizer.FiguredBassLine(keyOfNote)
+    figuredLine.addElement(music21.note.Note(bassPitch), figure)
+    realization = figuredLine.realize()
+    if realization.getNumSolutions() == 0:
+        return None
+
+    # Flatten the solution to a chord and find the interval within it
+    solution = realization.generateRealizationFromPossibilityProgression(realization.getAllPossibilityProgressions()[0]).flatten()
+    chord = music21.chord.Chord(solution.notes).closedPosition()
+    outCount = 0
+    for x in range(len(chord.notes)):
+        for y in range(len(chord.notes)):
+            if x != y and interval.Interval(chord.notes[x], chord.notes[y]).simpleName == intervalName:
+                outCount += 1
+    return outCount
+
+
 class CheckForDiminishedBass(analysis.AnalysisMethod):
     """
     Analysis method used as a tool to check for generation of diminished fifths over figures that are actually supposed to imply perfect fifths.
     """
+    version = 2
 
     def analyze(self, filePath):
+        try:
+            return self.__analyzeBassNotes(filePath)
+        finally:
+            # Worker processes exit without running exit handlers, so new realizations are saved after every piece
+            getRealizationCache().save()
+
+    def __analyzeBassNotes(self, filePath):
         # Retrieve score, measure map, and required parts for the analysis
         score, measureMap = tools.parsing.parsePieceByPath(filePath, True)
         bassPart = tools.parsing.getPartStreamFromScoreStream(score, 1)
@@ -26,7 +173,8 @@ class CheckForDiminishedBass(analysis.AnalysisMethod):
         iterBass = bassPart.recurse().notes
         for note in iterBass:
             # The problem is most common over leading tones: ignore any note that is not a leading tone
-            if not note.name == note.getContextByClass('KeySignature').asKey().getLeadingTone().name:
+            keyOfNote = note.getContextByClass('KeySignature').asKey()
+            if not note.name == keyOfNote.getLeadingTone().name:
                 continue
 
             # Ignore certain figures and combinations of figures
@@ -34,36 +182,53 @@ class CheckForDiminishedBass(analysis.AnalysisMethod):
             if '_' in figure or ('4' in figure or '6' in figure or '2' in figure) and '5' not in figure:
                 continue
 
-            # Use music21 to automatically generate a solution to a given bass note with figure
-            figuredLine = realizer.FiguredBassLine(note.getContextByClass('KeySignature').asKey(), note.getContextByClass('TimeSignature'))
-            figuredLine.addElement(note, figure)
-            realization = figuredLine.realize()
+            # Realize the bass note with its figure, reusing the realization of the same combination if it was realized before
+            realizationKey = (str(keyOfNote), note.pitch.nameWithOctave, figure)
+            realizationCache = getRealizationCache()
+            if realizationCache.hasEntry(realizationKey):
+                intervalCount = realizationCache.getEntry(realizationKey)
+            else:
+                intervalCount = countIntervalsInRealization(keyOfNote, note.pitch.nameWithOctave, figure, DETECTED_INTERVAL)
+                realizationCache.storeEntry(realizationKey, intervalCount)
 
             # Check if there are no valid solutions
             # This usually happens with 9 in the figured bass and is considered to be a problem with music21
-            if realization.getNumSolutions() == 0:
-                print("WARNING: Figure could not be evaluated: '" + figure + "' in " + makeMeasureAndBeatStringByMeasureMap(note, measureMap))
+            if intervalCount is None:
+                print("WARNING: Figure could not be evaluated: '" + figure + "' in " + makeMeasureAndBeatStringOfNote(note, bassPart, measureMap))
                 continue
 
-            # Flatten the solution to a chord and find a diminished fifth within it
-            solution = realization.generateRandomRealization().flatten()
-            chord = music21.chord.Chord(solution.notes).closedPosition()
-            for x in range(len(chord.notes)):
-                for y in range(len(chord.notes)):
-                    if x != y and interval.Interval(chord.notes[x], chord.notes[y]).simpleName == 'd5':  # Change this for detecting other intervals
-                        outResult.append((makeMeasureAndBeatStringByMeasureMap(note, measureMap), figure))
+            for _ in range(intervalCount):
+                outResult.append((makeMeasureAndBeatStringOfNote(note, bassPart, measureMap), figure))
 
         return outResult
 
+    def getFingerprint(self):
+        # The results depend on the detected interval, which is not an attribute of the method
+        return super().getFingerprint() + ":" + DETECTED_INTERVAL
+
     def getOutputHeader(self):
         return ["Position, Marking"]
 
     def createOutputEntry(self, resultData):
         return resultData
 
+    def getResultColumns(self):
+        return [("position", "TEXT"), ("measure", "TEXT"), ("beat", "REAL"), ("figure", "TEXT")]
+
+    def createResultRows(self, resultData):
+        # One row per diminished fifth, so a note may appear in several rows
+        return [(position,) + splitMeasureAndBeatString(position) + (figure,) for position, figure in resultData]
+
+    def getIndexedResultColumns(self):
+        return ["position"]
+
 
 if __name__ == '__main__':
+    # Usage: Tools-CheckForDiminishedOverFiguredBass.py [corpus name] [resume]
     corpusName = sys.argv[1] if len(sys.argv) > 1 else ""
+    bShouldResume = len(sys.argv) > 2 and sys.argv[2] == "resume"
 
-    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"])
+    # Results are journaled as the run progresses, so an interrupted run can be continued by passing 'resume'
+    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"], journalPath="DiminishedFifthOverFiguredBass.journal",
+                                                         bShouldResume=bShouldResume)
     analysis.procedures.analyseCatalogueCorpus(corpusName, CheckForDiminishedBass(), True, "DiminishedFifthOverFiguredBass", params)
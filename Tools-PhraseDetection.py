@@ -1,17 +1,23 @@
+from __future__ import annotations
+
 import csv
+import math
+import os.path
+import pickle
 import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
+import musicau
 from musicau import analysis, tools
 
-from musicau.analysis.actions import makeMeasureAndBeatStringByMeasureMap
+from musicau.analysis.actions import makeMeasureAndBeatStringOfNote, hasFermata, splitMeasureAndBeatString
 
 import music21
 
-import numpy
-import cv2
-
-import os.path
+# numpy is only loaded once phrases are scored, so that loading this module (i.e. in worker processes) stays fast
+numpy = musicau.importLazily("numpy")
 
 
 class IntegerPitchEncoding40:
@@ -94,14 +100,329 @@ def transposeIntPitchToNoAlterations(note: int, sourceKey: music21.key.Key) -> i
     return note + 23 * -sourceKey.sharps + 40 * (sourceKey.sharps // 2)
 
 
-def npHistogramToCV(npHistogram):
+def compareHistogramsBhattacharyya(histograms1: numpy.ndarray, histograms2: numpy.ndarray) -> numpy.ndarray:
+    """
+    Utility function to calculate the Bhattacharyya distance between pairs of histograms, equivalent to cv2.compareHist with
+    cv2.HISTCMP_BHATTACHARYYA. The bins are summed in two interleaved partial sums like OpenCV does, so that the results are identical.
+    @param histograms1: Matrix of histograms with one histogram per row. Each histogram must start at an even bin of the compared range.
+    @param histograms2: Matrix of histograms of the same shape as histograms1.
+    @return: Array of the distances between the histograms in each row.
+    """
+    binProducts = numpy.sqrt(histograms1 * histograms2)
+    evenSums = numpy.zeros(len(binProducts))
+    oddSums = numpy.zeros(len(binProducts))
+    for column in range(0, binProducts.shape[1], 2):
+        evenSums += binProducts[:, column]
+    for column in range(1, binProducts.shape[1], 2):
+        oddSums += binProducts[:, column]
+
+    normalizations = histograms1.sum(axis=1) * histograms2.sum(axis=1)
+    normalizations = numpy.where(numpy.abs(normalizations) > numpy.finfo(numpy.float32).eps, 1 / numpy.sqrt(normalizations), 1.0)
+    return numpy.sqrt(numpy.maximum(1 - (evenSums + oddSums) * normalizations, 0))
+
+
+def retrieveAndTransposePhrases(filePath: os.path, maxSearch: int = 0) -> dict[str, numpy.ndarray]:
+    """
+    Utility to retrieve and transpose all phrases from a given file path.
+    @param filePath: Path to the file to retrieve the phrases from.
+    @param maxSearch: The maximum amount of phrases to retrieve.
+    @return: A dictionary of phrases as arrays of transposed pitch classes (integer encoding modulo the base value) with measure-beat strings as
+    keys. Pitch classes are equal exactly if the names of the transposed pitches are equal.
+    """
+    score, measureMap = tools.parsing.parsePieceByPath(filePath, False)
+    melodyPart = tools.parsing.getPartStreamFromScoreStream(score, 0)
+
+    melodyFermatas = melodyPart.recurse().notes
+
+    notePhraseMap = {}
+    noteValueMap = {}
+    phraseNumber = "1, 1.0"
+    keySignature = None
+    for note in melodyFermatas:
+        if keySignature is None:
+            keySignature = note.getContextByClass('KeySignature').asKey()
+        if note.duration.quarterLength not in noteValueMap:
+            noteValueMap[note.duration.quarterLength] = 0
+
+        noteValueMap[note.duration.quarterLength] += 1
+
+        if phraseNumber not in notePhraseMap:
+            notePhraseMap[phraseNumber] = []
+
+        if maxSearch == 0 or len(notePhraseMap.keys()) <= maxSearch:
+            notePhraseMap[phraseNumber].append(note)
+
+        if hasFermata(note):
+            phraseNumber = makeMeasureAndBeatStringOfNote(note.next('Note') if note.next('Note') is not None else note, melodyPart, measureMap)
+
+    mainNoteValue = max(noteValueMap, key=noteValueMap.get)
+
+    transposedPhrases = {}
+    for phrase in notePhraseMap:
+        for note in notePhraseMap[phrase]:
+            if not note.offset % mainNoteValue == 0.0:
+                continue
+
+            encodedNote = IntegerPitchEncoding40.encodeMusic21Pitch(note.pitch)
+
+            if phrase not in transposedPhrases:
+                transposedPhrases[phrase] = []
+
+            transposedPhrases[phrase].append(transposeIntPitchToNoAlterations(encodedNote, keySignature) % IntegerPitchEncoding40.baseValue)
+
+    return {phrase: numpy.array(transposedPhrases[phrase], dtype=numpy.int64) for phrase in transposedPhrases}
+
+
+class PhraseIndex:
+    """
+    Persistent inverted index over the transposed phrases of all pieces in a corpus. The index maps n-grams of transposed pitches at a given
+    position within a phrase to the phrases containing them, which allows finding all phrases that could match a query phrase without parsing
+    or scoring every phrase in the corpus.
+    """
+    version = 1
+
+    def __init__(self, corpusName: str, ngramLength: int = 2):
+        """
+        @param corpusName: Name of the music21 LocalCorpus to index. If blank, the default corpus name will be used.
+        @param ngramLength: Length of the indexed n-grams.
+        """
+        self.corpusName: str = corpusName if corpusName != "" else musicau.DEFAULT_CORPUS_NAME
+        self.ngramLength: int = ngramLength
+        self.pieces: dict[str, tuple[str, dict[str, tuple[int, ...]]]] = {}
+        self.postings: dict[tuple[tuple[int, ...], int], list[tuple[str, str]]] = {}
+        self.__fileCache = tools.caching.FileCache("indexes")
+        self.__entryName = "phrases." + self.corpusName + ".n" + str(ngramLength) + ".v" + str(PhraseIndex.version) + ".p"
+        self.load()
+
+    def load(self):
+        """
+        Loads the persisted index, if there is one.
+        """
+        data = self.__fileCache.read(self.__entryName)
+        if data is None:
+            return
+        try:
+            self.pieces, self.postings = pickle.loads(data)
+        except Exception:
+            print("WARNING: Phrase index is invalid and will be rebuilt.")
+            self.pieces, self.postings = {}, {}
+
+    def save(self):
+        """
+        Persists the index in the cache directory.
+        """
+        try:
+            self.__fileCache.write(self.__entryName, pickle.dumps((self.pieces, self.postings)))
+        except OSError:
+            print("WARNING: Unable to write phrase index to cache directory " + str(tools.caching.getCacheDirectory()))
+
+    def updateFromCorpus(self, cataloguesToIgnore: list[str] = [], workerCount: int = 1):
+        """
+        Brings the index up to date with the pieces of the corpus that a run over the corpus analyses, re-extracting the phrases only of pieces
+        that were added or changed since the index was last updated.
+        @param cataloguesToIgnore: List of catalogues to ignore by string name, as passed to the run.
+        @param workerCount: Number of worker processes to spread the extraction of phrases across, see AnalysisProcedureParams.workerCount.
+        """
+        corpus = music21.corpus.corpora.LocalCorpus(self.corpusName)
+        if not corpus.existsInSettings:
+            raise Exception("The given corpus does not exist: " + self.corpusName)
+        pieces = analysis.procedures.collectCatalogueCorpusPieces(self.corpusName, cataloguesToIgnore)
+        self.update([sourcePath for _, _, _, sourcePath in pieces], workerCount)
+
+    def update(self, sourcePaths: list[os.path], workerCount: int = 1):
+        """
+        Brings the index up to date with the given pieces, removing all other pieces from the index. Pieces whose phrases cannot be extracted are
+        left out of the index with a warning, so that they are parsed by the analysis itself.
+        @param sourcePaths: Paths to the MusicXML files of all pieces to index.
+        @param workerCount: Number of worker processes to spread the extraction of phrases across, see AnalysisProcedureParams.workerCount.
+        """
+        bHasChanged = False
+        currentPaths = set()
+        changedPaths = []
+        for sourcePath in sourcePaths:
+            path = os.path.abspath(sourcePath)
+            currentPaths.add(path)
+            if path not in self.pieces or self.pieces[path][0] != tools.manifest.getSourceChecksum(path):
+                changedPaths.append(path)
+
+        workerCount = workerCount if workerCount > 0 else os.cpu_count()
+        if workerCount > 1 and len(changedPaths) > 1:
+            print("Indexing phrases of " + str(len(changedPaths)) + " pieces using " + str(workerCount) + " worker processes...")
+            with ProcessPoolExecutor(max_workers=workerCount) as executor:
+                extractedPhrases = list(executor.map(_extractIndexedPhrases, changedPaths))
+        else:
+            extractedPhrases = map(_extractIndexedPhrases, changedPaths)
+
+        for path, (phrases, formattedException) in zip(changedPaths, extractedPhrases):
+            bHasChanged = True
+            if formattedException is not None:
+                print("WARNING: Phrases of " + path + " could not be indexed - piece will be skipped:\n" + formattedException)
+                self.pieces.pop(path, None)
+                continue
+            self.pieces[path] = (tools.manifest.getSourceChecksum(path), phrases)
+
+        for path in list(self.pieces):
+            if path not in currentPaths:
+                del self.pieces[path]
+                bHasChanged = True
+
+        if bHasChanged:
+            self.__rebuildPostings()
+            self.save()
+
+    def __rebuildPostings(self):
+        self.postings = {}
+        for path, (_, phrases) in self.pieces.items():
+            for phrase, pitchClasses in phrases.items():
+                for position in range(len(pitchClasses) - self.ngramLength + 1):
+                    key = (pitchClasses[position:position + self.ngramLength], position)
+                    if key not in self.postings:
+                        self.postings[key] = []
+                    self.postings[key].append((path, phrase))
+
+    def containsPiece(self, sourcePath: os.path) -> bool:
+        """
+        Checks whether the index contains the up-to-date phrases of a piece.
+        @param sourcePath: Path to the MusicXML file of the piece.
+        @return: True if the piece is indexed and has not changed since, otherwise False.
+        """
+        path = os.path.abspath(sourcePath)
+        return path in self.pieces and self.pieces[path][0] == tools.manifest.getSourceChecksum(path)
+
+    def getPhrases(self, sourcePath: os.path) -> dict[str, tuple[int, ...]]:
+        """
+        Retrieves the indexed phrases of a piece.
+        @param sourcePath: Path to the MusicXML file of the piece.
+        @return: Dictionary of phrases as transposed pitch classes (see retrieveAndTransposePhrases) with measure-beat strings as keys.
+        """
+        return self.pieces[os.path.abspath(sourcePath)][1]
+
+    def findCandidates(self,
+                       queryPitchClasses: tuple[int, ...],
+                       countDiffThreshold: float,
+                       sequenceThreshold: float) -> dict[str, set[str]]:
+        """
+        Finds all phrases that could match a query phrase. A phrase can only reach the sequence threshold if few of its pitches differ from the
+        query, and every differing pitch affects at most n of the n-grams at the same positions. Any phrase sharing fewer n-grams with the query
+        than this allows is therefore ruled out without scoring it, so no phrase that would be detected as a match is ever missed.
+        @param queryPitchClasses: The query phrase as transposed pitch classes.
+        @param countDiffThreshold: Threshold for the counting difference evaluation.
+        @param sequenceThreshold: Threshold for the sequence equality evaluation.
+        @return: Dictionary matching the paths of pieces to the set of their candidate phrases.
+        """
+        sharedNgramCounts: dict[tuple[str, str], int] = {}
+        for position in range(len(queryPitchClasses) - self.ngramLength + 1):
+            for candidate in self.postings.get((queryPitchClasses[position:position + self.ngramLength], position), []):
+                sharedNgramCounts[candidate] = sharedNgramCounts.get(candidate, 0) + 1
+
+        outCandidates: dict[str, set[str]] = {}
+        for path, (_, phrases) in self.pieces.items():
+            for phrase, pitchClasses in phrases.items():
+                shorterPhraseLength = min(len(queryPitchClasses), len(pitchClasses))
+                if shorterPhraseLength > 0:
+                    # Rule out phrases exceeding the count difference threshold, using the same calculation as the detection itself
+                    if max(len(queryPitchClasses), len(pitchClasses)) / shorterPhraseLength - 1 > countDiffThreshold:
+                        continue
+                    requiredNgrams = (shorterPhraseLength - self.ngramLength + 1) - self.ngramLength * \
+                        (shorterPhraseLength - _getMinimumEqualCount(shorterPhraseLength, sequenceThreshold))
+                    if sharedNgramCounts.get((path, phrase), 0) < requiredNgrams:
+                        continue
+                if path not in outCandidates:
+                    outCandidates[path] = set()
+                outCandidates[path].add(phrase)
+        return outCandidates
+
+
+def _extractIndexedPhrases(sourcePath: os.path) -> tuple[dict[str, tuple[int, ...]], str]:
+    """
+    Extracts the phrases of a piece for the PhraseIndex. Exceptions are caught and returned, so that a single faulty piece does not end the update
+    of the index.
+    @param sourcePath: Path to the MusicXML file of the piece.
+    @return: A tuple of the phrases as transposed pitch classes with measure-beat strings as keys (or None on failure) and the formatted exception
+    (or None on success).
+    """
+    print("Indexing phrases of " + str(sourcePath))
+    try:
+        phrases = retrieveAndTransposePhrases(sourcePath)
+    except Exception:
+        return None, traceback.format_exc()
+    return {phrase: tuple(phrases[phrase].tolist()) for phrase in phrases}, None
+
+
+def _getMinimumEqualCount(phraseLength: int, sequenceThreshold: float) -> int:
+    # Smallest amount of equal pitches for which the sequence equality (as calculated by the detection) reaches the threshold
+    equalCount = max(0, math.ceil(sequenceThreshold * phraseLength))
+    while equalCount > 0 and (equalCount - 1) / phraseLength >= sequenceThreshold:
+        equalCount -= 1
+    while equalCount <= phraseLength and equalCount / phraseLength < sequenceThreshold:
+        equalCount += 1
+    return equalCount
+
+
+def scorePhrases(sourcePhrase: numpy.ndarray,
+                 targetPhrases: dict[any, numpy.ndarray],
+                 countDiffThreshold: float,
+                 histogramThreshold: float,
+                 sequenceThreshold: float) -> dict[any, dict]:
     """
-    Utility function to convert a numpy histogram to a cv2 compatible histogram.
-    @param npHistogram: The numpy histogram.
-    @return: The numpy histogram for cv2.
+    Scores a batch of target phrases against a source phrase at once. The phrases may belong to a single piece or, using keys that include the
+    piece, to any amount of pieces.
+    @param sourcePhrase: The source phrase as an array of transposed pitch classes (see retrieveAndTransposePhrases).
+    @param targetPhrases: Dictionary of phrases as arrays of transposed pitch classes.
+    @param countDiffThreshold: Threshold for the counting difference evaluation.
+    @param histogramThreshold: Threshold for the pitch histogram evaluation.
+    @param sequenceThreshold: Threshold for the sequence equality evaluation.
+    @return: Dictionary of the detection results of each phrase, with the same keys as the given phrases.
     """
-    counts, bin_edges = npHistogram
-    return counts.ravel().astype('float32')
+    phraseKeys = list(targetPhrases.keys())
+    if len(phraseKeys) == 0:
+        return {}
+
+    # Perform calculation of the count differential
+    sourceLength = len(sourcePhrase)
+    targetLengths = numpy.array([len(targetPhrases[phraseKey]) for phraseKey in phraseKeys], dtype=numpy.int64)
+    shorterPhraseLengths = numpy.minimum(targetLengths, sourceLength)
+    countDiffs = numpy.maximum(targetLengths, sourceLength) / shorterPhraseLengths - 1
+
+    # Only phrases within the count differential threshold are compared any further
+    comparedRows = numpy.flatnonzero(countDiffs <= countDiffThreshold)
+    pitchHistograms = numpy.zeros(len(phraseKeys))
+    sequenceEqualities = numpy.zeros(len(phraseKeys))
+    if len(comparedRows) > 0:
+        # Both phrases are compared up to the length of the shorter one, padding the target phrases with an invalid pitch class
+        comparedLengths = shorterPhraseLengths[comparedRows]
+        maxLength = int(comparedLengths.max())
+        targetMatrix = numpy.full((len(comparedRows), maxLength), -1, dtype=numpy.int64)
+        for row, phraseIndex in enumerate(comparedRows):
+            targetMatrix[row, :comparedLengths[row]] = targetPhrases[phraseKeys[phraseIndex]][:comparedLengths[row]]
+        bIsCompared = numpy.arange(maxLength)[numpy.newaxis, :] < comparedLengths[:, numpy.newaxis]
+
+        # Perform calculation of the pitch histograms, the source histogram of each row being taken from the cumulative source histogram
+        baseValue = IntegerPitchEncoding40.baseValue
+        rowOffsets = numpy.repeat(numpy.arange(len(comparedRows)) * baseValue, comparedLengths)
+        targetHistograms = numpy.bincount(rowOffsets + targetMatrix[bIsCompared], minlength=len(comparedRows) * baseValue) \
+            .reshape(len(comparedRows), baseValue).astype(numpy.float64)
+        cumulativeSourceHistograms = numpy.cumsum(numpy.eye(baseValue)[sourcePhrase[:maxLength]], axis=0)
+        sourceHistograms = cumulativeSourceHistograms[comparedLengths - 1]
+        pitchHistograms[comparedRows] = 1 - compareHistogramsBhattacharyya(sourceHistograms, targetHistograms)
+
+        # Perform calculation of the sequence equality
+        sequenceEqualityCounts = numpy.count_nonzero((targetMatrix == sourcePhrase[numpy.newaxis, :maxLength]) & bIsCompared, axis=1)
+        sequenceEqualities[comparedRows] = sequenceEqualityCounts / comparedLengths
+
+    # Determine whether each phrase is a match based on given thresholds
+    bIsMatch = (countDiffs <= countDiffThreshold) & \
+        (pitchHistograms >= histogramThreshold) & (sequenceEqualities >= sequenceThreshold)
+
+    outDetectionResults = {}
+    for phraseIndex, phraseKey in enumerate(phraseKeys):
+        detectionResult = {"isMatch": 0, "countDiff": float(countDiffs[phraseIndex]), "pitchHistogram": 0, "sequenceEquality": 0}
+        if countDiffs[phraseIndex] <= countDiffThreshold:
+            detectionResult["pitchHistogram"] = float(pitchHistograms[phraseIndex])
+            detectionResult["sequenceEquality"] = float(sequenceEqualities[phraseIndex])
+            detectionResult["isMatch"] = 1 if bIsMatch[phraseIndex] else 0
+        outDetectionResults[phraseKey] = detectionResult
+    return outDetectionResults
 
 
 class PhraseDetector(analysis.AnalysisMethod):
@@ -113,159 +434,243 @@ class PhraseDetector(analysis.AnalysisMethod):
                  pathToSourcePhrase: os.path,
                  countDiffThreshold: float,
                  histogramThreshold: float,
-                 sequenceThreshold: float):
+                 sequenceThreshold: float,
+                 phraseIndex: PhraseIndex = None):
         """
         This class has a few custom parameters to demonstrate how we can tweak the way an analysis is performed.
         @param pathToSourcePhrase: Path to the file containing the source phrase.
         @param countDiffThreshold: Threshold for the counting difference evaluation.
         @param histogramThreshold: Threshold for the pitch histogram evaluation.
         @param sequenceThreshold: Threshold for the sequence equality evaluation.
+        @param phraseIndex: Optional PhraseIndex of the corpus. If given, only the candidate phrases found in the index are scored and the
+        detection results only contain these phrases.
         """
         super().__init__()
         self.sourceFilePath: os.path = pathToSourcePhrase
-        self.__sourcePhrase = self.__retrieveAndTransposePhrases(pathToSourcePhrase, 1)["1, 1.0"]  # Pre-process the source phrase into source pitches once
+        self.__sourcePhrase = retrieveAndTransposePhrases(pathToSourcePhrase, 1)["1, 1.0"]  # Pre-process the source phrase into source pitches once
         self.countDiffThreshold: float = countDiffThreshold
         self.histogramThreshold: float = histogramThreshold
         self.sequenceThreshold: float = sequenceThreshold
+        self.phraseIndex: PhraseIndex = phraseIndex
+        self.__candidates: dict[str, set[str]] = None
 
-    @staticmethod
-    def __retrieveAndTransposePhrases(filePath: os.path, maxSearch: int = 0):
+    def scorePhrases(self, targetPhrases: dict[any, numpy.ndarray]) -> dict[any, dict]:
         """
-        Utility to retrieve and transpose all phrases from a given file path.
-        @param filePath: Path to the file to retrieve the phrases from.
-        @param maxSearch: The maximum amount of phrases to retrieve.
-        @return: A dictionary of phrases as transposed music21 pitches with measure-beat strings as keys.
+        Scores a batch of target phrases against the source phrase at once (see scorePhrases).
+        @param targetPhrases: Dictionary of phrases as arrays of transposed pitch classes (see retrieveAndTransposePhrases).
+        @return: Dictionary of the detection results of each phrase, with the same keys as the given phrases.
         """
-        score, measureMap = tools.parsing.parsePieceByPath(filePath, False)
-        melodyPart = tools.parsing.getPartStreamFromScoreStream(score, 0)
-
-        bHasFermata = lambda n: \
-            True if (hasattr(n, 'expressions') and n.expressions and any(isinstance(e, music21.expressions.Fermata) for e in n.expressions)) else False
-        melodyFermatas = melodyPart.recurse().notes
+        return scorePhrases(self.__sourcePhrase, targetPhrases, self.countDiffThreshold, self.histogramThreshold, self.sequenceThreshold)
 
-        notePhraseMap = {}
-        noteValueMap = {}
-        phraseNumber = "1, 1.0"
-        keySignature = None
-        for note in melodyFermatas:
-            if keySignature is None:
-                keySignature = note.getContextByClass('KeySignature').asKey()
-            if note.duration.quarterLength not in noteValueMap:
-                noteValueMap[note.duration.quarterLength] = 0
-
-            noteValueMap[note.duration.quarterLength] += 1
-
-            if phraseNumber not in notePhraseMap:
-                notePhraseMap[phraseNumber] = []
-
-            if maxSearch == 0 or len(notePhraseMap.keys()) <= maxSearch:
-                notePhraseMap[phraseNumber].append(note)
-
-            if bHasFermata(note):
-                phraseNumber = makeMeasureAndBeatStringByMeasureMap(note.next('Note') if note.next('Note') is not None else note, measureMap)
-
-        mainNoteValue = max(noteValueMap, key=noteValueMap.get)
-
-        transposedPhrases = {}
-        for phrase in notePhraseMap:
-            for note in notePhraseMap[phrase]:
-                if not note.offset % mainNoteValue == 0.0:
-                    continue
-
-                encodedNote = IntegerPitchEncoding40.encodeMusic21Pitch(note.pitch)
-
-                if phrase not in transposedPhrases:
-                    transposedPhrases[phrase] = []
+    def analyze(self, filePath: os.path):
+        # Retrieve the transposed phrases for the target, using only the candidate phrases from the index if the piece is indexed
+        if self.phraseIndex is not None and self.phraseIndex.containsPiece(filePath):
+            if self.__candidates is None:
+                self.__candidates = self.phraseIndex.findCandidates(tuple(self.__sourcePhrase.tolist()),
+                                                                    self.countDiffThreshold,
+                                                                    self.sequenceThreshold)
+            indexedPhrases = self.phraseIndex.getPhrases(filePath)
+            targetPhrases = {phrase: numpy.array(indexedPhrases[phrase], dtype=numpy.int64)
+                             for phrase in indexedPhrases if phrase in self.__candidates.get(os.path.abspath(filePath), set())}
+        else:
+            targetPhrases = retrieveAndTransposePhrases(filePath)
 
-                transposedPhrases[phrase].append(IntegerPitchEncoding40.decodeToMusic21Pitch(transposeIntPitchToNoAlterations(encodedNote, keySignature)))
+        outMatches = None
+        outDetectionResults = self.scorePhrases(targetPhrases)
 
-        return transposedPhrases
+        for phrase in outDetectionResults:
+            if outDetectionResults[phrase]['isMatch'] == 1:
+                outMatches = [phrase] if outMatches is None else outMatches + [phrase]
 
-    def __performDetection(self, targetPhrase: list[music21.pitch.Pitch]):
-        # Initialize the results
-        detectionResult = {"isMatch": 0, "countDiff": 0, "pitchHistogram": 0, "sequenceEquality": 0}
+        return [outMatches, outDetectionResults]
 
-        # Perform calculation of the count differential
-        comp_CountDiff = max(len(self.__sourcePhrase), len(targetPhrase)) / min(len(self.__sourcePhrase), len(targetPhrase)) - 1
+    def getOutputHeader(self):
+        return ["Phrase Matches", "Detection Results per Phrase"]
 
-        detectionResult["countDiff"] = comp_CountDiff
-        if comp_CountDiff > self.countDiffThreshold:
-            return detectionResult
+    def getResultColumns(self):
+        return [("position", "TEXT"), ("measure", "TEXT"), ("beat", "REAL"), ("isMatch", "INTEGER"), ("countDiff", "REAL"),
+                ("pitchHistogram", "REAL"), ("sequenceEquality", "REAL")]
 
-        # Perform calculation of the pitch histograms
-        encodedSourcePitches = list(map(lambda x: IntegerPitchEncoding40.encodeMusic21Pitch(x), self.__sourcePhrase))
-        encodedTargetPitches = list(map(lambda x: IntegerPitchEncoding40.encodeMusic21Pitch(x), targetPhrase))
+    def createResultRows(self, resultData):
+        # One row per scored phrase of the piece, identified by the position of its first note
+        detectionResults = resultData[1]
+        return [(phrase,) + splitMeasureAndBeatString(phrase) +
+                (detectionResults[phrase]["isMatch"], detectionResults[phrase]["countDiff"], detectionResults[phrase]["pitchHistogram"],
+                 detectionResults[phrase]["sequenceEquality"]) for phrase in detectionResults]
 
-        shorterPhraseLength = min(len(self.__sourcePhrase), len(targetPhrase))
+    def getIndexedResultColumns(self):
+        return ["position"]
 
-        sourcePitchHistogram = npHistogramToCV(numpy.histogram(encodedSourcePitches[:shorterPhraseLength], bins=499, range=(0, 499)))
-        targetPitchHistogram = npHistogramToCV(numpy.histogram(encodedTargetPitches[:shorterPhraseLength], bins=499, range=(0, 499)))
+    def getFingerprint(self):
+        # The results depend on the contents of the file containing the source phrase, not just on its path, and on whether the index is used
+        return super().getFingerprint() + ":" + tools.manifest.getSourceChecksum(self.sourceFilePath) + \
+            (":indexed" if self.phraseIndex is not None else "")
 
-        detectionResult["pitchHistogram"] = 1 - cv2.compareHist(sourcePitchHistogram, targetPitchHistogram, cv2.HISTCMP_BHATTACHARYYA)
 
-        # Perform calculation of the sequence equality
-        sourcePitchNames = list(map(lambda x: x.name, self.__sourcePhrase))
-        targetPitchNames = list(map(lambda x: x.name, targetPhrase))
+class MultiPhraseDetector(analysis.AnalysisMethod):
+    """
+    Analysis method used as a tool to locate several phrases inside the contents of a corpus in a single pass. Every phrase of a piece is scored
+    against all source phrases, resulting in a matrix of matches between source phrases and the phrases of the piece.
+    """
 
-        comp_SeqEqualityCount = 0
-        for k in range(shorterPhraseLength):
-            if sourcePitchNames[k] == targetPitchNames[k]:
-                comp_SeqEqualityCount += 1
+    def __init__(self,
+                 pathsToSourcePhrases: list[os.path],
+                 countDiffThreshold: float,
+                 histogramThreshold: float,
+                 sequenceThreshold: float,
+                 bShouldUseAllPhrases: bool = False,
+                 phraseIndex: PhraseIndex = None):
+        """
+        @param pathsToSourcePhrases: Paths to the files containing the source phrases.
+        @param countDiffThreshold: Threshold for the counting difference evaluation.
+        @param histogramThreshold: Threshold for the pitch histogram evaluation.
+        @param sequenceThreshold: Threshold for the sequence equality evaluation.
+        @param bShouldUseAllPhrases: Whether every phrase of the given files should be used as a source phrase, instead of only the first one.
+        @param phraseIndex: Optional PhraseIndex of the corpus. If given, only the candidate phrases found in the index are scored.
+        """
+        super().__init__()
+        self.sourceFilePaths: list[os.path] = pathsToSourcePhrases
+        self.countDiffThreshold: float = countDiffThreshold
+        self.histogramThreshold: float = histogramThreshold
+        self.sequenceThreshold: float = sequenceThreshold
+        self.bShouldUseAllPhrases: bool = bShouldUseAllPhrases
+        self.phraseIndex: PhraseIndex = phraseIndex
+        self.__candidates: list[dict[str, set[str]]] = None
+
+        # Pre-process the source phrases into source pitches once, naming each of them by its file and measure-beat string
+        self.sourcePhraseNames: list[str] = []
+        self.__sourcePhrases: list[numpy.ndarray] = []
+        for sourceFilePath in pathsToSourcePhrases:
+            phrases = retrieveAndTransposePhrases(sourceFilePath, 0 if bShouldUseAllPhrases else 1)
+            for phrase in (phrases if bShouldUseAllPhrases else ["1, 1.0"]):
+                self.sourcePhraseNames.append(os.path.splitext(os.path.basename(sourceFilePath))[0] + ", " + phrase)
+                self.__sourcePhrases.append(phrases[phrase])
 
-        detectionResult["sequenceEquality"] = comp_SeqEqualityCount / shorterPhraseLength
+    def analyze(self, filePath: os.path):
+        # Retrieve the transposed phrases for the target, determining the candidate phrases of each source phrase if the piece is indexed
+        candidatesPerSourcePhrase = None
+        if self.phraseIndex is not None and self.phraseIndex.containsPiece(filePath):
+            if self.__candidates is None:
+                self.__candidates = [self.phraseIndex.findCandidates(tuple(sourcePhrase.tolist()), self.countDiffThreshold, self.sequenceThreshold)
+                                     for sourcePhrase in self.__sourcePhrases]
+            candidatesPerSourcePhrase = [candidates.get(os.path.abspath(filePath), set()) for candidates in self.__candidates]
+            indexedPhrases = self.phraseIndex.getPhrases(filePath)
+            targetPhrases = {phrase: numpy.array(indexedPhrases[phrase], dtype=numpy.int64) for phrase in indexedPhrases}
+        else:
+            targetPhrases = retrieveAndTransposePhrases(filePath)
+
+        # Score the target phrases against all source phrases, phrases ruled out by the index never being a match
+        targetPhraseNames = list(targetPhrases.keys())
+        outMatches = None
+        outMatchMatrix = []
+        for i, sourcePhrase in enumerate(self.__sourcePhrases):
+            phrasesToScore = targetPhrases if candidatesPerSourcePhrase is None else \
+                {phrase: targetPhrases[phrase] for phrase in targetPhrases if phrase in candidatesPerSourcePhrase[i]}
+            detectionResults = scorePhrases(sourcePhrase, phrasesToScore, self.countDiffThreshold, self.histogramThreshold, self.sequenceThreshold)
+            outMatchMatrix.append([detectionResults[phrase]["isMatch"] if phrase in detectionResults else 0 for phrase in targetPhraseNames])
 
-        # Determine whether it is a match based on given thresholds
-        bIsMatch = detectionResult["pitchHistogram"] >= self.histogramThreshold and detectionResult["sequenceEquality"] >= self.sequenceThreshold
-        detectionResult["isMatch"] = 1 if bIsMatch else 0
+            matchingPhrases = [phrase for phrase in targetPhraseNames if phrase in detectionResults and detectionResults[phrase]["isMatch"] == 1]
+            if len(matchingPhrases) > 0:
+                if outMatches is None:
+                    outMatches = {}
+                outMatches[self.sourcePhraseNames[i]] = matchingPhrases
 
-        return detectionResult
+        return [outMatches, targetPhraseNames, outMatchMatrix]
 
-    def analyze(self, filePath: os.path):
-        # Retrieve the transposed phrases for the target
-        targetPhrases = self.__retrieveAndTransposePhrases(filePath)
+    def getOutputHeader(self):
+        return ["Phrase Matches per Source Phrase", "Target Phrases", "Match Matrix (Source Phrases x Target Phrases)"]
 
-        outMatches = None
-        outDetectionResults = {}
+    def getResultColumns(self):
+        return [("sourcePhrase", "TEXT"), ("position", "TEXT"), ("measure", "TEXT"), ("beat", "REAL"), ("isMatch", "INTEGER")]
 
-        for phrase in targetPhrases:
-            outDetectionResults[phrase] = self.__performDetection(targetPhrases[phrase])
-            if outDetectionResults[phrase]['isMatch'] == 1:
-                outMatches = [phrase] if outMatches is None else outMatches + [phrase]
+    def createResultRows(self, resultData):
+        # One row per cell of the match matrix, target phrases being identified by the position of their first note
+        _, targetPhraseNames, matchMatrix = resultData
+        return [(sourcePhraseName, phrase) + splitMeasureAndBeatString(phrase) + (bIsMatch,)
+                for sourcePhraseName, matchRow in zip(self.sourcePhraseNames, matchMatrix)
+                for phrase, bIsMatch in zip(targetPhraseNames, matchRow)]
 
-        return [outMatches, outDetectionResults]
+    def getIndexedResultColumns(self):
+        return ["position", "sourcePhrase"]
 
-    def getOutputHeader(self):
-        return ["Phrase Matches", "Detection Results per Phrase"]
+    def getFingerprint(self):
+        # The results depend on the contents of the files containing the source phrases, not just on their paths
+        return super().getFingerprint() + ":" + repr(self.sourceFilePaths) + ":" + \
+            ",".join(tools.manifest.getSourceChecksum(sourceFilePath) for sourceFilePath in self.sourceFilePaths) + \
+            (":indexed" if self.phraseIndex is not None else "")
 
 
 if __name__ == '__main__':
+    # Usage: Tools-PhraseDetection.py [corpus name] [resume]
     corpusName = sys.argv[1] if len(sys.argv) > 1 else ""
+    bShouldResume = len(sys.argv) > 2 and sys.argv[2] == "resume"
 
-    # The path to the file containing the phrase we would like to detect
-    pathToPhrase = ""
-    while not os.path.isfile(pathToPhrase):
-        pathToPhrase = input("Path to file containing phrase to detect (or 'q' to exit): ")
-        if pathToPhrase == "q":
+    # The paths to the files containing the phrases we would like to detect, separated by semicolons
+    pathsToPhrases = []
+    while len(pathsToPhrases) == 0 or not all(os.path.isfile(path) for path in pathsToPhrases):
+        pathsInput = input("Path(s) to file(s) containing phrase to detect, separated by ';' (or 'q' to exit): ")
+        if pathsInput == "q":
             exit()
+        pathsToPhrases = [path.strip() for path in pathsInput.split(";") if path.strip() != ""]
+    bShouldUseAllPhrases = input("Detect every phrase of the given file(s) instead of only the first one? (y/n): ").lower() == "y"
 
     outputName = "PhraseDetection"
-    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"])
-    catalogues, results = analysis.procedures.analyseCatalogueCorpus(corpusName, PhraseDetector(pathToPhrase, 0.25, 0.5, 0.7), True, outputName, params)
+    # Results are journaled as the run progresses, so an interrupted run can be continued by passing 'resume' and the same phrases
+    params = analysis.procedures.AnalysisProcedureParams(cataloguesToIgnore=["AP1832"], bUseResultCache=True, journalPath=outputName + ".journal",
+                                                         bShouldResume=bShouldResume)
 
-    # Here we demonstrate how the results can be processed further by calculating values across the entire catalogues
+    # Bring the phrase index up to date with the pieces of the run, so that only candidate phrases have to be scored
+    phraseIndex = PhraseIndex(corpusName)
+    phraseIndex.updateFromCorpus(params.cataloguesToIgnore, params.workerCount)
     timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-    fileName = os.path.splitext(outputName)[0] + "_" + timestamp + "_AllMatches.csv"
-    file = open(fileName, 'w')
-    csvWriter = csv.writer(file)
-
-    header = ["Catalogue and Piece ID", "Matches", "Detailed Results"]
-    csvWriter.writerow(header)
 
-    for catalogue in catalogues.keys():
-        for pieceId in results[catalogue].keys():
-            if results[catalogue][pieceId].resultData[0] is not None:
+    if len(pathsToPhrases) == 1 and not bShouldUseAllPhrases:
+        catalogues, results = analysis.procedures.analyseCatalogueCorpus(corpusName, PhraseDetector(pathsToPhrases[0], 0.25, 0.5, 0.7, phraseIndex),
+                                                                         True, outputName, params)
+
+        # Here we demonstrate how the results can be processed further by calculating values across the entire catalogues
+        fileName = os.path.splitext(outputName)[0] + "_" + timestamp + "_AllMatches.csv"
+        file = open(fileName, 'w')
+        csvWriter = csv.writer(file)
+
+        header = ["Catalogue and Piece ID", "Matches", "Detailed Results"]
+        csvWriter.writerow(header)
+
+        for catalogue in catalogues.keys():
+            for pieceId in results[catalogue].keys():
+                if results[catalogue][pieceId].resultData[0] is not None:
+                    resultData = results[catalogue][pieceId].resultData
+                    line = [catalogue + ", " + pieceId, resultData[0], resultData[1]]
+                    csvWriter.writerow(line)
+
+        file.close()
+    else:
+        detector = MultiPhraseDetector(pathsToPhrases, 0.25, 0.5, 0.7, bShouldUseAllPhrases, phraseIndex)
+        catalogues, results = analysis.procedures.analyseCatalogueCorpus(corpusName, detector, True, outputName, params)
+
+        # Combine the match matrices of all pieces into a single matrix of source phrases and target phrases with at least one match
+        targetColumns = []
+        matchColumns = []
+        for catalogue in catalogues.keys():
+            for pieceId in results[catalogue].keys():
                 resultData = results[catalogue][pieceId].resultData
-                line = [catalogue + ", " + pieceId, resultData[0], resultData[1]]
-                csvWriter.writerow(line)
+                if resultData[0] is None:
+                    continue
+                for j, targetPhrase in enumerate(resultData[1]):
+                    matchColumn = [matchRow[j] for matchRow in resultData[2]]
+                    if any(matchColumn):
+                        targetColumns.append(catalogue + ", " + pieceId + ", " + targetPhrase)
+                        matchColumns.append(matchColumn)
+
+        fileName = os.path.splitext(outputName)[0] + "_" + timestamp + "_MatchMatrix.csv"
+        file = open(fileName, 'w')
+        csvWriter = csv.writer(file)
+
+        header = ["Source Phrase"] + targetColumns
+        csvWriter.writerow(header)
+
+        for i, sourcePhraseName in enumerate(detector.sourcePhraseNames):
+            line = [sourcePhraseName] + [matchColumn[i] for matchColumn in matchColumns]
+            csvWriter.writerow(line)
 
-    file.close()
+        file.close()
@@ -3,6 +3,8 @@ Test of the Computer-Assisted Musicology module MusiCAU, commissioned by the
 Institute of Musicology at the University of Kiel.
 """
 
+import importlib
+import importlib.util
 import sys
 
 minPythonVersion = (3, 10)
@@ -11,7 +13,6 @@ if sys.version_info < minPythonVersion:
     raise ImportError('''
     MusiCAU v.0.1+ is a Python {}+ only library.
     '''.format(minPythonVersionStr))
-del sys
 del minPythonVersion
 del minPythonVersionStr
 
@@ -24,4 +25,34 @@ __all__ = [
     'tools'
 ]
 
-from musicau import *
+
+def __getattr__(name: str):
+    # Subpackages are only imported on first access (PEP 562), so that importing musicau does not import music21 and its dependencies
+    if name in __all__:
+        return importlib.import_module(__name__ + "." + name)
+    raise AttributeError("module '" + __name__ + "' has no attribute '" + name + "'")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+def importLazily(moduleName: str):
+    """
+    Imports a module that is only loaded once one of its attributes is first accessed, for heavy dependencies that are not needed by every run
+    of a script. Note that using the module in annotations of functions or classes accesses its attributes when they are defined.
+    @param moduleName: Name of the module (i.e. 'numpy').
+    @return: The module, which is loaded on first use.
+    @raise: ImportError if the module cannot be found
+    """
+    if moduleName in sys.modules:
+        return sys.modules[moduleName]
+    moduleSpec = importlib.util.find_spec(moduleName)
+    if moduleSpec is None:
+        raise ImportError("No module named '" + moduleName + "'")
+    moduleLoader = importlib.util.LazyLoader(moduleSpec.loader)
+    moduleSpec.loader = moduleLoader
+    outModule = importlib.util.module_from_spec(moduleSpec)
+    sys.modules[moduleName] = outModule
+    moduleLoader.exec_module(outModule)
+    return outModule
@@ -2,6 +2,7 @@
 MusiCAU analyis module. Provides the backbone for automated analysis.
 '''
 
+import importlib
 import os.path
 
 
@@ -9,6 +10,9 @@ class AnalysisMethod:
     """
     Abstract class that defines the framework of how analysis methods are to be constructed and interacted with.
     """
+    # Version of the analysis method. Increase this whenever a change to the method alters its results, so that stored results are not reused.
+    version: int = 1
+
     def __init__(self):
         pass
 
@@ -35,6 +39,42 @@ class AnalysisMethod:
         """
         return resultData
 
+    def getResultColumns(self) -> list[tuple[str, str]]:
+        """
+        Method to receive the columns of the table the results are stored in when writing them to a database (see ResultDatabase). Every row is
+        stored along with the catalogue ID, piece number and specifiers of its piece, which must not be used as column names.
+        @return: List of tuples of the column name and its SQLite type ('TEXT', 'INTEGER' or 'REAL').
+        """
+        return [("resultData", "TEXT")]
+
+    def createResultRows(self, resultData: list[any]) -> list[tuple]:
+        """
+        Method to generate the rows of the database table based on given results. Unlike the CSV output, a piece may produce any number of rows,
+        i.e. one per match.
+        @param resultData: The result data from the AnalysisResult of a given piece.
+        @return: List of rows, each a tuple containing one value per column of getResultColumns.
+        """
+        return [(str(resultData),)]
+
+    def getIndexedResultColumns(self) -> list[str]:
+        """
+        Method to receive the columns of the database table to be indexed, in addition to the catalogue ID, piece number and specifiers, to speed
+        up joins with the results of other analysis methods (i.e. on the position).
+        @return: List of column names.
+        """
+        return []
+
+    def getFingerprint(self) -> str:
+        """
+        Method to receive a fingerprint of the analysis method, used to decide whether stored results of the method can be reused. By default,
+        the fingerprint consists of the class name, the version and all public attributes of simple types. Override this method if the results
+        depend on anything else, such as the contents of additional files.
+        @return: String identifying the method and all parameters that influence its results.
+        """
+        parameters = sorted((name, value) for name, value in vars(self).items()
+                            if not name.startswith("_") and isinstance(value, (bool, int, float, str, type(None))))
+        return self.__class__.__qualname__ + ":" + str(self.version) + ":" + repr(parameters)
+
 
 class AnalysisResult:
     """
@@ -63,8 +103,18 @@ class AnalysisResult:
 
 __all__ = [
     'actions',
+    'features',
+    'patterns',
     'procedures',
 ]
 
 
-from musicau.analysis import *
+def __getattr__(name: str):
+    # Submodules are only imported on first access (PEP 562), see musicau.__getattr__
+    if name in __all__:
+        return importlib.import_module(__name__ + "." + name)
+    raise AttributeError("module '" + __name__ + "' has no attribute '" + name + "'")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,6 +1,297 @@
 import music21
 
+from music21.common import opFrac
+
+from bisect import bisect_left, bisect_right
+from fractions import Fraction
 from typing import Callable
+import math
+
+
+class PartOffsetIndex:
+    """
+    Index of all notes in a part by their offset from the beginning of the part. Allows lookups of notes at a given offset without scanning the
+    entire part every time.
+    """
+    def __init__(self, partStream: music21.stream.Part):
+        """
+        @param partStream: The music21 Part stream to index.
+        """
+        self.notesByOffset: dict[float, list[music21.note.Note]] = {}
+        self.offsetsByNoteId: dict[int, float] = {}
+        streamIterator = partStream.recurse().notes
+        for note in streamIterator:
+            offset = streamIterator.currentHierarchyOffset()
+            if offset not in self.notesByOffset:
+                self.notesByOffset[offset] = []
+            self.notesByOffset[offset].append(note)
+            self.offsetsByNoteId[id(note)] = offset
+
+    def getNotesAtOffset(self, offset: float) -> list[music21.note.Note]:
+        """
+        Retrieves all notes starting at a given offset in the order in which they appear in the part.
+        @param offset: The offset from the beginning of the part.
+        @return: List of notes at the offset, empty if there are none.
+        """
+        return self.notesByOffset.get(offset, [])
+
+    def getOffsetOfNote(self, note: music21.note.Note) -> float:
+        """
+        Retrieves the offset of a note from the beginning of the part.
+        @param note: The note, which must be part of the indexed part.
+        @return: The offset of the note, or None if the note is not part of the indexed part.
+        """
+        return self.offsetsByNoteId.get(id(note))
+
+
+def getPartOffsetIndex(partStream: music21.stream.Part) -> PartOffsetIndex:
+    """
+    Retrieves the offset index of a part, building it on first use. The index is stored in the cache of the part stream, which music21 clears
+    whenever the contents of the part change, so a stale index is never returned.
+    @param partStream: The music21 Part stream to retrieve the index for.
+    @return: The PartOffsetIndex of the part.
+    """
+    offsetIndex = partStream._cache.get('musicau.partOffsetIndex')
+    if offsetIndex is None:
+        offsetIndex = PartOffsetIndex(partStream)
+        partStream._cache['musicau.partOffsetIndex'] = offsetIndex
+    return offsetIndex
+
+
+class MeasureTimeline:
+    """
+    Sorted form of a measure map along with the time signatures and padding of each measure. Allows lookups of the measure and beat at a given
+    offset using a binary search, without walking the context of any music21 element.
+    """
+    def __init__(self, partStream: music21.stream.Part, measureMap: dict[float, str]):
+        """
+        @param partStream: The music21 Part stream to take the time signatures and padding of the measures from.
+        @param measureMap: The measure map of the piece, as returned by parsing.parsePieceByPath.
+        """
+        self.measureOffsets: list[float] = sorted(measureMap.keys())
+        self.measureLabels: list[str] = [measureMap[offset] for offset in self.measureOffsets]
+        self.measurePaddings: list[float] = [0.0] * len(self.measureOffsets)
+        # Time signatures in effect within each measure as tuples of the offset within the measure, the time signature and its offset within the
+        # measure it is placed in. The first entry of a measure may be carried over from a previous measure.
+        self.timeSignatures: list[list[tuple[float, music21.meter.TimeSignature, float]]] = [[] for _ in self.measureOffsets]
+
+        measureIndicesByOffset = {offset: i for i, offset in enumerate(self.measureOffsets)}
+        currentTimeSignature = None
+        for measure in partStream.getElementsByClass('Measure'):
+            measureTimeSignatures = [] if currentTimeSignature is None else [(float('-inf'), currentTimeSignature[0], currentTimeSignature[1])]
+            for timeSignature in measure.getElementsByClass('TimeSignature'):
+                timeSignatureOffset = measure.elementOffset(timeSignature)
+                measureTimeSignatures.append((timeSignatureOffset, timeSignature, timeSignatureOffset))
+                currentTimeSignature = (timeSignature, timeSignatureOffset)
+
+            measureIndex = measureIndicesByOffset.get(measure.offset)
+            if measureIndex is not None:
+                self.measurePaddings[measureIndex] = measure.paddingLeft
+                self.timeSignatures[measureIndex] = measureTimeSignatures
+
+    def getMeasureIndexAtOffset(self, offset: float) -> int:
+        """
+        Retrieves the index of the measure containing a given offset.
+        @param offset: The offset from the beginning of the piece.
+        @return: The index of the measure, or -1 if the offset is before the first measure.
+        """
+        return bisect_right(self.measureOffsets, offset) - 1
+
+    def getMeasureLabelAtOffset(self, offset: float) -> str:
+        """
+        Retrieves the label of the measure containing a given offset, as it appears in the measure map.
+        @param offset: The offset from the beginning of the piece.
+        @return: The label of the measure.
+        @raise: KeyError if the offset is before the first measure
+        """
+        measureIndex = self.getMeasureIndexAtOffset(offset)
+        if measureIndex < 0:
+            raise KeyError(offset)
+        return self.measureLabels[measureIndex]
+
+    def getBeatAtOffset(self, offset: float, bShouldIncludePadding: bool = True) -> float:
+        """
+        Retrieves the beat at a given offset, calculated the same way as music21 calculates the beat of a note placed in a measure.
+        @param offset: The offset from the beginning of the piece.
+        @param bShouldIncludePadding: Whether the padding of pickup measures is taken into account. music21 ignores the padding for notes
+        placed within voices.
+        @return: The beat as a float or Fraction, or nan if there is no time signature in effect.
+        """
+        measureIndex = self.getMeasureIndexAtOffset(offset)
+        if measureIndex < 0:
+            return float('nan')
+        offsetInMeasure = opFrac(offset - self.measureOffsets[measureIndex])
+        timeSignatures = self.timeSignatures[measureIndex]
+        timeSignatureIndex = bisect_right([entry[0] for entry in timeSignatures], offsetInMeasure) - 1
+        if timeSignatureIndex < 0:
+            return float('nan')
+
+        _, timeSignature, timeSignatureOffset = timeSignatures[timeSignatureIndex]
+        if bShouldIncludePadding and self.measurePaddings[measureIndex]:
+            offsetInMeasure = opFrac(offsetInMeasure + self.measurePaddings[measureIndex])
+        if opFrac(offsetInMeasure + timeSignatureOffset) >= timeSignature.barDuration.quarterLength:
+            offsetInMeasure = opFrac((offsetInMeasure - timeSignatureOffset) % timeSignature.barDuration.quarterLength)
+        return timeSignature.getBeatProportion(offsetInMeasure)
+
+    def makeMeasureAndBeatString(self, offset: float, bShouldIncludePadding: bool = True) -> str:
+        """
+        Makes a string containing the measure and beat at a given offset, equivalent to makeMeasureAndBeatStringByMeasureMap.
+        @param offset: The offset from the beginning of the piece.
+        @param bShouldIncludePadding: Whether the padding of pickup measures is taken into account (see getBeatAtOffset).
+        @return: String in the format '[measure], [beat]'
+        """
+        return str(self.getMeasureLabelAtOffset(offset)) + ", " + str(self.getBeatAtOffset(offset, bShouldIncludePadding))
+
+
+def getMeasureTimeline(partStream: music21.stream.Part, measureMap: dict[float, str]) -> MeasureTimeline:
+    """
+    Retrieves the measure timeline of a part, building it on first use. Like the offset index, the timeline is stored in the cache of the part
+    stream.
+    @param partStream: The music21 Part stream to retrieve the timeline for.
+    @param measureMap: The measure map of the piece, as returned by parsing.parsePieceByPath.
+    @return: The MeasureTimeline of the part.
+    """
+    cachedTimeline = partStream._cache.get('musicau.measureTimeline')
+    if cachedTimeline is None or cachedTimeline[0] is not measureMap:
+        cachedTimeline = (measureMap, MeasureTimeline(partStream, measureMap))
+        partStream._cache['musicau.measureTimeline'] = cachedTimeline
+    return cachedTimeline[1]
+
+
+def hasFermata(element: music21.base.Music21Object) -> bool:
+    """
+    Checks whether an element possesses an expression of type Fermata, which marks a closure.
+    @param element: The element to check.
+    @return: True if the element has a fermata, otherwise False.
+    """
+    return hasattr(element, 'expressions') and bool(element.expressions) and \
+        any(isinstance(e, music21.expressions.Fermata) for e in element.expressions)
+
+
+class ClosureIndex:
+    """
+    Index of the closures (notes with fermatas) in a part and the phrases they delimit.
+    """
+    def __init__(self, partStream: music21.stream.Part):
+        """
+        @param partStream: The music21 Part stream to index, usually the melody part.
+        """
+        offsetIndex = getPartOffsetIndex(partStream)
+        self.closureNotes: list[music21.note.Note] = [note for note in partStream.recurse().notes if hasFermata(note)]
+        self.closureOffsets: list[float] = sorted({offsetIndex.getOffsetOfNote(note) for note in self.closureNotes})
+        self.closureOffsetSet: set[float] = set(self.closureOffsets)
+
+        # Each phrase starts at the first note of the part or the first note after a closure and ends with the next closure or the last note
+        self.phraseBoundaries: list[tuple[float, float]] = []
+        noteOffsets = sorted(offsetIndex.notesByOffset.keys())
+        if len(noteOffsets) > 0:
+            phraseStartIndex = 0
+            for closureOffset in self.closureOffsets:
+                if closureOffset < noteOffsets[phraseStartIndex]:
+                    continue
+                self.phraseBoundaries.append((noteOffsets[phraseStartIndex], closureOffset))
+                phraseStartIndex = bisect_right(noteOffsets, closureOffset)
+                if phraseStartIndex >= len(noteOffsets):
+                    break
+            if phraseStartIndex < len(noteOffsets):
+                self.phraseBoundaries.append((noteOffsets[phraseStartIndex], noteOffsets[-1]))
+        self.__phraseStartOffsets = [boundaries[0] for boundaries in self.phraseBoundaries]
+
+    def isClosureAtOffset(self, offset: float) -> bool:
+        """
+        Checks whether a closure is placed at a given offset.
+        @param offset: The offset from the beginning of the part.
+        @return: True if a note with a fermata starts at the offset, otherwise False.
+        """
+        return offset in self.closureOffsetSet
+
+    def getPhraseIndexAtOffset(self, offset: float) -> int:
+        """
+        Retrieves the index of the phrase containing a given offset.
+        @param offset: The offset from the beginning of the part.
+        @return: The index of the phrase within the phrase boundaries, or -1 if the offset is before the first phrase.
+        """
+        return bisect_right(self.__phraseStartOffsets, offset) - 1
+
+
+def getClosureIndex(partStream: music21.stream.Part) -> ClosureIndex:
+    """
+    Retrieves the closure index of a part, building it on first use. Like the offset index, the closure index is stored in the cache of the part
+    stream, so all analysis methods working on the same parsed piece share it.
+    @param partStream: The music21 Part stream to retrieve the closure index for, usually the melody part.
+    @return: The ClosureIndex of the part.
+    """
+    closureIndex = partStream._cache.get('musicau.closureIndex')
+    if closureIndex is None:
+        closureIndex = ClosureIndex(partStream)
+        partStream._cache['musicau.closureIndex'] = closureIndex
+    return closureIndex
+
+
+class FigureDensityIndex:
+    """
+    Prefix sums of the amount of figures per figured bass marking over the offsets of a figured bass part. Allows retrieving the amount of figures
+    within any range of offsets using two binary searches, instead of looking up every marking within the range.
+    """
+    def __init__(self, figuredBassPart: music21.stream.Part):
+        """
+        @param figuredBassPart: The music21 Part stream containing the figured bass information as lyrics.
+        """
+        offsetIndex = getPartOffsetIndex(figuredBassPart)
+        self.offsets: list[float] = sorted(offsetIndex.notesByOffset.keys())
+        self.figureSums: list[int] = [0]
+        self.markingCounts: list[int] = [0]
+        for offset in self.offsets:
+            figure = getFiguredBassAtOffset(offset, figuredBassPart)
+            self.figureSums.append(self.figureSums[-1] + (len(figure.split(",")) if figure != '' else 0))
+            self.markingCounts.append(self.markingCounts[-1] + (1 if figure != '' else 0))
+
+    def __getIndexRange(self, startOffset: float, endOffset: float) -> tuple[int, int]:
+        return bisect_left(self.offsets, startOffset), bisect_right(self.offsets, endOffset)
+
+    def getFigureSum(self, startOffset: float, endOffset: float) -> int:
+        """
+        Retrieves the total amount of figures of all markings within a range of offsets (i.e. 2 for '6,4').
+        @param startOffset: The first offset of the range.
+        @param endOffset: The last offset of the range, inclusive.
+        @return: The amount of figures.
+        """
+        startIndex, endIndex = self.__getIndexRange(startOffset, endOffset)
+        return self.figureSums[endIndex] - self.figureSums[startIndex] if endIndex > startIndex else 0
+
+    def getMarkingCount(self, startOffset: float, endOffset: float) -> int:
+        """
+        Retrieves the amount of figured bass markings within a range of offsets. Notes of the figured bass part without a figure are not counted.
+        @param startOffset: The first offset of the range.
+        @param endOffset: The last offset of the range, inclusive.
+        @return: The amount of markings.
+        """
+        startIndex, endIndex = self.__getIndexRange(startOffset, endOffset)
+        return self.markingCounts[endIndex] - self.markingCounts[startIndex] if endIndex > startIndex else 0
+
+    def getMeanFigureCount(self, startOffset: float, endOffset: float) -> float:
+        """
+        Retrieves the average amount of figures per figured bass marking within a range of offsets.
+        @param startOffset: The first offset of the range.
+        @param endOffset: The last offset of the range, inclusive.
+        @return: The average amount of figures, or 0 if there are no markings within the range.
+        """
+        markingCount = self.getMarkingCount(startOffset, endOffset)
+        return self.getFigureSum(startOffset, endOffset) / markingCount if markingCount > 0 else 0
+
+
+def getFigureDensityIndex(figuredBassPart: music21.stream.Part) -> FigureDensityIndex:
+    """
+    Retrieves the figure density index of a figured bass part, building it on first use. The index is stored in the cache of the part stream like
+    the offset index.
+    @param figuredBassPart: The music21 Part stream containing the figured bass information as lyrics.
+    @return: The FigureDensityIndex of the part.
+    """
+    densityIndex = figuredBassPart._cache.get('musicau.figureDensityIndex')
+    if densityIndex is None:
+        densityIndex = FigureDensityIndex(figuredBassPart)
+        figuredBassPart._cache['musicau.figureDensityIndex'] = densityIndex
+    return densityIndex
 
 
 def testConditionAtOffset(offset: float,
@@ -13,9 +304,8 @@ def testConditionAtOffset(offset: float,
     @param condition: The condition to test for as a Callable (pass in a function or lambda):
     @return: The result of the evaluation.
     """
-    streamIterator = partStream.recurse().notes
-    for note in streamIterator:
-        if streamIterator.currentHierarchyOffset() == offset and condition(note):
+    for note in getPartOffsetIndex(partStream).getNotesAtOffset(offset):
+        if condition(note):
             return True
     return False
 
@@ -32,9 +322,8 @@ def runFunctionAtOffset(offset: float,
     @param function:  The function to run as a Callable (pass in a function or lambda):
     @return: The result of the evaluation, or None if the condition was never met.
     """
-    streamIterator = partStream.recurse().notes
-    for note in streamIterator:
-        if streamIterator.currentHierarchyOffset() == offset and condition(note):
+    for note in getPartOffsetIndex(partStream).getNotesAtOffset(offset):
+        if condition(note):
             return function(note)
     return None
 
@@ -68,6 +357,50 @@ def getOffsetOfElement(element: music21.base.Music21Object) -> float:
     return element.getContextByClass('Measure').offset + element.offset
 
 
+def getOffsetOfNoteInPart(note: music21.note.Note, partStream: music21.stream.Part) -> float:
+    """
+    Retrieves the offset of a note from the beginning of the part using the offset index of the part, instead of searching for the measure
+    containing the note.
+    @param note: The note of which to get the offset.
+    @param partStream: The music21 Part stream containing the note.
+    @return: The offset.
+    """
+    offset = getPartOffsetIndex(partStream).getOffsetOfNote(note)
+    return offset if offset is not None else getOffsetOfElement(note)
+
+
+def makeMeasureAndBeatStringOfNote(note: music21.note.Note, partStream: music21.stream.Part, measureMap: dict[float, str]) -> str:
+    """
+    Makes a string containing the measure and beat of a note using the offset index and the measure timeline of the part, equivalent to
+    makeMeasureAndBeatStringByMeasureMap.
+    @param note: The music21 Note to generate this string for.
+    @param partStream: The music21 Part stream containing the note.
+    @param measureMap: The measure map to use.
+    @return: String in the format '[measure], [beat]'
+    """
+    bIsInVoice = isinstance(note.activeSite, music21.stream.Voice)
+    return getMeasureTimeline(partStream, measureMap).makeMeasureAndBeatString(getOffsetOfNoteInPart(note, partStream), not bIsInVoice)
+
+
+def splitMeasureAndBeatString(measureAndBeat: str) -> tuple[str, float]:
+    """
+    Splits a string containing the measure and beat (as made by makeMeasureAndBeatStringOfNote) into its parts.
+    @param measureAndBeat: String in the format '[measure], [beat]'.
+    @return: A tuple containing the measure label and the beat, or None as the beat if it is unknown (i.e. 'nan' if there is no time signature
+    in effect) or cannot be read.
+    """
+    measure, beat = measureAndBeat.rsplit(", ", 1)
+    try:
+        beatValue = float(beat)
+    except ValueError:
+        # Beats may also be written as fractions (i.e. '3/2')
+        try:
+            beatValue = float(Fraction(beat))
+        except (ValueError, ZeroDivisionError):
+            return measure, None
+    return measure, beatValue if not math.isnan(beatValue) else None
+
+
 def makeMeasureAndBeatStringByMeasureMap(note: music21.note.Note, measureMap: dict[float, str]) -> str:
     """
     Makes a string containing the measure and beat of a note based on the given measure map.
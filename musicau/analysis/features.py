@@ -0,0 +1,259 @@
+import musicau
+
+import music21
+
+from musicau.analysis import AnalysisMethod, procedures
+from musicau.analysis.actions import getClosureIndex, getFiguredBassFromNote, getMeasureTimeline, getPartOffsetIndex, hasFermata
+from musicau.tools import featureStore, manifest, parsing
+from musicau.tools.eventTables import encodePitchBase40
+
+import copy
+import os.path
+
+
+class PieceFeatures:
+    """
+    The features of a single version (with or without expanded repeats) of a piece, as rows of the tables of a FeatureStore.
+    """
+    def __init__(self,
+                 measures: list[tuple],
+                 notes: list[tuple],
+                 figures: list[tuple],
+                 closures: list[tuple]):
+        """
+        @param measures: Rows of the measures table, see featureStore.MEASURE_COLUMNS.
+        @param notes: Rows of the notes table, see featureStore.NOTE_COLUMNS.
+        @param figures: Rows of the figures table, see featureStore.FIGURE_COLUMNS.
+        @param closures: Rows of the closures table, see featureStore.CLOSURE_COLUMNS.
+        """
+        self.tables: dict[str, list[tuple]] = {"measures": measures, "notes": notes, "figures": figures, "closures": closures}
+
+    def __repr__(self):
+        # Summarized, as the rows of every piece are printed by the analysis procedure
+        return ", ".join(str(len(rows)) + " " + tableName for tableName, rows in self.tables.items())
+
+
+def extractPieceFeatures(score: music21.stream.Score, measureMap: dict[float, str]) -> PieceFeatures:
+    """
+    Extracts the features of a parsed piece. Part 0 is expected to be the melody and part 2 the figured bass part, if present.
+    @param score: The music21 Score stream, as returned by parsing.parsePieceByPath.
+    @param measureMap: The measure map of the score, as returned by parsing.parsePieceByPath.
+    @return: The PieceFeatures of the piece.
+    """
+    parts = list(score.parts)
+
+    measures = []
+    if len(parts) > 0:
+        measureTimeline = getMeasureTimeline(parts[0], measureMap)
+        for measureIndex, (offset, label) in enumerate(zip(measureTimeline.measureOffsets, measureTimeline.measureLabels)):
+            # The time signature in effect at the beginning of the measure, which may have been carried over from a previous measure
+            timeSignatures = [entry[1] for entry in measureTimeline.timeSignatures[measureIndex] if entry[0] <= 0]
+            measures.append((measureIndex, label, float(offset), timeSignatures[-1].ratioString if len(timeSignatures) > 0 else None))
+
+    notes = []
+    for partIndex, part in enumerate(parts):
+        offsetIndex = getPartOffsetIndex(part)
+        measureTimeline = getMeasureTimeline(part, measureMap)
+        # Notes are numbered in order of their offsets, simultaneous notes (i.e. in different voices) keeping the order in which they appear
+        partNotes = sorted(part.recurse().notes, key=offsetIndex.getOffsetOfNote)
+        for noteIndex, note in enumerate(partNotes):
+            offset = offsetIndex.getOffsetOfNote(note)
+            bIsInVoice = isinstance(note.activeSite, music21.stream.Voice)
+            measure = measureTimeline.getMeasureLabelAtOffset(offset)
+            beat = measureTimeline.getBeatAtOffset(offset, not bIsInVoice)
+            for pitchIndex, pitch in enumerate(note.pitches):
+                notes.append((partIndex, noteIndex, pitchIndex, str(note.activeSite.id) if bIsInVoice else None, float(offset),
+                              float(note.duration.quarterLength), measure + ", " + str(beat), measure, float(beat), encodePitchBase40(pitch),
+                              pitch.ps, pitch.nameWithOctave, note.tie.type if note.tie is not None else None, hasFermata(note)))
+
+    figures = []
+    if len(parts) > 2:
+        offsetIndex = getPartOffsetIndex(parts[2])
+        measureTimeline = getMeasureTimeline(parts[2], measureMap)
+        for note in sorted(parts[2].recurse().notes, key=offsetIndex.getOffsetOfNote):
+            if note.lyric is None:
+                continue
+            offset = offsetIndex.getOffsetOfNote(note)
+            bIsInVoice = isinstance(note.activeSite, music21.stream.Voice)
+            measure = measureTimeline.getMeasureLabelAtOffset(offset)
+            beat = measureTimeline.getBeatAtOffset(offset, not bIsInVoice)
+            figure = getFiguredBassFromNote(note)
+            figures.append((len(figures), float(offset), measure + ", " + str(beat), measure, float(beat), figure,
+                            len(figure.split(",")) if figure != '' else 0))
+
+    closures = []
+    if len(parts) > 0:
+        closureIndex = getClosureIndex(parts[0])
+        offsetIndex = getPartOffsetIndex(parts[0])
+        measureTimeline = getMeasureTimeline(parts[0], measureMap)
+        for note in sorted(closureIndex.closureNotes, key=offsetIndex.getOffsetOfNote):
+            offset = offsetIndex.getOffsetOfNote(note)
+            bIsInVoice = isinstance(note.activeSite, music21.stream.Voice)
+            measure = measureTimeline.getMeasureLabelAtOffset(offset)
+            beat = measureTimeline.getBeatAtOffset(offset, not bIsInVoice)
+            phraseStart = closureIndex.phraseBoundaries[closureIndex.getPhraseIndexAtOffset(offset)][0]
+            closures.append((len(closures), float(offset), measure + ", " + str(beat), measure, float(beat), encodePitchBase40(note.pitches[0]),
+                             float(phraseStart)))
+
+    return PieceFeatures(measures, notes, figures, closures)
+
+
+class FeatureExtractor(AnalysisMethod):
+    """
+    Analysis method extracting the features of every piece with and without expanded repeats, used to fill a FeatureStore.
+    """
+    def __init__(self, knownChecksums: dict[str, str] = None):
+        """
+        @param knownChecksums: Dictionary matching the paths of pieces to the checksums they had when their features were last stored. Pieces that
+        have not changed since are skipped.
+        """
+        super().__init__()
+        self.__knownChecksums: dict[str, str] = knownChecksums if knownChecksums is not None else {}
+
+    def analyze(self, filePath):
+        if self.__knownChecksums.get(str(filePath)) == manifest.getSourceChecksum(filePath):
+            return None
+
+        outResult = []
+        for bShouldExpandRepeats in [False, True]:
+            score, measureMap = parsing.parsePieceByPath(filePath, bShouldExpandRepeats)
+            outResult.append(extractPieceFeatures(score, measureMap))
+        return outResult
+
+    def getOutputHeader(self):
+        return ["Features (Unexpanded)", "Features (Expanded)"]
+
+
+def ingestCatalogueCorpus(corpusName: str,
+                          featureStorePath: os.path,
+                          params: procedures.AnalysisProcedureParams = procedures.AnalysisProcedureParams()) -> tuple[int, int]:
+    """
+    Extracts the features of all pieces of a corpus into a FeatureStore. Only pieces that are new or have changed since they were last stored are
+    parsed, and pieces that are no longer part of the corpus (or whose catalogues are ignored) are removed from the store.
+    @param corpusName: Name of the LocalCorpus to ingest. If blank, the default corpus name will be used.
+    @param featureStorePath: Path to the database file of the FeatureStore, which is created if it does not exist.
+    @param params: Additional procedure parameters as an AnalysisProcedureParams object. Stored results are never used, as the store itself keeps
+    track of the pieces that have not changed.
+    @return: A tuple containing the amount of stored and of removed piece versions.
+    """
+    params = copy.copy(params)
+    params.bUseResultCache = False
+
+    store = featureStore.FeatureStore(featureStorePath)
+    storedCount = 0
+    try:
+        extractor = FeatureExtractor(store.getPieceChecksums(FeatureExtractor.version))
+        for result in procedures.iterateCatalogueCorpus(corpusName, extractor, False, "", params):
+            if result.resultData is None:
+                continue
+            for bIsExpanded, pieceFeatures in zip([False, True], result.resultData):
+                store.storePiece(result.catalogueID, result.pieceNumber, result.fileSpecifiers, bIsExpanded, result.filePath,
+                                 manifest.getSourceChecksum(result.filePath), FeatureExtractor.version, pieceFeatures.tables)
+                storedCount += 1
+
+        # Pieces whose extraction failed are kept with their previous features, only pieces no longer in the corpus are removed
+        corpusPieces = procedures.collectCatalogueCorpusPieces(corpusName if corpusName != "" else musicau.DEFAULT_CORPUS_NAME,
+                                                               params.cataloguesToIgnore)
+        removedCount = store.removePieces([sourcePath for _, _, _, sourcePath in corpusPieces])
+        store.createIndexes()
+    finally:
+        store.close()
+    return storedCount, removedCount
+
+
+class FeatureQuery:
+    """
+    Thin query interface to a FeatureStore, answering common questions about the pieces of a corpus without parsing them with music21. All
+    queries are restricted to one version of the pieces, with or without expanded repeats. Positions are strings in the format '[measure], [beat]'
+    like the ones in the results of the analysis methods, so results can be joined with the tables of a ResultDatabase.
+    """
+    def __init__(self, featureStorePath: os.path, bUseExpandedPieces: bool = False):
+        """
+        @param featureStorePath: Path to the database file of the FeatureStore, see ingestCatalogueCorpus.
+        @param bUseExpandedPieces: Whether to query the pieces with expanded repeats.
+        @raise: Exception if the file does not exist
+        """
+        if not os.path.isfile(featureStorePath):
+            raise Exception("The given feature store does not exist: " + str(featureStorePath))
+        self.store: featureStore.FeatureStore = featureStore.FeatureStore(featureStorePath)
+        self.bUseExpandedPieces: bool = bUseExpandedPieces
+
+    def getPieces(self, catalogue: str = None) -> list[tuple[int, str, str, str]]:
+        """
+        Retrieves the stored pieces.
+        @param catalogue: Catalogue ID to restrict the pieces to, all catalogues if None.
+        @return: List of tuples of the piece ID, catalogue ID, piece number and specifiers.
+        """
+        return self.store.query("SELECT pieceId, catalogue, pieceNumber, specifiers FROM pieces WHERE expanded = ? AND (? IS NULL OR catalogue = ?) "
+                                "ORDER BY catalogue, pieceNumber, specifiers", (int(self.bUseExpandedPieces), catalogue, catalogue))
+
+    def getNotes(self, pieceId: int, partIndex: int) -> list[tuple[float, float, str, int, str, bool]]:
+        """
+        Retrieves the notes of a part, chords contributing one row per pitch.
+        @param pieceId: ID of the piece, see getPieces.
+        @param partIndex: Index of the part (0 for the melody, 1 for the bass).
+        @return: List of tuples of the offset, duration, position, base-40 pitch, pitch name and whether the note carries a fermata, in order of
+        their offsets.
+        """
+        return self.store.query("SELECT offset, duration, position, pitch40, name, fermata FROM notes WHERE pieceId = ? AND part = ? "
+                                "ORDER BY noteIndex, pitchIndex", (pieceId, partIndex))
+
+    def getFigures(self, pieceId: int) -> list[tuple[float, str, str]]:
+        """
+        Retrieves the figures of a piece.
+        @param pieceId: ID of the piece, see getPieces.
+        @return: List of tuples of the offset, position and figure, in order of their offsets.
+        """
+        return self.store.query("SELECT offset, position, figure FROM figures WHERE pieceId = ? ORDER BY figureIndex", (pieceId,))
+
+    def getClosures(self, pieceId: int) -> list[tuple[float, str, int]]:
+        """
+        Retrieves the closures (notes with a fermata in the melody) of a piece.
+        @param pieceId: ID of the piece, see getPieces.
+        @return: List of tuples of the offset, position and base-40 pitch of the melody note, in order of their offsets.
+        """
+        return self.store.query("SELECT offset, position, pitch40 FROM closures WHERE pieceId = ? ORDER BY closureIndex", (pieceId,))
+
+    def findFigures(self, figure: str, bOnlyOnClosures: bool = False) -> list[tuple[str, str, str, str, str]]:
+        """
+        Finds all figures containing a given figure throughout the corpus, equivalent to testing `figure in getFiguredBassAtOffset(...)`. Only
+        the first figure at an offset is considered, like getFiguredBassAtOffset does.
+        @param figure: The figure to find (i.e. '7' matches '7', 'n7,5' and '7,4'), with 'h' written as 'n'.
+        @param bOnlyOnClosures: Whether to only find figures placed at the offset of a closure.
+        @return: List of tuples of the catalogue ID, piece number, specifiers, position and figure.
+        """
+        return self.store.query("SELECT pieces.catalogue, pieces.pieceNumber, pieces.specifiers, figures.position, figures.figure FROM pieces "
+                                "JOIN figures ON figures.pieceId = pieces.pieceId "
+                                "WHERE pieces.expanded = ? AND instr(figures.figure, ?) > 0 "
+                                "AND figures.figureIndex = (SELECT MIN(firstFigures.figureIndex) FROM figures AS firstFigures "
+                                "WHERE firstFigures.pieceId = figures.pieceId AND firstFigures.offset = figures.offset) "
+                                "AND (? = 0 OR EXISTS (SELECT 1 FROM closures WHERE closures.pieceId = figures.pieceId "
+                                "AND closures.offset = figures.offset)) "
+                                "ORDER BY pieces.catalogue, pieces.pieceNumber, pieces.specifiers, figures.figureIndex",
+                                (int(self.bUseExpandedPieces), figure, int(bOnlyOnClosures)))
+
+    def countClosures(self) -> list[tuple[str, str, str, int]]:
+        """
+        Counts the closures of every piece.
+        @return: List of tuples of the catalogue ID, piece number, specifiers and amount of closures.
+        """
+        return self.store.query("SELECT pieces.catalogue, pieces.pieceNumber, pieces.specifiers, COUNT(closures.closureIndex) FROM pieces "
+                                "LEFT JOIN closures ON closures.pieceId = pieces.pieceId WHERE pieces.expanded = ? "
+                                "GROUP BY pieces.pieceId ORDER BY pieces.catalogue, pieces.pieceNumber, pieces.specifiers",
+                                (int(self.bUseExpandedPieces),))
+
+    def query(self, statement: str, parameters: tuple = ()) -> list[tuple]:
+        """
+        Runs any SQL query on the feature store, see musicau.tools.featureStore for the tables and their columns. Unlike the other queries, the
+        statement has to restrict the pieces to one version itself (i.e. using `pieces.expanded = 0`).
+        @param statement: The SQL statement.
+        @param parameters: Values for the placeholders in the statement.
+        @return: List of the resulting rows.
+        """
+        return self.store.query(statement, parameters)
+
+    def close(self):
+        """
+        Closes the feature store.
+        """
+        self.store.close()
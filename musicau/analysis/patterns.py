@@ -0,0 +1,179 @@
+import music21
+
+from musicau.analysis.actions import getClosureIndex, getFiguredBassFromNote
+
+from bisect import bisect_right
+
+
+class FigureEvent:
+    """
+    A single bass note of a piece along with the figure above it, as part of a FigureStream.
+    """
+    def __init__(self, index: int, note: music21.note.NotRest, offset: float, figure: str, bIsClosure: bool):
+        """
+        @param index: Index of the event within the stream.
+        @param note: The music21 Note (or Chord) in the bass part.
+        @param offset: The offset of the note from the beginning of the part.
+        @param figure: The figure at the offset of the note, empty if there is none.
+        @param bIsClosure: Whether a closure (a note with a fermata in the melody part) is placed at the offset of the note.
+        """
+        self.index: int = index
+        self.note: music21.note.NotRest = note
+        self.offset: float = offset
+        self.figure: str = figure
+        self.bIsClosure: bool = bIsClosure
+        self.bassPitch: float = note.pitches[0].ps
+
+
+class FigureStream:
+    """
+    The bass notes of a piece in order of their offsets (notes of several voices are interleaved), each with the figure placed above it. This is
+    the sequence FigurePatterns are matched against.
+    """
+    def __init__(self, bassPart: music21.stream.Part, figuredBassPart: music21.stream.Part, melodyPart: music21.stream.Part = None):
+        """
+        @param bassPart: The music21 Part stream containing the bass.
+        @param figuredBassPart: The music21 Part stream containing the figured bass information as lyrics.
+        @param melodyPart: The music21 Part stream containing the melody, used to find closures. If None, no event is on a closure.
+        """
+        # Figures of the figured bass part in order of their offsets, the first figure at an offset takes precedence over later ones
+        self.figureOffsets: list[float] = []
+        self.figureLyrics: list[str] = []
+        figuresByOffset: dict[float, str] = {}
+        for note in figuredBassPart.flatten().notes:
+            if note.lyric is None:
+                continue
+            self.figureOffsets.append(note.offset)
+            self.figureLyrics.append(note.lyric)
+            if note.offset not in figuresByOffset:
+                figuresByOffset[note.offset] = getFiguredBassFromNote(note)
+
+        closureIndex = getClosureIndex(melodyPart) if melodyPart is not None else None
+        self.events: list[FigureEvent] = []
+        for note in bassPart.flatten().notes:
+            bIsClosure = closureIndex is not None and closureIndex.isClosureAtOffset(note.offset)
+            self.events.append(FigureEvent(len(self.events), note, note.offset, figuresByOffset.get(note.offset, ''), bIsClosure))
+
+    def __len__(self):
+        return len(self.events)
+
+    def getNextFigureAfterOffset(self, offset: float) -> str:
+        """
+        Retrieves the next figure placed after a given offset, whether or not a new bass note starts with it.
+        @param offset: The offset from the beginning of the piece.
+        @return: The figure as it appears in the figured bass part (without any normalization), or None if there is no later figure.
+        """
+        index = bisect_right(self.figureOffsets, offset)
+        return self.figureLyrics[index] if index < len(self.figureLyrics) else None
+
+
+class FigureStep:
+    """
+    A single step of a FigurePattern, which matches one event of a FigureStream. Constraints that are None match any event.
+    """
+    def __init__(self, figures: list[str] = None, bassInterval: int = None, bIsClosure: bool = None):
+        """
+        @param figures: List of figures, of which at least one must be contained in the figure of the event (i.e. ['7'] matches '7', 'n7,5' and
+        '7,4'). Use [''] to match any event, including events without a figure.
+        @param bassInterval: Interval in semitones from the bass note of the previous step to the bass note of this step (i.e. 1 for a rising half
+        step). Ignored for the first step of a pattern.
+        @param bIsClosure: Whether the event must be (True) or must not be (False) on a closure.
+        """
+        self.figures: list[str] = figures
+        self.bassInterval: int = bassInterval
+        self.bIsClosure: bool = bIsClosure
+
+
+class FigurePattern:
+    """
+    A sequence of steps to be matched against consecutive events of a FigureStream (i.e. a 7 - 9 - 8 or 4 - 3 progression).
+    """
+    def __init__(self, name: str, steps: list[FigureStep]):
+        """
+        @param name: Name of the pattern, used to tell the matches of several patterns apart.
+        @param steps: The steps of the pattern, at least one.
+        @raise: Exception if no steps are given
+        """
+        if len(steps) == 0:
+            raise Exception("The figure pattern " + name + " contains no steps.")
+        self.name: str = name
+        self.steps: list[FigureStep] = steps
+
+
+class FigurePatternMatch:
+    """
+    A match of a FigurePattern, consisting of one event per step of the pattern.
+    """
+    def __init__(self, pattern: FigurePattern, events: list[FigureEvent]):
+        """
+        @param pattern: The matched FigurePattern.
+        @param events: The matched events of the FigureStream, one per step of the pattern.
+        """
+        self.pattern: FigurePattern = pattern
+        self.events: list[FigureEvent] = events
+
+
+class FigurePatternMatcher:
+    """
+    Matches several FigurePatterns in a single pass over a FigureStream. The patterns are compiled into an automaton whose states are the steps of
+    all patterns. Each event advances all partial matches at once, so the time spent per piece is linear in the amount of events.
+    """
+    def __init__(self, patterns: list[FigurePattern]):
+        """
+        @param patterns: The FigurePatterns to match.
+        """
+        self.patterns: list[FigurePattern] = patterns
+
+        # All figures of all steps are numbered, so that each step only has to test a bit mask against the figures contained in an event
+        figureBits: dict[str, int] = {}
+        for pattern in patterns:
+            for step in pattern.steps:
+                for figure in step.figures or []:
+                    if figure not in figureBits:
+                        figureBits[figure] = 1 << len(figureBits)
+        self.__figureBits: list[tuple[str, int]] = list(figureBits.items())
+
+        # Transition table of the automaton: one entry per step, holding the figure mask (0 for any figure), interval and closure constraints
+        self.__transitions: list[list[tuple[int, int, bool]]] = []
+        for pattern in patterns:
+            self.__transitions.append([(sum(figureBits[figure] for figure in set(step.figures)) if step.figures is not None else 0,
+                                        step.bassInterval, step.bIsClosure) for step in pattern.steps])
+
+    def findMatches(self, figureStream: FigureStream) -> list[FigurePatternMatch]:
+        """
+        Finds all matches of all patterns in a FigureStream. Matches may overlap.
+        @param figureStream: The FigureStream to search.
+        @return: List of the matches, ordered by their last event and, for matches ending on the same event, by the order of the patterns.
+        """
+        outMatches = []
+        figureMasks: dict[str, int] = {}
+        # Partial matches as tuples of the pattern index, the index of the next step and the index of the first event
+        activeStates: list[tuple[int, int, int]] = []
+        previousEvent = None
+        for event in figureStream.events:
+            figureMask = figureMasks.get(event.figure)
+            if figureMask is None:
+                figureMask = sum(bit for figure, bit in self.__figureBits if figure in event.figure)
+                figureMasks[event.figure] = figureMask
+            bassInterval = event.bassPitch - previousEvent.bassPitch if previousEvent is not None else None
+
+            nextStates = []
+            for patternIndex, stepIndex, startIndex in activeStates + [(patternIndex, 0, event.index) for patternIndex in range(len(self.patterns))]:
+                requiredFigures, requiredInterval, bRequiredClosure = self.__transitions[patternIndex][stepIndex]
+                if requiredFigures != 0 and figureMask & requiredFigures == 0:
+                    continue
+                if requiredInterval is not None and stepIndex > 0 and bassInterval != requiredInterval:
+                    continue
+                if bRequiredClosure is not None and event.bIsClosure != bRequiredClosure:
+                    continue
+                if stepIndex + 1 < len(self.__transitions[patternIndex]):
+                    nextStates.append((patternIndex, stepIndex + 1, startIndex))
+                    continue
+                outMatches.append((event.index, patternIndex, startIndex))
+
+            activeStates = nextStates
+            previousEvent = event
+
+        outMatches.sort(key=lambda match: (match[0], match[1]))
+        return [FigurePatternMatch(self.patterns[patternIndex], figureStream.events[startIndex:endIndex + 1])
+                for endIndex, patternIndex, startIndex in outMatches]
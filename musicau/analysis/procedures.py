@@ -1,26 +1,166 @@
 import musicau
 
 from musicau.analysis import AnalysisResult, AnalysisMethod
-from musicau.tools import parsing
+from musicau.tools import caching, journal, manifest, parsing, profiling, resultDatabase
 
 import music21
 
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
+from typing import Iterator
 import os.path
 import csv
+import pickle
+import traceback
 
 
 class AnalysisProcedureParams:
     """
     Class to hold additional parameters for the analysis procedure.
     """
-    def __init__(self, bOutputFileSpecifiers: bool = True, cataloguesToIgnore: list[str] = []):
+    def __init__(self,
+                 bOutputFileSpecifiers: bool = True,
+                 cataloguesToIgnore: list[str] = [],
+                 workerCount: int = 1,
+                 bUseResultCache: bool = False,
+                 profilingOutputPath: str = "",
+                 slowestPiecesToProfile: int = 0,
+                 journalPath: str = "",
+                 bShouldResume: bool = False,
+                 databasePath: str = ""):
         """
         @param bOutputFileSpecifiers: Whether to output a column containing the file specifiers in the CSV output.
         @param cataloguesToIgnore: List of catalogues to ignore by string name
+        @param workerCount: Number of worker processes to spread the analysis of pieces across. A value of 1 analyses all pieces in the
+        current process, a value of 0 uses one worker per CPU core.
+        @param bUseResultCache: Whether to store results in the cache directory and reuse them for pieces that have not changed since they were
+        last analysed with the same analysis method (see AnalysisMethod.getFingerprint).
+        @param profilingOutputPath: Path to a JSON file in Chrome trace format to which the wall time, CPU time and peak memory usage of every
+        piece and stage (metadata refresh, parsing, expanding repeats, analysis and CSV output) are written. Profiling is disabled if empty.
+        @param slowestPiecesToProfile: Amount of the slowest pieces whose cProfile statistics are written next to the profiling output, for
+        inspection using pstats. The pieces are ranked by the times of the regular run and only these pieces are analysed again under cProfile
+        once the run is complete, so that the overhead of cProfile does not distort the ranking or the trace. As the parsed scores are usually
+        cached by then, their statistics may understate the time spent parsing. Requires a profiling output path.
+        @param journalPath: Path to a journal file to which the results of every piece are appended as soon as the piece has been analysed, so that
+        an interrupted run can be resumed. Journaling is disabled if empty.
+        @param bShouldResume: Whether to reuse the results recorded in the journal by an earlier run that was interrupted, analysing only the
+        remaining pieces. Otherwise, the journal is cleared at the start of the run.
+        @param databasePath: Path to an SQLite database to which the results are written in addition to any CSV output, one table per analysis
+        method named after its output file name (or its class name if none is given), see AnalysisMethod.getResultColumns. No database is written
+        if empty.
         """
         self.bOutputFileSpecifiers: bool = bOutputFileSpecifiers
         self.cataloguesToIgnore: list[str] = cataloguesToIgnore
+        self.workerCount: int = workerCount
+        self.bUseResultCache: bool = bUseResultCache
+        self.profilingOutputPath: str = profilingOutputPath
+        self.slowestPiecesToProfile: int = slowestPiecesToProfile
+        self.journalPath: str = journalPath
+        self.bShouldResume: bool = bShouldResume
+        self.databasePath: str = databasePath
+
+
+# The analysis methods and the journal used by the current worker process, set once per worker by _initializeWorker
+_workerAnalysisMethods: list[AnalysisMethod] = []
+_workerJournal: journal.ResultJournal = None
+
+
+def _initializeWorker(pickledAnalysisMethods: bytes, journalPath: str):
+    """
+    Initializes a worker process of the process pool by restoring the analysis methods it should use.
+    @param pickledAnalysisMethods: The pickled list of AnalysisMethod objects.
+    @param journalPath: Path to the journal the worker appends its results to, or an empty string if journaling is disabled.
+    """
+    global _workerAnalysisMethods, _workerJournal
+    _workerAnalysisMethods = pickle.loads(pickledAnalysisMethods)
+    _workerJournal = journal.ResultJournal(journalPath) if journalPath != "" else None
+
+
+def _analyzePiece(analysisMethods: list[AnalysisMethod],
+                  methodIndices: list[int],
+                  sourcePath: os.path,
+                  bShouldCatchExceptions: bool,
+                  bShouldProfile: bool = False,
+                  resultJournal: journal.ResultJournal = None,
+                  journalRecords: list[dict] = None) -> tuple[list[tuple[list[any], str]], dict]:
+    """
+    Analyses a single piece using several analysis methods. The piece is parsed only once and the parsed score is shared between the methods.
+    @param analysisMethods: The AnalysisMethod objects.
+    @param methodIndices: Indices of the analysis methods to use for this piece.
+    @param sourcePath: Path to the MusicXML file to analyse.
+    @param bShouldCatchExceptions: Whether exceptions should be caught and returned instead of being raised, so that a single faulty piece does
+    not end the entire run.
+    @param bShouldProfile: Whether the time spent in each stage and the peak memory usage should be recorded.
+    @param resultJournal: The journal to append the successful results to, or None if journaling is disabled.
+    @param journalRecords: The journal records of the piece without their result data, one per method index (see _makeJournalRecords).
+    @return: A tuple containing a list of a tuple of the result data (or None on failure) and the formatted exception (or None on success) per
+    method index, and the profile of the piece (or None if not profiled, see profiling.profilingPiece).
+    """
+    if not bShouldProfile:
+        return _analyzePieceWithMethods(analysisMethods, methodIndices, sourcePath, bShouldCatchExceptions, resultJournal, journalRecords), None
+    with profiling.profilingPiece(sourcePath, True) as pieceProfile:
+        outResults = _analyzePieceWithMethods(analysisMethods, methodIndices, sourcePath, bShouldCatchExceptions, resultJournal, journalRecords)
+    return outResults, pieceProfile
+
+
+def _analyzePieceWithMethods(analysisMethods: list[AnalysisMethod],
+                             methodIndices: list[int],
+                             sourcePath: os.path,
+                             bShouldCatchExceptions: bool,
+                             resultJournal: journal.ResultJournal,
+                             journalRecords: list[dict]) -> list[tuple[list[any], str]]:
+    outResults = []
+    with parsing.sharedParsing():
+        for methodIndex in methodIndices:
+            with profiling.measureStage("analyze"):
+                if not bShouldCatchExceptions:
+                    outResults.append((analysisMethods[methodIndex].analyze(sourcePath), None))
+                    continue
+                try:
+                    outResults.append((analysisMethods[methodIndex].analyze(sourcePath), None))
+                except Exception:
+                    outResults.append((None, traceback.format_exc()))
+
+    if resultJournal is not None:
+        with profiling.measureStage("journal"):
+            resultJournal.append([dict(journalRecord, resultData=resultData)
+                                  for journalRecord, (resultData, formattedException) in zip(journalRecords, outResults)
+                                  if formattedException is None])
+    return outResults
+
+
+def _makeJournalRecords(fingerprints: list[str],
+                        methodIndices: list[int],
+                        piece: tuple[str, str, str, os.path],
+                        sourceChecksum: str) -> list[dict]:
+    """
+    Creates the journal records of a piece, to which the result data is added once the piece has been analysed.
+    @param fingerprints: The fingerprints of all analysis methods.
+    @param methodIndices: Indices of the analysis methods used for the piece.
+    @param piece: Tuple of the catalogue ID, piece number, file specifiers and path of the piece.
+    @param sourceChecksum: Checksum of the contents of the piece.
+    @return: List containing a record per method index.
+    """
+    catalogue, pieceNumber, fileSpecifiers, sourcePath = piece
+    return [{"fingerprint": fingerprints[methodIndex], "checksum": sourceChecksum, "sourcePath": str(sourcePath), "catalogue": catalogue,
+             "pieceNumber": pieceNumber, "fileSpecifiers": fileSpecifiers} for methodIndex in methodIndices]
+
+
+def _analyzePieceInWorker(methodIndices: list[int],
+                          sourcePath: os.path,
+                          bShouldProfile: bool,
+                          journalRecords: list[dict]) -> tuple[list[tuple[list[any], str]], dict]:
+    """
+    Analyses a single piece inside a worker process. Exceptions are caught and passed back to the parent process. Successful results are appended
+    to the journal by the worker itself, so they are recorded even if the parent process has not collected them yet.
+    @param methodIndices: Indices of the analysis methods to use for this piece.
+    @param sourcePath: Path to the MusicXML file to analyse.
+    @param bShouldProfile: Whether the time spent in each stage and the peak memory usage should be recorded.
+    @param journalRecords: The journal records of the piece without their result data, or None if journaling is disabled.
+    @return: A tuple containing a list of a tuple of the result data (or None on failure) and the formatted exception (or None on success) per
+    method index, and the profile of the piece (or None if not profiled).
+    """
+    return _analyzePiece(_workerAnalysisMethods, methodIndices, sourcePath, True, bShouldProfile, _workerJournal, journalRecords)
 
 
 def analyseCatalogueCorpus(corpusName: str,
@@ -39,8 +179,89 @@ def analyseCatalogueCorpus(corpusName: str,
     @return: A tuple containing a map matching catalogue IDs to composer names, and a map matching catalogue IDs to a map of piece numbers to
     AnalysisResults.
     """
-    if not isinstance(analysisMethod, AnalysisMethod) or analysisMethod.__class__ == AnalysisMethod:
-        raise Exception("The given analysis method argument is not a subclass of AnalysisMethod.")
+    outCatalogues, outResults = analyseCatalogueCorpusWithMethods(corpusName, [analysisMethod], bShouldDoOutput, [outputFileName], params)
+    return outCatalogues, outResults[0]
+
+
+def analyseCatalogueCorpusWithMethods(corpusName: str,
+                                      analysisMethods: list[AnalysisMethod],
+                                      bShouldDoOutput: bool = False,
+                                      outputFileNames: list[str] = None,
+                                      params: AnalysisProcedureParams = AnalysisProcedureParams()) \
+        -> tuple[dict[str, str], list[dict[str, dict[str, AnalysisResult]]]]:
+    """
+    Performs several analyses on a given music21 LocalCorpus in a single pass over the corpus. Each piece is parsed only once and the parsed
+    score is shared between all analysis methods, which must therefore not modify the score.
+    @param corpusName: Name of the LocalCorpus to analyse. If blank, the default corpus name will be used.
+    @param analysisMethods: The AnalysisMethod objects to be used for performing analysis on the pieces.
+    @param bShouldDoOutput: Whether to output the results to CSV files, one set of files per analysis method.
+    @param outputFileNames: The base names for the CSV file output, one per analysis method.
+    @param params: Additional procedure parameters as an AnalysisProcedureParams object.
+    @return: A tuple containing a map matching catalogue IDs to composer names, and a list containing a map matching catalogue IDs to a map of
+    piece numbers to AnalysisResults per analysis method.
+    """
+    outCatalogues: dict[str, str] = {}
+    collectedResults: list[dict[str, dict[str, AnalysisResult]]] = [{} for _ in analysisMethods]
+    for methodIndex, result in iterateCatalogueCorpusWithMethods(corpusName, analysisMethods, bShouldDoOutput, outputFileNames, params,
+                                                                 outCatalogues):
+        if result.catalogueID not in collectedResults[methodIndex]:
+            collectedResults[methodIndex][result.catalogueID] = {}
+        collectedResults[methodIndex][result.catalogueID][result.pieceNumber] = result
+
+    outResults = [{catalogue: methodResults.get(catalogue, {}) for catalogue in outCatalogues} for methodResults in collectedResults]
+    return outCatalogues, outResults
+
+
+def iterateCatalogueCorpus(corpusName: str,
+                           analysisMethod: AnalysisMethod,
+                           bShouldDoOutput: bool = False,
+                           outputFileName: str = "",
+                           params: AnalysisProcedureParams = AnalysisProcedureParams(),
+                           outCatalogues: dict[str, str] = None) -> Iterator[AnalysisResult]:
+    """
+    Performs an analysis on a given music21 LocalCorpus using a given AnalysisMethod object, yielding the results piece by piece instead of
+    collecting them. CSV rows are written as soon as the result of a piece is available.
+    @param corpusName: Name of the LocalCorpus to analyse. If blank, the default corpus name will be used.
+    @param analysisMethod: The AnalysisMethod object to be used for performing analysis on the pieces.
+    @param bShouldDoOutput: Whether to output the results to a CSV file.
+    @param outputFileName: The base name for the CSV file output.
+    @param params: Additional procedure parameters as an AnalysisProcedureParams object.
+    @param outCatalogues: Optional map that is filled with catalogue IDs matched to composer names before the first result is yielded.
+    @return: Iterator over the AnalysisResults of all pieces, in a fixed order.
+    """
+    for _, result in iterateCatalogueCorpusWithMethods(corpusName, [analysisMethod], bShouldDoOutput, [outputFileName], params, outCatalogues):
+        yield result
+
+
+def iterateCatalogueCorpusWithMethods(corpusName: str,
+                                      analysisMethods: list[AnalysisMethod],
+                                      bShouldDoOutput: bool = False,
+                                      outputFileNames: list[str] = None,
+                                      params: AnalysisProcedureParams = AnalysisProcedureParams(),
+                                      outCatalogues: dict[str, str] = None) -> Iterator[tuple[int, AnalysisResult]]:
+    """
+    Performs several analyses on a given music21 LocalCorpus in a single pass over the corpus, yielding the results piece by piece instead of
+    collecting them. CSV rows are written as soon as the result of a piece is available. Each piece is parsed only once and the parsed score is
+    shared between all analysis methods, which must therefore not modify the score.
+    @param corpusName: Name of the LocalCorpus to analyse. If blank, the default corpus name will be used.
+    @param analysisMethods: The AnalysisMethod objects to be used for performing analysis on the pieces.
+    @param bShouldDoOutput: Whether to output the results to CSV files, one set of files per analysis method.
+    @param outputFileNames: The base names for the CSV file output, one per analysis method.
+    @param params: Additional procedure parameters as an AnalysisProcedureParams object.
+    @param outCatalogues: Optional map that is filled with catalogue IDs matched to composer names before the first result is yielded.
+    @return: Iterator over tuples of the index of the analysis method and the AnalysisResult, in a fixed order.
+    """
+    if len(analysisMethods) == 0:
+        raise Exception("No analysis methods were given.")
+    for analysisMethod in analysisMethods:
+        if not isinstance(analysisMethod, AnalysisMethod) or analysisMethod.__class__ == AnalysisMethod:
+            raise Exception("The given analysis method argument is not a subclass of AnalysisMethod.")
+    if outputFileNames is None:
+        outputFileNames = [""] * len(analysisMethods)
+    if len(outputFileNames) != len(analysisMethods):
+        raise Exception("The amount of output file names does not match the amount of analysis methods.")
+    if outCatalogues is None:
+        outCatalogues = {}
 
     if corpusName == "":
         print("WARNING: Using default corpus...")
@@ -49,9 +270,204 @@ def analyseCatalogueCorpus(corpusName: str,
     if not corpus.existsInSettings:
         raise Exception("The given corpus does not exist: " + corpusName)
 
-    musicau.tools.corpusManagement.refreshCorpus(corpusName, bVerbose=True)
+    corpusProfile = profiling.CorpusProfile(params.slowestPiecesToProfile) if params.profilingOutputPath != "" else None
+    runRecorder = corpusProfile.recorder if corpusProfile is not None else None
+    if corpusProfile is None and params.slowestPiecesToProfile > 0:
+        print("WARNING: No profiling output path was given, pieces will not be profiled.")
 
-    outCatalogues: dict[str, str] = {}
+    with profiling.recordingStages(runRecorder), profiling.measureStage("refresh"):
+        musicau.tools.corpusManagement.refreshCorpus(corpusName, bVerbose=True)
+
+    piecesToAnalyse = collectCatalogueCorpusPieces(corpusName, params.cataloguesToIgnore, outCatalogues, True)
+
+    # Bring the checksums of all pieces up to date once, so that neither this process nor any worker has to hash unchanged files again
+    with profiling.recordingStages(runRecorder), profiling.measureStage("manifest"):
+        sourceManifest = manifest.getManifest()
+        changedPieces = sourceManifest.refresh([sourcePath for _, _, _, sourcePath in piecesToAnalyse])
+        sourceManifest.save()
+    if len(changedPieces) > 0:
+        print("Found " + str(len(changedPieces)) + " new or changed pieces.")
+
+    # Results recorded in the journal by an interrupted run are reused when resuming, as long as the piece and the analysis method are unchanged
+    fingerprints = [analysisMethod.getFingerprint() for analysisMethod in analysisMethods]
+    resultJournal = journal.ResultJournal(params.journalPath) if params.journalPath != "" else None
+    journaledResults: dict[tuple[str, str], list[any]] = {}
+    if resultJournal is None:
+        if params.bShouldResume:
+            print("WARNING: No journal path was given, the run cannot be resumed.")
+    elif params.bShouldResume:
+        for record in resultJournal.read():
+            journaledResults[(record["fingerprint"], record["checksum"])] = record["resultData"]
+    else:
+        resultJournal.clear()
+
+    # Reuse stored results of pieces that have not changed since they were last analysed with the same analysis method
+    resultStores = [caching.ResultStore(fingerprint) if params.bUseResultCache else None for fingerprint in fingerprints]
+    storedResults: dict[tuple[int, int], list[any]] = {}
+    pendingMethodIndices: list[list[int]] = []
+    resumedResultCount = 0
+    for i, (_, _, _, sourcePath) in enumerate(piecesToAnalyse):
+        pendingMethodIndices.append([])
+        sourceChecksum = sourceManifest.getChecksum(sourcePath)
+        for methodIndex, resultStore in enumerate(resultStores):
+            if resultStore is not None and resultStore.hasResult(sourceChecksum):
+                storedResults[(i, methodIndex)] = resultStore.getResult(sourceChecksum)
+            elif (fingerprints[methodIndex], sourceChecksum) in journaledResults:
+                storedResults[(i, methodIndex)] = journaledResults[(fingerprints[methodIndex], sourceChecksum)]
+                if resultStore is not None:
+                    resultStore.storeResult(sourceChecksum, storedResults[(i, methodIndex)])
+                resumedResultCount += 1
+            else:
+                pendingMethodIndices[i].append(methodIndex)
+    if params.bUseResultCache:
+        print("Reusing " + str(len(storedResults) - resumedResultCount) + " of " + str(len(piecesToAnalyse) * len(analysisMethods)) +
+              " stored results.")
+    if params.bShouldResume and resultJournal is not None:
+        print("Resuming with " + str(resumedResultCount) + " of " + str(len(piecesToAnalyse) * len(analysisMethods)) + " results from the journal.")
+
+    outputFiles = []
+    csvWriters: dict[tuple[int, str], csv.writer] = {}
+    if bShouldDoOutput:
+        outputTimestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        for methodIndex, (analysisMethod, outputFileName) in enumerate(zip(analysisMethods, outputFileNames)):
+            if outputFileName == "":
+                print("WARNING: The given output file name is empty, using generic name instead.")
+                outputFileName = "generic_" + analysisMethod.__class__.__name__
+
+            for catalogue in list(outCatalogues):
+                try:
+                    fileName = os.path.splitext(outputFileName)[0] + "_" + outputTimestamp + "_" + catalogue + ".csv"
+                    file = open(fileName, 'w')
+                except OSError:
+                    print("WARNING: Unable to create CSV file with specified name, returning results in code instead.")
+                    continue
+                outputFiles.append(file)
+
+                csvWriter = csv.writer(file)
+                csvWriter.writerow((["ID", "Specifiers"] if params.bOutputFileSpecifiers else ["ID"]) + analysisMethod.getOutputHeader())
+                csvWriters[(methodIndex, catalogue)] = csvWriter
+
+    database = None
+    tableNames: list[str] = []
+    if params.databasePath != "":
+        database = resultDatabase.ResultDatabase(params.databasePath)
+        for analysisMethod, outputFileName in zip(analysisMethods, outputFileNames):
+            tableName = os.path.splitext(outputFileName)[0] if outputFileName != "" else analysisMethod.__class__.__name__
+            if tableName in tableNames:
+                tableName += "_" + str(len(tableNames))
+            tableNames.append(tableName)
+            database.createTable(tableName, analysisMethod.__class__.__name__, analysisMethod.getFingerprint(), analysisMethod.getResultColumns())
+
+    workerCount = params.workerCount if params.workerCount > 0 else os.cpu_count()
+    executor = None
+    futures: dict[int, Future] = {}
+    piecesToSubmit = [i for i in range(len(piecesToAnalyse)) if len(pendingMethodIndices[i]) > 0]
+    bShouldProfile = corpusProfile is not None
+
+    try:
+        if workerCount > 1 and len(piecesToSubmit) > 0:
+            try:
+                pickledAnalysisMethods = pickle.dumps(analysisMethods)
+            except Exception as e:
+                raise Exception("The given analysis methods cannot be pickled for use in worker processes: " + str(e))
+
+            print("Analysing " + str(len(piecesToSubmit)) + " pieces using " + str(workerCount) + " worker processes...")
+            executor = ProcessPoolExecutor(max_workers=workerCount, initializer=_initializeWorker,
+                                           initargs=(pickledAnalysisMethods, params.journalPath))
+            for i in piecesToSubmit:
+                journalRecords = _makeJournalRecords(fingerprints, pendingMethodIndices[i], piecesToAnalyse[i],
+                                                     sourceManifest.getChecksum(piecesToAnalyse[i][3])) if resultJournal is not None else None
+                futures[i] = executor.submit(_analyzePieceInWorker, pendingMethodIndices[i], piecesToAnalyse[i][3], bShouldProfile,
+                                             journalRecords)
+
+        # Collect the results in the order of the pieces rather than in completion order to keep the output layout stable
+        for i, (catalogue, pieceNumber, fileSpecifiers, sourcePath) in enumerate(piecesToAnalyse):
+            pieceProfile = None
+            if len(pendingMethodIndices[i]) == 0:
+                analysedResults = []
+            elif executor is None:
+                journalRecords = _makeJournalRecords(fingerprints, pendingMethodIndices[i], piecesToAnalyse[i],
+                                                     sourceManifest.getChecksum(sourcePath)) if resultJournal is not None else None
+                analysedResults, pieceProfile = _analyzePiece(analysisMethods, pendingMethodIndices[i], sourcePath, False, bShouldProfile,
+                                                              resultJournal, journalRecords)
+            else:
+                analysedResults, pieceProfile = futures.pop(i).result()
+            if pieceProfile is not None:
+                corpusProfile.addPieceProfile(pieceProfile)
+
+            pieceDescription = outCatalogues[catalogue] + " (" + catalogue + ")" + ", No. " + pieceNumber + " (" + fileSpecifiers + ")"
+            for methodIndex, (analysisResult, formattedException) in zip(pendingMethodIndices[i], analysedResults):
+                if formattedException is not None:
+                    print("WARNING: Analysis using " + analysisMethods[methodIndex].__class__.__name__ + " failed for " + pieceDescription +
+                          " - piece will be skipped:\n" + formattedException)
+                    continue
+                storedResults[(i, methodIndex)] = analysisResult
+                if resultStores[methodIndex] is not None:
+                    resultStores[methodIndex].storeResult(sourceManifest.getChecksum(sourcePath), analysisResult)
+
+            for methodIndex, analysisMethod in enumerate(analysisMethods):
+                if (i, methodIndex) not in storedResults:
+                    continue
+                result = AnalysisResult(sourcePath, catalogue, pieceNumber, fileSpecifiers, storedResults.pop((i, methodIndex)))
+                methodDescription = "" if len(analysisMethods) == 1 else " [" + analysisMethod.__class__.__name__ + "]"
+                print(pieceDescription + methodDescription + ": " + str(result.resultData))
+
+                if (methodIndex, catalogue) in csvWriters:
+                    with profiling.recordingStages(runRecorder), profiling.measureStage("output"):
+                        line = ([pieceNumber, fileSpecifiers] if params.bOutputFileSpecifiers else [pieceNumber]) + \
+                            analysisMethod.createOutputEntry(result.resultData)
+                        csvWriters[(methodIndex, catalogue)].writerow(line)
+
+                if database is not None:
+                    with profiling.recordingStages(runRecorder), profiling.measureStage("output"):
+                        database.insertResults(tableNames[methodIndex], catalogue, pieceNumber, fileSpecifiers, sourcePath,
+                                               analysisMethod.createResultRows(result.resultData))
+
+                yield methodIndex, result
+
+            for file in outputFiles:
+                file.flush()
+
+        if corpusProfile is not None and params.slowestPiecesToProfile > 0:
+            methodIndicesByPath = {str(piece[3]): methodIndices for piece, methodIndices in zip(piecesToAnalyse, pendingMethodIndices)}
+            _profileSlowestPieces(corpusProfile, analysisMethods, methodIndicesByPath)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        for resultStore in resultStores:
+            if resultStore is not None:
+                resultStore.save()
+        for file in outputFiles:
+            file.close()
+        if database is not None:
+            for analysisMethod, tableName in zip(analysisMethods, tableNames):
+                database.createIndexes(tableName, analysisMethod.getIndexedResultColumns())
+            database.close()
+        if corpusProfile is not None:
+            _writeCorpusProfile(corpusProfile, params.profilingOutputPath)
+
+    print("Analysis complete.")
+    if bShouldDoOutput:
+        print("Export complete.")
+
+
+def collectCatalogueCorpusPieces(corpusName: str,
+                                 cataloguesToIgnore: list[str] = [],
+                                 outCatalogues: dict[str, str] = None,
+                                 bVerbose: bool = False) -> list[tuple[str, str, str, os.path]]:
+    """
+    Collects the pieces of a music21 LocalCorpus that a run over the corpus analyses, in a fixed order, so that serial and parallel runs produce
+    identical results. The metadata of the corpus is not refreshed.
+    @param corpusName: Name of the LocalCorpus.
+    @param cataloguesToIgnore: List of catalogues to ignore by string name.
+    @param outCatalogues: Optional map that is filled with the IDs of all catalogues that are not ignored, matched to composer names.
+    @param bVerbose: Whether to print each catalogue found.
+    @return: List of tuples of the catalogue ID, piece number, file specifiers and path of each piece.
+    @raise: Exception if the corpus contains no catalogues
+    """
+    if outCatalogues is None:
+        outCatalogues = {}
+    corpus = music21.corpus.corpora.LocalCorpus(corpusName)
     metadataFiles = corpus.search('_META', 'sourcePath')
     if len(metadataFiles) == 0:
         raise Exception("The given corpus contains no catalogues.")
@@ -60,56 +476,55 @@ def analyseCatalogueCorpus(corpusName: str,
             composerName = metaFile.metadata.composer
             catalogueId = parsing.getCatalogueId(parsing.getFileNameFromMetadata(metaFile))
 
-            if catalogueId in params.cataloguesToIgnore:
+            if catalogueId in cataloguesToIgnore:
                 continue
 
             outCatalogues[catalogueId] = composerName
-            print("Found catalogue: " + composerName + " (" + catalogueId + ")")
+            if bVerbose:
+                print("Found catalogue: " + composerName + " (" + catalogueId + ")")
 
-    outResults: dict[str, dict] = {}
+    outPieces: list[tuple[str, str, str, os.path]] = []
     for catalogue in list(outCatalogues):
-        outResults[catalogue]: dict[str, AnalysisResult] = {}
-
         currentCatalogue = corpus.search(catalogue, 'sourcePath')
         for piece in currentCatalogue:
             if "_META" in str(piece.sourcePath) or ".expanded." in str(piece.sourcePath):
                 continue
-            analysisResult = analysisMethod.analyze(piece.sourcePath)
             pieceNumber = parsing.getPieceNumber(parsing.getFileNameFromMetadata(piece))
             fileSpecifiers = parsing.getSpecifiers(parsing.getFileNameFromMetadata(piece))
-            outResults[catalogue][pieceNumber] = AnalysisResult(piece.sourcePath, catalogue, pieceNumber, fileSpecifiers, analysisResult)
-            print(outCatalogues[catalogue] + " (" + catalogue + ")" + ", No. " + pieceNumber + " (" + fileSpecifiers + "): " + str(analysisResult))
-
-    if not bShouldDoOutput:
-        return outCatalogues, outResults
+            outPieces.append((catalogue, pieceNumber, fileSpecifiers, piece.sourcePath))
+    return outPieces
 
-    print("Analysis complete - exporting to file.")
 
-    if outputFileName == "":
-        print("WARNING: The given output file name is empty, using generic name instead.")
-        outputFileName = "generic_" + analysisMethod.__class__.__name__
-
-    outputTimestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
-
-    for catalogue in list(outCatalogues):
-        try:
-            fileName = os.path.splitext(outputFileName)[0] + "_" + outputTimestamp + "_" + catalogue + ".csv"
-            file = open(fileName, 'w')
-        except OSError:
-            print("WARNING: Unable to create CSV file with specified name, returning results in code instead.")
-            return outCatalogues, outResults
-
-        csvWriter = csv.writer(file)
-
-        csvWriter.writerow((["ID", "Specifiers"] if params.bOutputFileSpecifiers else ["ID"]) + analysisMethod.getOutputHeader())
-
-        for pieceNumber in list(outResults[catalogue]):
-            result = outResults[catalogue][pieceNumber]
-            line = ([pieceNumber, result.fileSpecifiers] if params.bOutputFileSpecifiers else [pieceNumber]) + analysisMethod.createOutputEntry(
-                result.resultData)
-            csvWriter.writerow(line)
+def _profileSlowestPieces(corpusProfile: profiling.CorpusProfile, analysisMethods: list[AnalysisMethod], methodIndicesByPath: dict[str, list[int]]):
+    """
+    Analyses the slowest pieces of a corpus run again under cProfile and adds their statistics to the profile of the run. The results are
+    discarded, as they have already been output by the run itself.
+    @param corpusProfile: The CorpusProfile of the run.
+    @param analysisMethods: The AnalysisMethod objects of the run.
+    @param methodIndicesByPath: Indices of the analysis methods used for each piece, by the path of the piece.
+    """
+    piecesToProfile = corpusProfile.getPiecesToRunUnderProfiler()
+    if len(piecesToProfile) == 0:
+        return
+    print("Profiling the " + str(len(piecesToProfile)) + " slowest pieces under cProfile...")
+    for pieceProfile in piecesToProfile:
+        sourcePath = pieceProfile["sourcePath"]
+        with profiling.profilingPiece(sourcePath, False, True) as profilerProfile:
+            _analyzePieceWithMethods(analysisMethods, methodIndicesByPath[sourcePath], sourcePath, True, None, None)
+        corpusProfile.addProfilerStats(pieceProfile, profilerProfile["profilerStats"])
 
-        file.close()
 
-    print("Export complete.")
-    return outCatalogues, outResults
+def _writeCorpusProfile(corpusProfile: profiling.CorpusProfile, profilingOutputPath: str):
+    """
+    Completes the profile of a corpus run, prints its summary and writes it to disk.
+    @param corpusProfile: The CorpusProfile of the run.
+    @param profilingOutputPath: Path to the JSON file the profile is written to.
+    """
+    corpusProfile.finish()
+    corpusProfile.printSummary()
+    try:
+        filePaths = corpusProfile.write(profilingOutputPath)
+    except OSError as e:
+        print("WARNING: Unable to write profiling output: " + str(e))
+        return
+    print("Profiling output written to " + ", ".join(map(str, filePaths)))
@@ -2,10 +2,29 @@
 MusiCAU tools module. Provides additional functionality.
 '''
 
+import importlib
+
+
 __all__ = [
+    'caching',
     'corpusManagement',
+    'eventTables',
+    'featureStore',
+    'journal',
+    'manifest',
     'parsing',
+    'profiling',
+    'repeatExpansion',
+    'resultDatabase',
 ]
 
 
-from musicau.tools import *
+def __getattr__(name: str):
+    # Submodules are only imported on first access (PEP 562), see musicau.__getattr__
+    if name in __all__:
+        return importlib.import_module(__name__ + "." + name)
+    raise AttributeError("module '" + __name__ + "' has no attribute '" + name + "'")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
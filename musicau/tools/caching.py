@@ -0,0 +1,317 @@
+import music21
+
+from music21 import freezeThaw
+
+import hashlib
+import os.path
+import pickle
+import tempfile
+import time
+
+
+# Directory in which all cached files are stored. Can be set using the MUSICAU_CACHE_DIR environment variable, which is also respected by worker
+# processes, or by calling setCacheDirectory.
+_cacheDirectory: str = os.environ.get("MUSICAU_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".musicau", "cache"))
+
+# Maximum size of all cached files in bytes before the least recently used files are evicted.
+_maxCacheSize: int = int(os.environ.get("MUSICAU_CACHE_SIZE_MB", "2048")) * 1024 * 1024
+
+# Amount of bytes written since the size of the cache was last checked, used to avoid scanning the cache directory on every write.
+_bytesWrittenSinceEviction: int = -1
+
+# Prefix of temporary files that are written before being atomically moved to their final location.
+_temporaryFilePrefix = ".tmp-"
+
+
+def getCacheDirectory() -> os.path:
+    """
+    Retrieves the directory in which all cached files are stored.
+    @return: The path to the cache directory.
+    """
+    return _cacheDirectory
+
+
+def setCacheDirectory(cacheDirectory: os.path):
+    """
+    Sets the directory in which all cached files are stored. Note that worker processes that are not forked from the current process only pick
+    up the directory given in the MUSICAU_CACHE_DIR environment variable.
+    @param cacheDirectory: The path to the new cache directory.
+    """
+    global _cacheDirectory, _bytesWrittenSinceEviction
+    _cacheDirectory = os.path.abspath(cacheDirectory)
+    _bytesWrittenSinceEviction = -1
+
+
+def setMaxCacheSize(maxCacheSize: int):
+    """
+    Sets the maximum size of the cache before the least recently used files are evicted.
+    @param maxCacheSize: The maximum size in bytes.
+    """
+    global _maxCacheSize, _bytesWrittenSinceEviction
+    _maxCacheSize = maxCacheSize
+    _bytesWrittenSinceEviction = -1
+
+
+def makeEntryName(sourcePath: os.path, sourceChecksum: str, suffix: str) -> str:
+    """
+    Generates the name of a cache entry belonging to a source file. The name contains a digest of the absolute source path, so that files with
+    the same name in different directories do not collide within the shared cache directory.
+    @param sourcePath: Path to the source file the entry belongs to.
+    @param sourceChecksum: Checksum of the contents of the source file.
+    @param suffix: Suffix identifying the kind of entry (i.e. 'expanded.p').
+    @return: The name of the cache entry.
+    """
+    return _makeEntryPrefix(sourcePath) + sourceChecksum + "." + suffix
+
+
+def _makeEntryPrefix(sourcePath: os.path) -> str:
+    pathDigest = hashlib.md5(os.path.abspath(sourcePath).encode()).hexdigest()[:8]
+    return os.path.splitext(os.path.basename(sourcePath))[0] + "." + pathDigest + "."
+
+
+class FileCache:
+    """
+    A category of files within the cache directory. Files are written atomically, so that concurrent workers never read partially written
+    files, and are evicted in least recently used order once the cache grows above its maximum size.
+    """
+    def __init__(self, category: str):
+        """
+        @param category: Name of the category, used as the name of the subdirectory within the cache directory.
+        """
+        self.category: str = category
+
+    def getDirectory(self) -> os.path:
+        """
+        Retrieves the directory in which the files of this category are stored.
+        @return: The path to the directory.
+        """
+        return os.path.join(getCacheDirectory(), self.category)
+
+    def read(self, entryName: str) -> bytes:
+        """
+        Reads a cache entry and marks it as recently used.
+        @param entryName: The name of the entry.
+        @return: The contents of the entry, or None if the entry does not exist.
+        """
+        entryPath = os.path.join(self.getDirectory(), entryName)
+        try:
+            with open(entryPath, "rb") as f:
+                data = f.read()
+            os.utime(entryPath)
+        except OSError:
+            return None
+        return data
+
+    def write(self, entryName: str, data: bytes):
+        """
+        Atomically writes a cache entry.
+        @param entryName: The name of the entry.
+        @param data: The contents of the entry.
+        """
+        global _bytesWrittenSinceEviction
+        directory = self.getDirectory()
+        os.makedirs(directory, exist_ok=True)
+
+        fileDescriptor, temporaryPath = tempfile.mkstemp(dir=directory, prefix=_temporaryFilePrefix)
+        try:
+            with os.fdopen(fileDescriptor, "wb") as f:
+                f.write(data)
+            os.replace(temporaryPath, os.path.join(directory, entryName))
+        except OSError:
+            if os.path.isfile(temporaryPath):
+                os.remove(temporaryPath)
+            raise
+
+        if _bytesWrittenSinceEviction < 0 or _bytesWrittenSinceEviction + len(data) > _maxCacheSize // 20:
+            evictLeastRecentlyUsed()
+            _bytesWrittenSinceEviction = 0
+        else:
+            _bytesWrittenSinceEviction += len(data)
+
+    def remove(self, entryName: str):
+        """
+        Removes a cache entry if it exists.
+        @param entryName: The name of the entry.
+        """
+        try:
+            os.remove(os.path.join(self.getDirectory(), entryName))
+        except OSError:
+            pass
+
+    def removeOutdatedEntries(self, sourcePath: os.path, sourceChecksum: str, suffix: str):
+        """
+        Removes all entries with the given suffix that belong to the source file but were generated from different contents.
+        @param sourcePath: Path to the source file the entries belong to.
+        @param sourceChecksum: Checksum of the current contents of the source file.
+        @param suffix: Suffix identifying the kind of entry.
+        """
+        prefix = _makeEntryPrefix(sourcePath)
+        currentEntryName = makeEntryName(sourcePath, sourceChecksum, suffix)
+        try:
+            entryNames = os.listdir(self.getDirectory())
+        except OSError:
+            return
+        for entryName in entryNames:
+            if entryName != currentEntryName and entryName.startswith(prefix) and entryName.endswith("." + suffix):
+                self.remove(entryName)
+
+
+def evictLeastRecentlyUsed():
+    """
+    Removes the least recently used files from the cache directory until it is below its maximum size. Temporary files of interrupted writes
+    are removed once they are older than an hour.
+    """
+    entries = []
+    totalSize = 0
+    for directory, _, fileNames in os.walk(getCacheDirectory()):
+        for fileName in fileNames:
+            filePath = os.path.join(directory, fileName)
+            try:
+                fileStat = os.stat(filePath)
+            except OSError:
+                continue
+            if fileName.startswith(_temporaryFilePrefix):
+                if fileStat.st_mtime < time.time() - 3600:
+                    _removeFile(filePath)
+                continue
+            entries.append((fileStat.st_mtime, fileStat.st_size, filePath))
+            totalSize += fileStat.st_size
+
+    if totalSize <= _maxCacheSize:
+        return
+
+    for _, fileSize, filePath in sorted(entries):
+        _removeFile(filePath)
+        totalSize -= fileSize
+        if totalSize <= _maxCacheSize:
+            break
+
+
+def _removeFile(filePath: os.path):
+    try:
+        os.remove(filePath)
+    except OSError:
+        pass  # Another process may have removed the file in the meantime
+
+
+_scoreCache = FileCache("scores")
+
+
+def loadScore(sourcePath: os.path, sourceChecksum: str, variant: str) -> music21.stream.Score:
+    """
+    Loads a previously stored score belonging to a source file from the cache.
+    @param sourcePath: Path to the source file the score was generated from.
+    @param sourceChecksum: Checksum of the contents of the source file.
+    @param variant: Name of the variant of the score (i.e. 'expanded').
+    @return: The music21 Score, or None if no valid score is stored for the given source file contents.
+    """
+    entryName = makeEntryName(sourcePath, sourceChecksum, _makeScoreSuffix(variant))
+    data = _scoreCache.read(entryName)
+    if data is None:
+        return None
+
+    try:
+        streamThawer = freezeThaw.StreamThawer()
+        streamThawer.openStr(data)
+        return streamThawer.stream
+    except Exception:
+        print("WARNING: Cached score is invalid and will be regenerated. " + str(sourcePath))
+        _scoreCache.remove(entryName)
+        return None
+
+
+def storeScore(sourcePath: os.path, sourceChecksum: str, variant: str, score: music21.stream.Score):
+    """
+    Stores a score belonging to a source file in the cache, replacing any scores of the same variant that belong to outdated versions of the
+    source file.
+    @param sourcePath: Path to the source file the score was generated from.
+    @param sourceChecksum: Checksum of the contents of the source file.
+    @param variant: Name of the variant of the score (i.e. 'expanded').
+    @param score: The music21 Score to store.
+    """
+    # A score that cannot be stored is simply parsed again next time, so failing to freeze it must not fail the parse
+    try:
+        data = freezeThaw.StreamFreezer(score).writeStr(fmt='pickle')
+        _scoreCache.write(makeEntryName(sourcePath, sourceChecksum, _makeScoreSuffix(variant)), data)
+        _scoreCache.removeOutdatedEntries(sourcePath, sourceChecksum, _makeScoreSuffix(variant))
+    except Exception:
+        print("WARNING: Unable to write to cache directory " + str(getCacheDirectory()))
+
+
+def _makeScoreSuffix(variant: str) -> str:
+    # Frozen streams can only be thawed reliably by the same version of music21
+    return variant + ".m21-" + music21.VERSION_STR + ".p"
+
+
+class ResultStore:
+    """
+    Persisted store of the results of a single analysis method, keyed by the checksum of the analysed source file. Results are stored
+    separately for each fingerprint of the analysis method, so changing the method or its parameters never returns outdated results.
+    """
+    def __init__(self, fingerprint: str):
+        """
+        @param fingerprint: The fingerprint of the analysis method, as returned by AnalysisMethod.getFingerprint.
+        """
+        self.fingerprint: str = fingerprint
+        self.results: dict[str, any] = {}
+        self.__newResults: dict[str, any] = {}
+        self.__entryName: str = hashlib.md5(fingerprint.encode()).hexdigest()[:16] + ".p"
+        self.__fileCache = FileCache("results")
+        self.load()
+
+    def load(self):
+        """
+        Loads the persisted results, discarding any results that have not been saved yet.
+        """
+        self.results = {}
+        self.__newResults = {}
+        data = self.__fileCache.read(self.__entryName)
+        if data is None:
+            return
+        try:
+            storedResults = pickle.loads(data)
+        except Exception:
+            print("WARNING: Stored results are invalid and will be discarded: " + self.fingerprint)
+            return
+        if storedResults.get("fingerprint") == self.fingerprint:
+            self.results = storedResults["results"]
+
+    def save(self):
+        """
+        Persists all results added since the store was loaded. Results stored by other processes in the meantime are kept.
+        """
+        if len(self.__newResults) == 0:
+            return
+
+        newResults = self.__newResults
+        self.load()
+        self.results.update(newResults)
+        try:
+            self.__fileCache.write(self.__entryName, pickle.dumps({"fingerprint": self.fingerprint, "results": self.results}))
+        except (OSError, pickle.PicklingError) as e:
+            print("WARNING: Unable to store analysis results: " + str(e))
+
+    def hasResult(self, sourceChecksum: str) -> bool:
+        """
+        Checks whether a result is stored for a source file.
+        @param sourceChecksum: Checksum of the contents of the source file.
+        @return: True if a result is stored, otherwise False.
+        """
+        return sourceChecksum in self.results
+
+    def getResult(self, sourceChecksum: str) -> any:
+        """
+        Retrieves the stored result for a source file.
+        @param sourceChecksum: Checksum of the contents of the source file.
+        @return: The stored result data, or None if no result is stored.
+        """
+        return self.results.get(sourceChecksum)
+
+    def storeResult(self, sourceChecksum: str, resultData: any):
+        """
+        Adds the result for a source file to the store. The result is persisted when calling save.
+        @param sourceChecksum: Checksum of the contents of the source file.
+        @param resultData: The result data of the analysis.
+        """
+        self.results[sourceChecksum] = resultData
+        self.__newResults[sourceChecksum] = resultData
@@ -1,5 +1,13 @@
 from music21 import corpus, environment
 
+from musicau.tools import manifest
+
+import os.path
+
+
+# Minimum amount of new or changed files before their metadata is extracted using multiple processes.
+MIN_FILES_FOR_MULTIPROCESSING = 8
+
 
 def refreshCorpora(bVerbose: bool = False):
     """
@@ -10,8 +18,7 @@ def refreshCorpora(bVerbose: bool = False):
     for localCorpus in localCorpora:
         if bVerbose:
             print("Refreshing metadata for " + localCorpus + "...")
-        corpus.corpora.LocalCorpus(localCorpus).cacheMetadata(useMultiprocessing=False, verbose=bVerbose)
-        corpus.corpora.LocalCorpus(localCorpus).save()
+        _refreshLocalCorpus(corpus.corpora.LocalCorpus(localCorpus), bVerbose)
 
 
 def refreshCorpus(corpusName: str, bVerbose: bool = False) -> bool:
@@ -25,6 +32,58 @@ def refreshCorpus(corpusName: str, bVerbose: bool = False) -> bool:
         return False
     if bVerbose:
         print("Refreshing metadata for " + corpusName + "...")
-    corpus.corpora.LocalCorpus(corpusName).cacheMetadata(useMultiprocessing=False, verbose=bVerbose)
-    corpus.corpora.LocalCorpus(corpusName).save()
+    _refreshLocalCorpus(corpus.corpora.LocalCorpus(corpusName), bVerbose)
     return True
+
+
+def isGeneratedFile(filePath: os.path) -> bool:
+    """
+    Checks whether a file in a corpus directory was generated by MusiCAU rather than being a source file.
+    @param filePath: Path to the file.
+    @return: True if the file was generated (such as a file with expanded repeats), otherwise False.
+    """
+    return ".expanded." in os.path.basename(filePath)
+
+
+def _refreshLocalCorpus(localCorpus: corpus.corpora.LocalCorpus, bVerbose: bool):
+    """
+    Incrementally refreshes the metadata of a music21 LocalCorpus. Metadata is only extracted for files that were added or changed since the last
+    refresh, and entries of removed files are dropped. Generated files are excluded from the corpus metadata.
+    @param localCorpus: The music21 LocalCorpus to refresh.
+    @param bVerbose: Whether to print verbose debug information.
+    """
+    sourcePaths = [path for path in localCorpus.getPaths() if not isGeneratedFile(path)]
+    metadataBundle = localCorpus.metadataBundle
+
+    # The metadata manifest tracks the state of each file as of the last refresh, independent of the manifest used for parsing
+    metadataManifest = manifest.CorpusManifest("metadata." + localCorpus.name)
+    changedPaths = set(map(str, metadataManifest.refresh(sourcePaths)))
+
+    # music21 offers no public way of removing single entries from a metadata bundle, so the entries are accessed directly
+    currentPaths = set(map(str, sourcePaths))
+    bundledPaths = set()
+    bHasRemovedEntries = False
+    for key, metadataEntry in list(metadataBundle._metadataEntries.items()):
+        entryPath = str(metadataEntry.sourcePath)
+        if entryPath not in currentPaths or entryPath in changedPaths:
+            del metadataBundle._metadataEntries[key]
+            bHasRemovedEntries = True
+        else:
+            bundledPaths.add(entryPath)
+
+    pathsToAdd = [path for path in sourcePaths if str(path) not in bundledPaths]
+    if bVerbose:
+        print("Found " + str(len(pathsToAdd)) + " new or changed files, " + str(len(sourcePaths) - len(pathsToAdd)) + " unchanged.")
+
+    if len(pathsToAdd) > 0:
+        failingPaths = metadataBundle.addFromPaths(pathsToAdd,
+                                                   parseUsingCorpus=localCorpus.parseUsingCorpus,
+                                                   useMultiprocessing=len(pathsToAdd) >= MIN_FILES_FOR_MULTIPROCESSING,
+                                                   storeOnDisk=False,
+                                                   verbose=False)
+        for failingPath in failingPaths:
+            print("WARNING: Unable to read metadata from file: " + str(failingPath))
+
+    if len(pathsToAdd) > 0 or bHasRemovedEntries:
+        metadataBundle.write()
+    metadataManifest.save()
@@ -0,0 +1,328 @@
+import music21
+
+from musicau.tools import caching, manifest, parsing
+
+from xml.etree import ElementTree
+import io
+import os.path
+
+import numpy
+
+
+# Version of the stored event table format. Increase whenever the contents of the tables change so that outdated tables are regenerated.
+EVENT_TABLE_VERSION = 2
+
+# Base values of the natural pitches in the base-40 pitch encoding, in which each octave spans 40 values.
+BASE40_STEP_VALUES = {"C": 2, "D": 8, "E": 14, "F": 19, "G": 25, "A": 31, "B": 37}
+
+
+def encodePitchBase40(pitch: music21.pitch.Pitch) -> int:
+    """
+    Encodes a music21 Pitch in the base-40 encoding, which preserves the spelling of a pitch and allows transposition by integer addition.
+    @param pitch: The music21 Pitch to encode.
+    @return: The base-40 value of the pitch.
+    """
+    octave = pitch.octave if pitch.octave is not None else pitch.implicitOctave
+    return BASE40_STEP_VALUES[pitch.step] + int(pitch.alter) + octave * 40
+
+
+class PartEventTable:
+    """
+    Structure of arrays holding the notes of a single part, sorted by offset. Simultaneous notes (i.e. in different voices) keep the order in which
+    they appear in the part. Chords are represented by their first pitch.
+    """
+    def __init__(self,
+                 pitches: numpy.ndarray,
+                 offsets: numpy.ndarray,
+                 durations: numpy.ndarray,
+                 fermatas: numpy.ndarray,
+                 figureIds: numpy.ndarray,
+                 measureIndices: numpy.ndarray):
+        """
+        @param pitches: Base-40 pitch of each note.
+        @param offsets: Offset of each note from the beginning of the part.
+        @param durations: Duration of each note in quarter lengths.
+        @param fermatas: Whether each note carries a fermata.
+        @param figureIds: Index of the figure (lyric) of each note within the figure strings of the piece, 0 if the note has no figure.
+        @param measureIndices: Index of the measure each note is in within the measures of the piece.
+        """
+        self.pitches: numpy.ndarray = pitches
+        self.offsets: numpy.ndarray = offsets
+        self.durations: numpy.ndarray = durations
+        self.fermatas: numpy.ndarray = fermatas
+        self.figureIds: numpy.ndarray = figureIds
+        self.measureIndices: numpy.ndarray = measureIndices
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def getIndexAtOffset(self, offset: float) -> int:
+        """
+        Retrieves the index of the first note starting at a given offset, using a binary search.
+        @param offset: The offset from the beginning of the part.
+        @return: The index of the note, or -1 if no note starts at the offset.
+        """
+        index = int(numpy.searchsorted(self.offsets, offset))
+        return index if index < len(self.offsets) and self.offsets[index] == offset else -1
+
+    def getFermataOffsets(self) -> numpy.ndarray:
+        """
+        Retrieves the offsets of all notes carrying a fermata.
+        @return: Sorted array of offsets.
+        """
+        return self.offsets[self.fermatas]
+
+
+class PieceEventTable:
+    """
+    Compact representation of the notes of all parts of a piece, which can be queried without instantiating any music21 streams.
+    """
+    def __init__(self,
+                 parts: list[PartEventTable],
+                 figureStrings: list[str],
+                 measureOffsets: numpy.ndarray,
+                 measureLabels: list[str],
+                 keySignatures: numpy.ndarray,
+                 timeSignatures: list[str]):
+        """
+        @param parts: The event tables of the parts, in the order of the parts in the score.
+        @param figureStrings: The distinct figures (lyrics) of the piece, referenced by index from the part tables. Index 0 is the empty figure.
+        @param measureOffsets: Offset of each measure from the beginning of the piece.
+        @param measureLabels: Label of each measure as it appears in the measure map.
+        @param keySignatures: Amount of sharps (negative for flats) of the key signature in effect at the end of each measure of the first part, 0
+        if there is none.
+        @param timeSignatures: Ratio (i.e. '3/4') of the time signature in effect at the end of each measure of the first part, empty if there is
+        none.
+        """
+        self.parts: list[PartEventTable] = parts
+        self.figureStrings: list[str] = figureStrings
+        self.measureOffsets: numpy.ndarray = measureOffsets
+        self.measureLabels: list[str] = measureLabels
+        self.keySignatures: numpy.ndarray = keySignatures
+        self.timeSignatures: list[str] = timeSignatures
+
+    def getFigure(self, figureId: int) -> str:
+        """
+        Retrieves a figure string by its index.
+        @param figureId: The index of the figure.
+        @return: The figure, empty if the index is 0.
+        """
+        return self.figureStrings[figureId]
+
+    def getFigureAtOffset(self, offset: float, partIndex: int = 2) -> str:
+        """
+        Retrieves the figure at a given offset, equivalent to actions.getFiguredBassAtOffset.
+        @param offset: The offset from the beginning of the piece.
+        @param partIndex: Index of the part containing the figured bass information as lyrics.
+        @return: The figure at the offset, empty if there is none.
+        """
+        part = self.parts[partIndex]
+        index = part.getIndexAtOffset(offset)
+        if index < 0:
+            return ''
+        # Several notes may start at the same offset, return the first one that carries a figure
+        while index < len(part) and part.offsets[index] == offset:
+            if part.figureIds[index] != 0:
+                return self.figureStrings[part.figureIds[index]]
+            index += 1
+        return ''
+
+    def toBytes(self) -> bytes:
+        """
+        Serializes the event table into the compressed NumPy .npz format.
+        @return: The serialized event table.
+        """
+        arrays = {"version": numpy.array(EVENT_TABLE_VERSION),
+                  "figureStrings": numpy.array(self.figureStrings, dtype=str),
+                  "measureOffsets": self.measureOffsets,
+                  "measureLabels": numpy.array(self.measureLabels, dtype=str),
+                  "keySignatures": self.keySignatures,
+                  "timeSignatures": numpy.array(self.timeSignatures, dtype=str)}
+        for i, part in enumerate(self.parts):
+            arrays["part" + str(i) + ".pitches"] = part.pitches
+            arrays["part" + str(i) + ".offsets"] = part.offsets
+            arrays["part" + str(i) + ".durations"] = part.durations
+            arrays["part" + str(i) + ".fermatas"] = part.fermatas
+            arrays["part" + str(i) + ".figureIds"] = part.figureIds
+            arrays["part" + str(i) + ".measureIndices"] = part.measureIndices
+        outBuffer = io.BytesIO()
+        numpy.savez_compressed(outBuffer, **arrays)
+        return outBuffer.getvalue()
+
+    @staticmethod
+    def fromBytes(data: bytes):
+        """
+        Deserializes an event table from the compressed NumPy .npz format.
+        @param data: The serialized event table.
+        @return: The PieceEventTable.
+        @raise: ValueError if the data is not a valid event table of the current version
+        """
+        with numpy.load(io.BytesIO(data), allow_pickle=False) as arrays:
+            if int(arrays["version"]) != EVENT_TABLE_VERSION:
+                raise ValueError("Outdated event table version.")
+            parts = []
+            while "part" + str(len(parts)) + ".offsets" in arrays:
+                prefix = "part" + str(len(parts)) + "."
+                parts.append(PartEventTable(arrays[prefix + "pitches"],
+                                            arrays[prefix + "offsets"],
+                                            arrays[prefix + "durations"],
+                                            arrays[prefix + "fermatas"],
+                                            arrays[prefix + "figureIds"],
+                                            arrays[prefix + "measureIndices"]))
+            return PieceEventTable(parts, arrays["figureStrings"].tolist(), arrays["measureOffsets"], arrays["measureLabels"].tolist(),
+                                   arrays["keySignatures"], arrays["timeSignatures"].tolist())
+
+
+def makePartEventTable(pitches: list[int],
+                       offsets: list[float],
+                       durations: list[float],
+                       fermatas: list[bool],
+                       figures: list[str],
+                       measureIndices: list[int],
+                       figureStrings: list[str]) -> PartEventTable:
+    """
+    Creates the event table of a part from lists holding the values of its notes in the order in which they appear in the part.
+    @param pitches: Base-40 pitch of each note.
+    @param offsets: Offset of each note from the beginning of the part.
+    @param durations: Duration of each note in quarter lengths.
+    @param fermatas: Whether each note carries a fermata.
+    @param figures: Figure (lyric) of each note with 'h' written as 'n', empty if the note has none.
+    @param measureIndices: Index of the measure each note is in within the measures of the piece.
+    @param figureStrings: The distinct figures of the piece, shared between all of its parts and starting with the empty figure. Figures that are
+    not contained yet are appended.
+    @return: The PartEventTable of the part.
+    """
+    figureIdsByString = {figure: i for i, figure in enumerate(figureStrings)}
+    figureIds = []
+    for figure in figures:
+        if figure not in figureIdsByString:
+            figureIdsByString[figure] = len(figureStrings)
+            figureStrings.append(figure)
+        figureIds.append(figureIdsByString[figure])
+
+    # Notes in different voices of a measure are not stored in offset order, so sort them while keeping the order of simultaneous notes
+    order = numpy.argsort(numpy.array(offsets, dtype=numpy.float64), kind='stable')
+    return PartEventTable(numpy.array(pitches, dtype=numpy.int32)[order],
+                          numpy.array(offsets, dtype=numpy.float64)[order],
+                          numpy.array(durations, dtype=numpy.float64)[order],
+                          numpy.array(fermatas, dtype=bool)[order],
+                          numpy.array(figureIds, dtype=numpy.int32)[order],
+                          numpy.array(measureIndices, dtype=numpy.int32)[order])
+
+
+def makeEventTableFromScore(score: music21.stream.Score, measureMap: dict[float, str]) -> PieceEventTable:
+    """
+    Extracts the event table from a parsed score.
+    @param score: The music21 Score stream, as returned by parsing.parsePieceByPath.
+    @param measureMap: The measure map of the score, as returned by parsing.parsePieceByPath.
+    @return: The PieceEventTable of the score.
+    """
+    figureStrings = ['']
+    measureOffsets = list(measureMap.keys())
+    measureIndicesByOffset = {offset: i for i, offset in enumerate(measureOffsets)}
+
+    parts = []
+    for part in score.parts:
+        pitches, offsets, durations, fermatas, figures, measureIndices = [], [], [], [], [], []
+        for measure in part.getElementsByClass('Measure'):
+            measureIndex = measureIndicesByOffset.get(measure.offset, -1)
+            measureIterator = measure.recurse().notes
+            for note in measureIterator:
+                pitches.append(encodePitchBase40(note.pitches[0]))
+                offsets.append(float(measure.offset + measureIterator.currentHierarchyOffset()))
+                durations.append(float(note.duration.quarterLength))
+                fermatas.append(any(isinstance(e, music21.expressions.Fermata) for e in note.expressions))
+                figures.append(note.lyric.replace("h", "n") if note.lyric is not None else '')
+                measureIndices.append(measureIndex)
+        parts.append(makePartEventTable(pitches, offsets, durations, fermatas, figures, measureIndices, figureStrings))
+
+    # Key and time signatures are taken from the measures of the first part, which are the measures of the measure map
+    keySignatures, timeSignatures = [], []
+    keySignature, timeSignature = 0, ''
+    for measure in score.parts[0].getElementsByClass('Measure') if len(score.parts) > 0 else []:
+        for element in measure.getElementsByClass('KeySignature'):
+            keySignature = element.sharps
+        for element in measure.getElementsByClass('TimeSignature'):
+            timeSignature = element.ratioString
+        keySignatures.append(keySignature)
+        timeSignatures.append(timeSignature)
+
+    return PieceEventTable(parts, figureStrings, numpy.array(measureOffsets, dtype=numpy.float64), list(measureMap.values()),
+                           numpy.array(keySignatures, dtype=numpy.int32), timeSignatures)
+
+
+def compareEventTables(first: PieceEventTable, second: PieceEventTable) -> list[str]:
+    """
+    Compares two event tables of the same piece, i.e. to validate one way of extracting event tables against another.
+    @param first: The first PieceEventTable.
+    @param second: The second PieceEventTable.
+    @return: List of descriptions of the differences, empty if the tables are equal.
+    """
+    outDifferences = []
+    if len(first.parts) != len(second.parts):
+        outDifferences.append("part count " + str(len(first.parts)) + " != " + str(len(second.parts)))
+    for name in ["measureOffsets", "measureLabels", "keySignatures", "timeSignatures"]:
+        if not numpy.array_equal(numpy.asarray(getattr(first, name)), numpy.asarray(getattr(second, name))):
+            outDifferences.append(name + " differ")
+
+    for i, (firstPart, secondPart) in enumerate(zip(first.parts, second.parts)):
+        if len(firstPart) != len(secondPart):
+            outDifferences.append("part " + str(i) + ": note count " + str(len(firstPart)) + " != " + str(len(secondPart)))
+            continue
+        for name in ["pitches", "offsets", "durations", "fermatas", "measureIndices"]:
+            mismatches = numpy.flatnonzero(getattr(firstPart, name) != getattr(secondPart, name))
+            if len(mismatches) > 0:
+                outDifferences.append("part " + str(i) + ": " + name + " differ at " + str(len(mismatches)) + " notes, first at offset " +
+                                      str(firstPart.offsets[mismatches[0]]))
+        # Figures are compared by their strings, as their indices depend on the order in which they were first found
+        firstFigures = [first.figureStrings[figureId] for figureId in firstPart.figureIds]
+        secondFigures = [second.figureStrings[figureId] for figureId in secondPart.figureIds]
+        if firstFigures != secondFigures:
+            outDifferences.append("part " + str(i) + ": figures differ")
+    return outDifferences
+
+
+_eventTableCache = caching.FileCache("events")
+
+
+def getEventTable(sourcePath: os.path, bShouldExpandRepeats: bool) -> PieceEventTable:
+    """
+    Retrieves the event table of a piece. Event tables are stored in the cache directory once per version of the source file, so that they can
+    be loaded without parsing the piece again. Event tables are made by parsing.parseEventTableByPath, which also expands repeats, without parsing
+    the piece with music21.
+    @param sourcePath: Path to the MusicXML file.
+    @param bShouldExpandRepeats: Whether the event table should be generated from the piece with its repeats rolled out.
+    @return: The PieceEventTable of the piece, or None if the piece could not be parsed.
+    """
+    if not os.path.isfile(sourcePath):
+        return None
+
+    sourceFileChecksum = manifest.getSourceChecksum(sourcePath)
+    entryName = caching.makeEntryName(sourcePath, sourceFileChecksum, _makeEventTableSuffix(bShouldExpandRepeats))
+    data = _eventTableCache.read(entryName)
+    if data is not None:
+        try:
+            return PieceEventTable.fromBytes(data)
+        except (ValueError, KeyError, OSError):
+            _eventTableCache.remove(entryName)
+
+    # Pieces are streamed straight into an event table, falling back to music21 for files the streaming parser does not support
+    try:
+        outEventTable = parsing.parseEventTableByPath(sourcePath, bShouldExpandRepeats)
+    except (ValueError, ElementTree.ParseError):
+        outEventTable = None
+    if outEventTable is None:
+        score, measureMap = parsing.parsePieceByPath(sourcePath, bShouldExpandRepeats)
+        if score is None:
+            return None
+        outEventTable = makeEventTableFromScore(score, measureMap)
+    try:
+        _eventTableCache.write(entryName, outEventTable.toBytes())
+        _eventTableCache.removeOutdatedEntries(sourcePath, sourceFileChecksum, _makeEventTableSuffix(bShouldExpandRepeats))
+    except OSError:
+        print("WARNING: Unable to write to cache directory " + str(caching.getCacheDirectory()))
+    return outEventTable
+
+
+def _makeEventTableSuffix(bShouldExpandRepeats: bool) -> str:
+    return ("expanded" if bShouldExpandRepeats else "unexpanded") + ".v" + str(EVENT_TABLE_VERSION) + ".npz"
@@ -0,0 +1,159 @@
+import os.path
+import sqlite3
+
+
+# Amount of pieces whose features are inserted within a single transaction.
+PIECES_PER_TRANSACTION = 20
+
+# Columns of the feature tables, apart from the ID of the piece every row belongs to, as tuples of the column name and its SQLite type.
+MEASURE_COLUMNS = [("measureIndex", "INTEGER"), ("label", "TEXT"), ("offset", "REAL"), ("timeSignature", "TEXT")]
+NOTE_COLUMNS = [("part", "INTEGER"), ("noteIndex", "INTEGER"), ("pitchIndex", "INTEGER"), ("voice", "TEXT"), ("offset", "REAL"),
+                ("duration", "REAL"), ("position", "TEXT"), ("measure", "TEXT"), ("beat", "REAL"), ("pitch40", "INTEGER"), ("midi", "REAL"),
+                ("name", "TEXT"), ("tie", "TEXT"), ("fermata", "INTEGER")]
+FIGURE_COLUMNS = [("figureIndex", "INTEGER"), ("offset", "REAL"), ("position", "TEXT"), ("measure", "TEXT"), ("beat", "REAL"),
+                  ("figure", "TEXT"), ("figureCount", "INTEGER")]
+CLOSURE_COLUMNS = [("closureIndex", "INTEGER"), ("offset", "REAL"), ("position", "TEXT"), ("measure", "TEXT"), ("beat", "REAL"),
+                   ("pitch40", "INTEGER"), ("phraseStart", "REAL")]
+
+_featureTables = {
+    "measures": (MEASURE_COLUMNS, ["measureIndex"]),
+    "notes": (NOTE_COLUMNS, ["part", "noteIndex", "pitchIndex"]),
+    "figures": (FIGURE_COLUMNS, ["figureIndex"]),
+    "closures": (CLOSURE_COLUMNS, ["closureIndex"]),
+}
+
+# Indexes of the feature tables as tuples of the table and the indexed columns.
+_featureIndexes = [
+    ("pieces", ["catalogue", "pieceNumber", "specifiers"]),
+    ("notes", ["pieceId", "part", "offset"]),
+    ("notes", ["pitch40"]),
+    ("figures", ["pieceId", "offset"]),
+    ("figures", ["figure"]),
+    ("closures", ["pieceId", "offset"]),
+]
+
+
+class FeatureStore:
+    """
+    SQLite database holding the features of every piece of a corpus that most queries need (measures, notes of every part, figures and closures),
+    so that they can be queried without parsing the corpus with music21. Every piece is stored twice, with and without expanded repeats, each
+    version identified by its own piece ID. Offsets, measures and beats of a version refer to that version.
+    """
+    def __init__(self, filePath: os.path):
+        """
+        @param filePath: Path to the database file, which is created if it does not exist.
+        """
+        self.filePath: os.path = filePath
+        self.connection: sqlite3.Connection = sqlite3.connect(filePath)
+        self.__pendingPieceCount: int = 0
+
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS pieces (pieceId INTEGER PRIMARY KEY, catalogue TEXT NOT NULL, "
+                                    "pieceNumber TEXT NOT NULL, specifiers TEXT NOT NULL, expanded INTEGER NOT NULL, sourcePath TEXT NOT NULL, "
+                                    "checksum TEXT NOT NULL, featureVersion INTEGER NOT NULL, UNIQUE (sourcePath, expanded))")
+            for tableName, (columns, keyColumns) in _featureTables.items():
+                columnDefinitions = ", ".join(columnName + " " + columnType for columnName, columnType in columns)
+                self.connection.execute("CREATE TABLE IF NOT EXISTS " + tableName + " (pieceId INTEGER NOT NULL, " + columnDefinitions + ", "
+                                        "PRIMARY KEY (pieceId, " + ", ".join(keyColumns) + "))")
+
+    def getPieceChecksums(self, featureVersion: int) -> dict[str, str]:
+        """
+        Retrieves the checksums of all stored pieces whose features were extracted by a given version of the extraction, and are stored both with
+        and without expanded repeats.
+        @param featureVersion: The version of the feature extraction.
+        @return: Dictionary matching the paths of the source files to their checksums at the time of extraction.
+        """
+        rows = self.connection.execute("SELECT sourcePath, checksum FROM pieces WHERE featureVersion = ? GROUP BY sourcePath, checksum "
+                                       "HAVING COUNT(*) = 2", (featureVersion,)).fetchall()
+        return {sourcePath: checksum for sourcePath, checksum in rows}
+
+    def storePiece(self,
+                   catalogue: str,
+                   pieceNumber: str,
+                   specifiers: str,
+                   bIsExpanded: bool,
+                   sourcePath: os.path,
+                   checksum: str,
+                   featureVersion: int,
+                   features: dict[str, list[tuple]]):
+        """
+        Stores the features of a piece, replacing any features stored for the same version of the piece. Pieces are committed in batches, and when
+        calling commit or close.
+        @param catalogue: The catalogue ID of the piece.
+        @param pieceNumber: The number of the piece within the catalogue.
+        @param specifiers: The file specifiers of the piece.
+        @param bIsExpanded: Whether the features were extracted with expanded repeats.
+        @param sourcePath: Path to the MusicXML file.
+        @param checksum: The checksum of the file the features were extracted from.
+        @param featureVersion: The version of the feature extraction.
+        @param features: Dictionary matching the names of the feature tables ('measures', 'notes', 'figures' and 'closures') to their rows, each
+        row being a tuple of the values of the columns of the table (see MEASURE_COLUMNS etc.).
+        @raise: Exception if a row does not match the columns of its table
+        """
+        self.__removePieceIds(self.connection.execute("SELECT pieceId FROM pieces WHERE sourcePath = ? AND expanded = ?",
+                                                      (str(sourcePath), int(bIsExpanded))).fetchall())
+        pieceId = self.connection.execute("INSERT INTO pieces (catalogue, pieceNumber, specifiers, expanded, sourcePath, checksum, featureVersion) "
+                                          "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                          (catalogue, pieceNumber, specifiers, int(bIsExpanded), str(sourcePath), checksum, featureVersion)).lastrowid
+        for tableName, (columns, _) in _featureTables.items():
+            rows = features.get(tableName, [])
+            for row in rows:
+                if len(row) != len(columns):
+                    raise Exception("The feature row " + str(row) + " does not match the " + str(len(columns)) + " columns of table " +
+                                    tableName + ".")
+            self.connection.executemany("INSERT INTO " + tableName + " VALUES (" + ", ".join(["?"] * (len(columns) + 1)) + ")",
+                                        [(pieceId,) + tuple(row) for row in rows])
+
+        self.__pendingPieceCount += 1
+        if self.__pendingPieceCount >= PIECES_PER_TRANSACTION:
+            self.commit()
+
+    def removePieces(self, sourcePathsToKeep: list[os.path]) -> int:
+        """
+        Removes all pieces whose source files are not among the given ones, i.e. pieces that were removed from the corpus.
+        @param sourcePathsToKeep: Paths to the source files of the pieces to keep.
+        @return: The amount of removed pieces, counting each version of a piece.
+        """
+        pathsToKeep = {str(sourcePath) for sourcePath in sourcePathsToKeep}
+        pieceIds = [(pieceId,) for pieceId, sourcePath in self.connection.execute("SELECT pieceId, sourcePath FROM pieces").fetchall()
+                    if sourcePath not in pathsToKeep]
+        self.__removePieceIds(pieceIds)
+        return len(pieceIds)
+
+    def __removePieceIds(self, pieceIds: list[tuple[int]]):
+        for tableName in list(_featureTables) + ["pieces"]:
+            self.connection.executemany("DELETE FROM " + tableName + " WHERE pieceId = ?", pieceIds)
+
+    def createIndexes(self):
+        """
+        Creates the indexes of the feature tables. Creating the indexes once all pieces are stored is faster than updating them with every
+        insertion, but existing indexes are kept up to date when storing further pieces.
+        """
+        with self.connection:
+            for tableName, indexedColumns in _featureIndexes:
+                self.connection.execute("CREATE INDEX IF NOT EXISTS " + tableName + "_" + "_".join(indexedColumns) + " ON " + tableName +
+                                        " (" + ", ".join(indexedColumns) + ")")
+            self.connection.execute("ANALYZE")
+
+    def commit(self):
+        """
+        Commits all stored pieces.
+        """
+        self.connection.commit()
+        self.__pendingPieceCount = 0
+
+    def query(self, statement: str, parameters: tuple = ()) -> list[tuple]:
+        """
+        Runs an SQL query on the database.
+        @param statement: The SQL statement.
+        @param parameters: Values for the placeholders in the statement.
+        @return: List of the resulting rows.
+        """
+        return self.connection.execute(statement, parameters).fetchall()
+
+    def close(self):
+        """
+        Commits all stored pieces and closes the database.
+        """
+        self.commit()
+        self.connection.close()
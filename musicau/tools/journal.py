@@ -0,0 +1,111 @@
+import os.path
+import pickle
+import struct
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Not available on Windows, where concurrent appends are not locked but damaged records are still detected and skipped
+
+
+# Marker at the beginning of every record, used to find the next record after a damaged one.
+JOURNAL_RECORD_MARKER = b"MCJ1"
+
+# Header of every record, consisting of the marker, the length of the pickled record and its CRC-32 checksum.
+_recordHeader = struct.Struct("<4sII")
+
+
+class ResultJournal:
+    """
+    Append-only journal of the results of a run over a corpus, written as soon as each piece has been analysed, so that an interrupted run can be
+    resumed. Each record is written in a single locked append, which allows several processes to append to the same journal at the same time.
+    Records are checked against their checksum when reading, so partially written records (i.e. of a process that was killed) are skipped.
+    """
+    def __init__(self, filePath: os.path):
+        """
+        @param filePath: Path to the journal file, which is created on the first append.
+        """
+        self.filePath: os.path = filePath
+
+    def clear(self):
+        """
+        Removes all records from the journal.
+        """
+        with open(self.filePath, 'wb'):
+            pass
+
+    def append(self, records: list[dict]):
+        """
+        Appends records to the journal.
+        @param records: The records, each of which must be picklable.
+        """
+        data = b"".join(_encodeRecord(record) for record in records)
+        if len(data) == 0:
+            return
+
+        fileDescriptor = os.open(self.filePath, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fileDescriptor, fcntl.LOCK_EX)
+            bytesWritten = 0
+            while bytesWritten < len(data):
+                bytesWritten += os.write(fileDescriptor, data[bytesWritten:])
+        finally:
+            # Closing the file releases the lock
+            os.close(fileDescriptor)
+
+    def read(self) -> list[dict]:
+        """
+        Reads all intact records of the journal.
+        @return: List of the records in the order they were appended.
+        """
+        try:
+            with open(self.filePath, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return []
+
+        outRecords = []
+        damagedRecordCount = 0
+        position = 0
+        while position < len(data):
+            record, nextPosition = _decodeRecord(data, position)
+            if record is None:
+                # Skip ahead to the next marker, as records appended after a damaged one are intact
+                damagedRecordCount += 1
+                nextPosition = data.find(JOURNAL_RECORD_MARKER, position + 1)
+                if nextPosition < 0:
+                    break
+            else:
+                outRecords.append(record)
+            position = nextPosition
+
+        if damagedRecordCount > 0:
+            print("WARNING: Skipped " + str(damagedRecordCount) + " damaged records in journal " + str(self.filePath))
+        return outRecords
+
+
+def _encodeRecord(record: dict) -> bytes:
+    payload = pickle.dumps(record)
+    return _recordHeader.pack(JOURNAL_RECORD_MARKER, len(payload), zlib.crc32(payload)) + payload
+
+
+def _decodeRecord(data: bytes, position: int) -> tuple[dict, int]:
+    """
+    Decodes the record starting at a given position.
+    @param data: The contents of the journal.
+    @param position: The position of the record within the contents.
+    @return: A tuple containing the record (or None if the record is damaged or incomplete) and the position of the next record.
+    """
+    headerEnd = position + _recordHeader.size
+    if headerEnd > len(data):
+        return None, len(data)
+    marker, payloadLength, checksum = _recordHeader.unpack_from(data, position)
+    payloadEnd = headerEnd + payloadLength
+    if marker != JOURNAL_RECORD_MARKER or payloadEnd > len(data) or zlib.crc32(data[headerEnd:payloadEnd]) != checksum:
+        return None, headerEnd
+    try:
+        return pickle.loads(data[headerEnd:payloadEnd]), payloadEnd
+    except Exception:
+        return None, payloadEnd
@@ -0,0 +1,148 @@
+from musicau.tools import caching
+
+import atexit
+import hashlib
+import json
+import os.path
+
+
+# Size of the chunks in which files are read when calculating their checksums.
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+
+def calculateChecksum(filePath: os.path) -> str:
+    """
+    Calculates the checksum of the contents of a file, reading the file in chunks so it never has to be held in memory in its entirety.
+    @param filePath: Path to the file.
+    @return: The first 12 characters of the MD5 hex digest of the file contents.
+    """
+    md5 = hashlib.md5()
+    with open(filePath, "rb") as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b""):
+            md5.update(chunk)
+    return md5.hexdigest()[:12]
+
+
+class CorpusManifest:
+    """
+    Persisted record of the size, modification time and checksum of source files. Checksums are only recalculated for files whose size or
+    modification time has changed since they were last recorded.
+    """
+    def __init__(self, name: str = "sources"):
+        """
+        @param name: Name of the manifest, used as the name of the file in which it is persisted within the cache directory.
+        """
+        self.name: str = name
+        self.entries: dict[str, tuple[int, int, str]] = {}
+        self.changedPaths: set[str] = set()
+        self.__fileCache = caching.FileCache("manifests")
+        self.load()
+
+    def load(self):
+        """
+        Loads the persisted manifest, discarding any entries that have not been saved yet.
+        """
+        self.entries = {}
+        self.changedPaths = set()
+        data = self.__fileCache.read(self.name + ".json")
+        if data is None:
+            return
+        try:
+            self.entries = {path: tuple(entry) for path, entry in json.loads(data)["entries"].items()}
+        except (ValueError, KeyError, TypeError):
+            print("WARNING: Manifest is invalid and will be rebuilt: " + self.name)
+
+    def save(self):
+        """
+        Persists all entries that have changed since the manifest was loaded. Entries recorded by other processes in the meantime are kept.
+        """
+        if len(self.changedPaths) == 0:
+            return
+
+        ownEntries = {path: self.entries[path] for path in self.changedPaths if path in self.entries}
+        removedPaths = {path for path in self.changedPaths if path not in self.entries}
+        self.load()
+        self.entries.update(ownEntries)
+        for path in removedPaths:
+            self.entries.pop(path, None)
+
+        try:
+            self.__fileCache.write(self.name + ".json", json.dumps({"version": 1, "entries": self.entries}).encode())
+        except OSError:
+            print("WARNING: Unable to write manifest to cache directory " + str(caching.getCacheDirectory()))
+
+    def getEntry(self, filePath: os.path) -> tuple[int, int, str]:
+        """
+        Retrieves the up-to-date entry of a file, recalculating its checksum if the file has changed since it was last recorded.
+        @param filePath: Path to the file.
+        @return: Tuple containing the size, modification time in nanoseconds and checksum of the file.
+        @raise: OSError if the file cannot be accessed
+        """
+        path = os.path.abspath(filePath)
+        fileStat = os.stat(path)
+        entry = self.entries.get(path)
+        if entry is None or entry[0] != fileStat.st_size or entry[1] != fileStat.st_mtime_ns:
+            entry = (fileStat.st_size, fileStat.st_mtime_ns, calculateChecksum(path))
+            self.entries[path] = entry
+            self.changedPaths.add(path)
+        return entry
+
+    def getChecksum(self, filePath: os.path) -> str:
+        """
+        Retrieves the checksum of a file, recalculating it only if the file has changed since it was last recorded.
+        @param filePath: Path to the file.
+        @return: The checksum of the file contents.
+        @raise: OSError if the file cannot be accessed
+        """
+        return self.getEntry(filePath)[2]
+
+    def refresh(self, filePaths: list[os.path]) -> list[os.path]:
+        """
+        Brings the entries of the given files up to date and removes entries of files that no longer exist.
+        @param filePaths: Paths to the files to refresh.
+        @return: List of the paths of all given files that were added or changed since they were last recorded.
+        """
+        outChangedPaths = []
+        for filePath in filePaths:
+            previousEntry = self.entries.get(os.path.abspath(filePath))
+            if self.getEntry(filePath) != previousEntry:
+                outChangedPaths.append(filePath)
+
+        for path in list(self.entries):
+            if not os.path.isfile(path):
+                del self.entries[path]
+                self.changedPaths.add(path)
+        return outChangedPaths
+
+
+_manifests: dict[str, CorpusManifest] = {}
+
+
+def getManifest(name: str = "sources") -> CorpusManifest:
+    """
+    Retrieves the manifest of the given name, loading it on first use. Changes to loaded manifests are saved when the process exits.
+    @param name: Name of the manifest.
+    @return: The CorpusManifest.
+    """
+    if name not in _manifests:
+        if len(_manifests) == 0:
+            atexit.register(saveManifests)
+        _manifests[name] = CorpusManifest(name)
+    return _manifests[name]
+
+
+def saveManifests():
+    """
+    Persists the changes to all loaded manifests.
+    """
+    for manifest in _manifests.values():
+        manifest.save()
+
+
+def getSourceChecksum(sourcePath: os.path) -> str:
+    """
+    Retrieves the checksum of a source file using the default manifest.
+    @param sourcePath: Path to the source file.
+    @return: The checksum of the file contents.
+    """
+    return getManifest().getChecksum(sourcePath)
@@ -1,44 +1,86 @@
+from __future__ import annotations
+
+import musicau
+
 import music21
 
-from music21 import converter
+from music21 import converter, expressions, repeat
+from music21.common import getNumFromStr
 from music21.metadata.bundles import MetadataEntry
 from music21.repeat import ExpanderException
 
-import glob
-import hashlib
+from musicau.tools import caching, manifest, profiling, repeatExpansion
+
+from contextlib import contextmanager
+from fractions import Fraction
+from xml.etree import ElementTree
 import os.path
 
+# Event tables depend on numpy, both are only loaded once an event table is created
+eventTables = musicau.importLazily("musicau.tools.eventTables")
+numpy = musicau.importLazily("numpy")
+
+
+# Parsed pieces shared between all calls of parsePieceByPath while inside a sharedParsing block, None if outside of such a block.
+_sharedParses: dict[tuple[str, bool], tuple[music21.stream.Score, dict[float, str]]] = None
+
+
+@contextmanager
+def sharedParsing():
+    """
+    Context manager within which parsePieceByPath parses each piece only once and returns the same score and measure map on every further call.
+    Used to run several analysis methods on a piece without parsing it repeatedly. The shared score must not be modified by its users.
+    """
+    global _sharedParses
+    if _sharedParses is not None:
+        yield  # Already inside an outer block, which keeps ownership of the shared parses
+        return
+    _sharedParses = {}
+    try:
+        yield
+    finally:
+        _sharedParses = None
+
 
 def parsePieceByPath(sourcePath: os.path, bShouldExpandRepeats: bool) -> tuple[music21.stream.Score, dict[float, str]]:
     """
     Parses a piece into a usable music21 Score stream and a corresponding measure map.
     @param sourcePath: Path to the MusicXML file to parse.
-    @param bShouldExpandRepeats: Whether repeats in the piece should be rolled out. The parser will store pre-expanded files after expanding repeats or
-    if the source file has changed to optimize future processing times.
+    @param bShouldExpandRepeats: Whether repeats in the piece should be rolled out. The parser will store pre-expanded scores in the cache directory
+    (see musicau.tools.caching) after expanding repeats or if the source file has changed to optimize future processing times.
     @return: Tuple containing the music21 Score stream and a measure map if parsed correctly, otherwise both will be None.
     """
     if not os.path.isfile(sourcePath):
         return None, None
 
-    if bShouldExpandRepeats:
-        with open(sourcePath, "r") as f:
-            sourceFileChecksum = hashlib.md5(f.read().encode()).hexdigest()[:12]
+    if _sharedParses is not None:
+        parseKey = (os.path.abspath(sourcePath), bShouldExpandRepeats)
+        if parseKey not in _sharedParses:
+            _sharedParses[parseKey] = _parsePiece(sourcePath, bShouldExpandRepeats)
+        return _sharedParses[parseKey]
+    return _parsePiece(sourcePath, bShouldExpandRepeats)
 
-        pathToPreExpandedScore = os.path.split(sourcePath)[0] + "\\" + getFileNameFromPath(sourcePath) + ".expanded." + sourceFileChecksum + ".cmxl"
-        if os.path.isfile(pathToPreExpandedScore):
-            outStream = converter.parse(pathToPreExpandedScore, format="xml")
-        else:
-            try:
-                for outdatedExpandedScore in glob.glob(os.path.split(sourcePath)[0] + "\\" + getFileNameFromPath(sourcePath) + ".expanded.*"):
-                    os.remove(outdatedExpandedScore)
 
-                outStream = converter.parse(sourcePath).expandRepeats()
-                outStream.write('musicxml', fp=pathToPreExpandedScore)
+def _parsePiece(sourcePath: os.path, bShouldExpandRepeats: bool) -> tuple[music21.stream.Score, dict[float, str]]:
+    if bShouldExpandRepeats:
+        with profiling.measureStage("cache"):
+            sourceFileChecksum = manifest.getSourceChecksum(sourcePath)
+            outStream = caching.loadScore(sourcePath, sourceFileChecksum, "expanded")
+        if outStream is None:
+            with profiling.measureStage("parse"):
+                parsedStream = converter.parse(sourcePath)
+            try:
+                with profiling.measureStage("expand"):
+                    outStream = parsedStream.expandRepeats()
+                with profiling.measureStage("cache"):
+                    caching.storeScore(sourcePath, sourceFileChecksum, "expanded", outStream)
             except ExpanderException:
                 print("WARNING: Score part contains repeat that cannot be expanded - check file. " + str(sourcePath))
-                outStream = converter.parse(sourcePath)
+                with profiling.measureStage("parse"):
+                    outStream = converter.parse(sourcePath)
     else:
-        outStream = converter.parse(sourcePath)
+        with profiling.measureStage("parse"):
+            outStream = converter.parse(sourcePath)
     outMeasureMap = makeMeasureMapFromStream(outStream.parts[0])
     return outStream, outMeasureMap
 
@@ -64,16 +106,351 @@ def makeMeasureMapFromStream(stream: music21.stream.Stream) -> dict[float, str]:
     @return: The generated measure map.
     """
     outMeasureMap = {}
+    measures = list(stream.getElementsByClass('Measure'))
+    measureLabels = _makeMeasureLabels([measure.measureNumberWithSuffix() for measure in measures])
+    for measure, measureLabel in zip(measures, measureLabels):
+        outMeasureMap[measure.offset] = measureLabel
+    return outMeasureMap
+
+
+def _makeMeasureLabels(measureNames: list[str]) -> list[str]:
+    """
+    Makes the labels of measures in a measure map, in which repeated measure names are distinguished by appending the amount of previous
+    occurrences, i.e. '5 (1)' for the second measure named '5'.
+    @param measureNames: The measure numbers with their suffixes, in the order of the measures.
+    @return: List of the labels of the measures.
+    """
+    outMeasureLabels = []
     usedMeasureNames = {}
-    for i, measure in enumerate(stream.getElementsByClass('Measure')):
-        targetMeasureName = measure.measureNumberWithSuffix()
-        if targetMeasureName not in list(usedMeasureNames):
-            outMeasureMap[measure.offset] = targetMeasureName
-            usedMeasureNames[targetMeasureName] = 1
+    for measureName in measureNames:
+        if measureName not in usedMeasureNames:
+            outMeasureLabels.append(measureName)
+            usedMeasureNames[measureName] = 1
         else:
-            outMeasureMap[measure.offset] = targetMeasureName + " (" + str(usedMeasureNames[targetMeasureName]) + ")"
-            usedMeasureNames[targetMeasureName] = usedMeasureNames[targetMeasureName] + 1
-    return outMeasureMap
+            outMeasureLabels.append(measureName + " (" + str(usedMeasureNames[measureName]) + ")")
+            usedMeasureNames[measureName] += 1
+    return outMeasureLabels
+
+
+def parseEventTableByPath(sourcePath: os.path, bShouldExpandRepeats: bool = False) -> eventTables.PieceEventTable:
+    """
+    Parses a piece straight into an event table by streaming the elements of the MusicXML file, without building any music21 streams. Only
+    pitches, durations, lyrics, fermatas, key and time signatures, measure numbers and repeats are read, and only one measure is held in memory at
+    a time. The result is equal to the event table made from the score returned by parsePieceByPath, including the splitting of parts with several
+    staves into one part per staff.
+    Repeats are expanded without copying any notes: the repeat barlines and endings of each part determine the order in which its measures are
+    played (see repeatExpansion.RepeatStructure), and the notes of the played measures are gathered from the unexpanded notes by index. Parts
+    whose repeats cannot be expanded leave the whole piece unexpanded with a warning, like parsePieceByPath does.
+    @param sourcePath: Path to the MusicXML file to parse, which must be an uncompressed partwise MusicXML file.
+    @param bShouldExpandRepeats: Whether repeats in the piece should be rolled out.
+    @return: The PieceEventTable of the piece, or None if the file does not exist.
+    @raise: ValueError if the file is not a partwise MusicXML file or repeats should be expanded in a piece containing repeat expressions such as
+    D.C., which are only supported by parsePieceByPath, or contains overlapping endings, ElementTree.ParseError if it is not a well-formed XML file
+    """
+    if not os.path.isfile(sourcePath):
+        return None
+
+    with profiling.measureStage("parse"):
+        partReaders: list[_MusicXmlPartReader] = []
+        bIsInPart = False
+        for _, element in ElementTree.iterparse(sourcePath):
+            if element.tag == "measure":
+                if element.find("part") is not None:
+                    raise ValueError("Timewise MusicXML files are not supported: " + str(sourcePath))
+                if not bIsInPart:
+                    partReaders.append(_MusicXmlPartReader())
+                    bIsInPart = True
+                partReaders[-1].readMeasure(element)
+                element.clear()  # Keeps only the current measure in memory
+            elif element.tag == "part":
+                bIsInPart = False
+                element.clear()
+        if len(partReaders) == 0:
+            raise ValueError("The file contains no partwise MusicXML parts: " + str(sourcePath))
+
+    playbackOrders = [None] * len(partReaders)
+    if bShouldExpandRepeats:
+        with profiling.measureStage("expand"):
+            if any(partReader.bHasRepeatExpressionCommand for partReader in partReaders):
+                raise ValueError("Repeat expressions such as D.C. are not supported: " + str(sourcePath))
+            try:
+                playbackOrders = [partReader.repeatStructure.getPlaybackOrder() for partReader in partReaders]
+            except ExpanderException:
+                print("WARNING: Score part contains repeat that cannot be expanded - check file. " + str(sourcePath))
+                playbackOrders = [None] * len(partReaders)
+
+    with profiling.measureStage("parse"):
+        playedMeasures = [partReader.getPlayedMeasures(playbackOrder) for partReader, playbackOrder in zip(partReaders, playbackOrders)]
+
+        # The measures of the first part make up the measure map, with the same labels as made by makeMeasureMapFromStream
+        measureOffsets = [offset for _, offset, _ in playedMeasures[0]]
+        measureLabels = _makeMeasureLabels([measureName for _, _, measureName in playedMeasures[0]])
+        measureIndicesByOffset = {offset: i for i, offset in enumerate(measureOffsets)}
+
+        # Key and time signatures remain in effect until the next played measure containing one, as in makeEventTableFromScore
+        keySignatures, timeSignatures = [], []
+        keySignature, timeSignature = 0, ''
+        for measureIndex, _, _ in playedMeasures[0]:
+            if partReaders[0].measureKeySignatures[measureIndex] is not None:
+                keySignature = partReaders[0].measureKeySignatures[measureIndex]
+            if partReaders[0].measureTimeSignatures[measureIndex] is not None:
+                timeSignature = partReaders[0].measureTimeSignatures[measureIndex]
+            keySignatures.append(keySignature)
+            timeSignatures.append(timeSignature)
+
+        figureStrings = ['']
+        parts = []
+        for partReader, measures in zip(partReaders, playedMeasures):
+            for staff in partReader.getStaves():
+                parts.append(_makeStaffEventTable(staff, partReader.measures, measures, measureIndicesByOffset, figureStrings))
+
+        return eventTables.PieceEventTable(parts, figureStrings, numpy.array(measureOffsets, dtype=numpy.float64), measureLabels,
+                                           numpy.array(keySignatures, dtype=numpy.int32), timeSignatures)
+
+
+def _makeStaffEventTable(notes: list[tuple[int, float, float, bool, str, int]],
+                         measures: list[tuple[float, Fraction, int, str]],
+                         playedMeasures: list[tuple[int, float, str]],
+                         measureIndicesByOffset: dict[float, int],
+                         figureStrings: list[str]) -> eventTables.PartEventTable:
+    """
+    Creates the event table of a staff by gathering the notes of every played measure from the notes of the staff as read from the file. Notes
+    keep their position within their measure and are shifted to the offset at which the measure is played.
+    @param notes: The notes of the staff as read by _MusicXmlPartReader, in the order of the file.
+    @param measures: The measures of the part as read by _MusicXmlPartReader.
+    @param playedMeasures: The played measures of the part, as returned by _MusicXmlPartReader.getPlayedMeasures.
+    @param measureIndicesByOffset: Dictionary matching the offsets of the measures of the measure map to their indices.
+    @param figureStrings: The distinct figures of the piece, see eventTables.makePartEventTable.
+    @return: The PartEventTable of the staff.
+    """
+    pitches, offsets, durations, fermatas, figures, noteMeasureIndices = zip(*notes) if len(notes) > 0 else ([],) * 6
+    offsets = numpy.array(offsets, dtype=numpy.float64)
+
+    # The notes are read measure by measure, so the notes of each measure form a contiguous range
+    measureStarts = numpy.searchsorted(numpy.array(noteMeasureIndices, dtype=numpy.int64), numpy.arange(len(measures) + 1))
+    playedMeasureIndices = numpy.array([measureIndex for measureIndex, _, _ in playedMeasures], dtype=numpy.int64)
+    noteCounts = measureStarts[playedMeasureIndices + 1] - measureStarts[playedMeasureIndices]
+    playedMeasureOfNotes = numpy.repeat(numpy.arange(len(playedMeasures)), noteCounts)
+    noteIndices = numpy.arange(len(playedMeasureOfNotes)) + \
+        numpy.repeat(measureStarts[playedMeasureIndices] - (numpy.cumsum(noteCounts) - noteCounts), noteCounts)
+
+    offsetShifts = numpy.array([offset - measures[measureIndex][0] for measureIndex, offset, _ in playedMeasures], dtype=numpy.float64)
+    measureIndices = numpy.array([measureIndicesByOffset.get(offset, -1) for _, offset, _ in playedMeasures], dtype=numpy.int32)
+    return eventTables.makePartEventTable(numpy.array(pitches, dtype=numpy.int32)[noteIndices],
+                                          offsets[noteIndices] + offsetShifts[playedMeasureOfNotes],
+                                          numpy.array(durations, dtype=numpy.float64)[noteIndices],
+                                          numpy.array(fermatas, dtype=bool)[noteIndices],
+                                          [figures[noteIndex] for noteIndex in noteIndices],
+                                          measureIndices[playedMeasureOfNotes],
+                                          figureStrings)
+
+
+class _MusicXmlPartReader:
+    """
+    Reads the measures of a single part of a MusicXML file, following the way music21 places measures and notes when importing the file.
+    """
+    def __init__(self):
+        self.divisions: Fraction = Fraction(1)
+        self.staffCount: int = 1
+        # Notes per staff as tuples of the base-40 pitch, offset, duration, fermata, figure and index of the measure
+        self.staves: dict[int, list[tuple[int, float, float, bool, str, int]]] = {}
+        # Measures as tuples of the offset, the duration (its highest time, by which it advances when repeats are expanded), the measure number
+        # and its suffix (None if there is none)
+        self.measures: list[tuple[float, Fraction, int, str]] = []
+        # Amount of sharps of the key signature and ratio of the time signature contained in each measure, None if the measure contains none
+        self.measureKeySignatures: list[int] = []
+        self.measureTimeSignatures: list[str] = []
+        self.repeatStructure: repeatExpansion.RepeatStructure = repeatExpansion.RepeatStructure()
+        self.bHasRepeatExpressionCommand: bool = False
+
+        self.__measureOffset: Fraction = Fraction(0)
+        self.__barDuration: Fraction = None
+        self.__lastMeasureNumber: int = 0
+        self.__lastNumberSuffix: str = None
+        self.__durations: dict[str, Fraction] = {}
+
+    def getStaves(self) -> list[list[tuple[int, float, float, bool, str, int]]]:
+        """
+        Retrieves the notes of every staff of the part, as music21 separates a part with several staves into one part per staff.
+        @return: List of the notes of each staff, in the order of the staves.
+        """
+        return [self.staves.get(staff, []) for staff in range(1, max([self.staffCount] + list(self.staves.keys())) + 1)]
+
+    def getPlayedMeasures(self, playbackOrder: list[tuple[int, str]]) -> list[tuple[int, float, str]]:
+        """
+        Retrieves the measures in the order in which they are played. Like in music21's expandRepeats, every played measure follows the previous
+        one after its duration, and repetitions of a measure are named by their repetition suffix.
+        @param playbackOrder: The playback order, as returned by RepeatStructure.getPlaybackOrder, or None if repeats are not expanded.
+        @return: List of the played measures as tuples of the index of the measure, its offset and its measure number with its suffix.
+        """
+        if playbackOrder is None:
+            return [(i, offset, str(number) + (suffix if suffix is not None else '')) for i, (offset, _, number, suffix) in enumerate(self.measures)]
+        outMeasures = []
+        offset = Fraction(0)
+        for measureIndex, repetitionSuffix in playbackOrder:
+            _, duration, number, suffix = self.measures[measureIndex]
+            suffix = repetitionSuffix if repetitionSuffix is not None else suffix
+            outMeasures.append((measureIndex, float(offset), str(number) + (suffix if suffix is not None else '')))
+            offset += duration
+        return outMeasures
+
+    def readMeasure(self, measureElement: ElementTree.Element):
+        """
+        Reads the contents of a measure and advances the offset to the next measure.
+        @param measureElement: The fully parsed measure element.
+        """
+        measureNumber, numberSuffix = self.__readMeasureNumber(measureElement.get("number"))
+        measureIndex = len(self.measures)
+        self.measureKeySignatures.append(None)
+        self.measureTimeSignatures.append(None)
+        self.repeatStructure.addMeasure()
+
+        position = Fraction(0)
+        highestTime = Fraction(0)
+        lastNoteStart = Fraction(0)
+        lastNoteStaff = None
+        bHasNotesOrRests = False
+        for element in measureElement:
+            if element.tag == "note":
+                bHasNotesOrRests = True
+                bIsChordNote = element.find("chord") is not None
+                bIsGraceNote = element.find("grace") is not None
+                duration = self.__getDuration(element) if not bIsGraceNote else Fraction(0)
+                start = lastNoteStart if bIsChordNote else position
+                if not bIsChordNote:
+                    lastNoteStart = position
+                    position += duration
+                    highestTime = max(highestTime, position)
+
+                pitchElement = element.find("pitch")
+                if pitchElement is None:
+                    continue  # Rests and unpitched notes
+                staff = int(element.findtext("staff", "1"))
+                bHasFermata = element.find("notations/fermata") is not None
+                if bIsChordNote and lastNoteStaff == staff:
+                    # Chords are represented by their first pitch, carrying a fermata if any of their notes does
+                    firstNote = self.staves[staff][-1]
+                    self.staves[staff][-1] = firstNote[:3] + (firstNote[3] or bHasFermata,) + firstNote[4:]
+                    continue
+                pitch = eventTables.BASE40_STEP_VALUES[pitchElement.findtext("step").strip()] + \
+                    int(float(pitchElement.findtext("alter", "0"))) + int(pitchElement.findtext("octave")) * 40
+                lyric = _readLyric(element)
+                self.staves.setdefault(staff, []).append((pitch, float(self.__measureOffset + start), float(duration), bHasFermata,
+                                                          lyric.replace("h", "n") if lyric is not None else '', measureIndex))
+                lastNoteStaff = staff
+            elif element.tag == "backup":
+                position -= self.__getDuration(element)
+            elif element.tag == "forward":
+                position += self.__getDuration(element)
+                highestTime = max(highestTime, position)
+            elif element.tag == "attributes":
+                self.__readAttributes(element)
+            elif element.tag == "barline":
+                self.__readBarline(element)
+            elif element.tag == "direction":
+                self.bHasRepeatExpressionCommand |= any(_isRepeatExpressionCommand(wordsElement)
+                                                        for wordsElement in element.iterfind("direction-type/words"))
+
+        # The offset of the next measure is determined like music21 does (see PartParser.adjustTimeAttributesFromMeasure)
+        barDuration = self.__barDuration if self.__barDuration is not None else Fraction(4)
+        if highestTime == 0 and not bHasNotesOrRests:
+            highestTime = barDuration  # music21 fills empty measures with a rest
+        self.measures.append((float(self.__measureOffset), highestTime, measureNumber, numberSuffix))
+        if highestTime > barDuration:
+            difference = highestTime - barDuration
+            bIsPlausible = difference > Fraction(1, 2) or (difference * 16).denominator == 1 or (difference * 12).denominator == 1
+            self.__measureOffset += highestTime if bIsPlausible else barDuration
+        else:
+            self.__measureOffset += highestTime
+
+    def __getDuration(self, element: ElementTree.Element) -> Fraction:
+        # Durations are given in divisions of a quarter note, and only a few distinct durations occur in a piece
+        durationText = element.findtext("duration", "0")
+        duration = self.__durations.get(durationText)
+        if duration is None:
+            duration = Fraction(int(durationText)) / self.divisions
+            self.__durations[durationText] = duration
+        return duration
+
+    def __readMeasureNumber(self, measureNumber: str) -> tuple[int, str]:
+        number, suffix = getNumFromStr(measureNumber) if measureNumber is not None else (None, None)
+        number = int(number) if number not in (None, '') else 0
+        suffix = suffix if suffix not in (None, '') else None
+
+        # Unnumbered measures named X1, X2, etc. by Finale are given the number of the previous measure, like music21 does
+        if suffix == 'X' and number != self.__lastMeasureNumber + 1:
+            suffix = (self.__lastNumberSuffix if self.__lastNumberSuffix is not None else '') + suffix + str(number)
+            number = self.__lastMeasureNumber
+        if number != self.__lastMeasureNumber:
+            self.__lastMeasureNumber = number
+            self.__lastNumberSuffix = suffix
+        return number, suffix
+
+    def __readAttributes(self, attributesElement: ElementTree.Element):
+        divisions = attributesElement.findtext("divisions")
+        if divisions is not None:
+            self.divisions = Fraction(divisions.strip())
+            self.__durations = {}
+        staffCount = attributesElement.findtext("staves")
+        if staffCount is not None:
+            self.staffCount = int(staffCount)
+        fifths = attributesElement.findtext("key/fifths")
+        if fifths is not None:
+            self.measureKeySignatures[-1] = int(fifths)
+        timeElement = attributesElement.find("time")
+        if timeElement is not None and timeElement.find("beats") is not None:
+            beats = timeElement.findtext("beats").strip()
+            beatType = timeElement.findtext("beat-type").strip()
+            self.measureTimeSignatures[-1] = beats + "/" + beatType
+            self.__barDuration = Fraction(4 * sum(int(beat) for beat in beats.split("+")), int(beatType))
+
+    def __readBarline(self, barlineElement: ElementTree.Element):
+        # Repeat barlines and endings are read like music21 does (see MeasureParser.xmlBarline)
+        direction = None
+        times = None
+        repeatElement = barlineElement.find("repeat")
+        if repeatElement is not None:
+            directionText = repeatElement.get("direction", "").lower()
+            if directionText not in ("forward", "backward"):
+                raise ValueError("Invalid repeat direction '" + directionText + "' in measure " + str(len(self.measures) + 1))
+            direction = "start" if directionText == "forward" else "end"
+            timesText = repeatElement.get("times")
+            if timesText is not None and direction == "end" and int(timesText) >= 0:
+                times = int(timesText)
+        self.repeatStructure.setBarline(barlineElement.get("location", "right"), direction, times)
+
+        endingElement = barlineElement.find("ending")
+        if endingElement is not None:
+            self.repeatStructure.addEnding(endingElement.get("number"), endingElement.get("type"), endingElement.text)
+
+
+def _isRepeatExpressionCommand(wordsElement: ElementTree.Element) -> bool:
+    """
+    Checks whether a text direction is read as a repeat expression command such as D.C. by music21, which affects the expansion of repeats.
+    @param wordsElement: The words element of the direction.
+    @return: True if the text is a repeat expression command, otherwise False.
+    """
+    return isinstance(expressions.TextExpression((wordsElement.text or '').strip()).getRepeatExpression(), repeat.RepeatExpressionCommand)
+
+
+def _readLyric(noteElement: ElementTree.Element) -> str:
+    """
+    Reads the lyrics of a note the way music21 returns them from Note.lyric.
+    @param noteElement: The note element.
+    @return: The texts of all lyrics separated by line breaks, or None if the note has no lyrics.
+    """
+    lyrics = []
+    for lyricElement in noteElement.iterfind("lyric"):
+        texts = [(textElement.text or '').strip() for textElement in lyricElement.iterfind("text")]
+        if len(texts) == 0:
+            continue
+        elisions = [elisionElement.text or '' for elisionElement in lyricElement.iterfind("elision")]
+        # Composite lyrics (several texts joined by elisions) are joined with the elision text, or an underscore if there is none
+        lyric = texts[0]
+        for i, text in enumerate(texts[1:]):
+            lyric += (elisions[i] if i < len(elisions) and elisions[i] != '' else '_') + text
+        lyrics.append(lyric)
+    return "\n".join(lyrics) if len(lyrics) > 0 else None
 
 
 def getFileNameFromMetadata(metadataEntry: MetadataEntry) -> str:
@@ -0,0 +1,404 @@
+from contextlib import contextmanager
+import cProfile
+import json
+import marshal
+import os.path
+import re
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows, peak memory usage is not recorded there
+
+
+# Files through which Linux reports and resets the peak resident set size of the process since the last reset.
+_PROCESS_STATUS_PATH = "/proc/self/status"
+_CLEAR_REFS_PATH = "/proc/self/clear_refs"
+
+# Whether the peak resident set size can be reset, determined on first use. Peak memory usage per stage and piece is only recorded if it can.
+_bCanResetPeakMemory: bool = None
+
+# Highest peak resident set size of the process read before any reset, as resetting also lowers the peak reported by getrusage.
+_processPeakMemory: int = 0
+
+
+class StageRecorder:
+    """
+    Accumulates the time spent in each stage of processing (i.e. 'parse' or 'analyze') and the highest peak memory usage of any of its runs.
+    Times of nested stages are only attributed to the innermost stage, so the time spent parsing a piece from within an analysis method does not
+    count towards the analysis stage. The peak memory usage of a stage does include its nested stages.
+    """
+    def __init__(self, bShouldRecordTrace: bool = False):
+        """
+        @param bShouldRecordTrace: Whether every single run of a stage should additionally be kept as an event in Chrome trace format.
+        """
+        self.wallTimes: dict[str, float] = {}
+        self.cpuTimes: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+        self.peakMemories: dict[str, int] = {}
+        self.traceEvents: list[dict] = [] if bShouldRecordTrace else None
+
+    def record(self, stageName: str, wallTime: float, cpuTime: float, peakMemory: int = None):
+        """
+        Adds the time spent in a single run of a stage.
+        @param stageName: Name of the stage.
+        @param wallTime: Elapsed wall clock time in seconds.
+        @param cpuTime: Elapsed CPU time of the process in seconds.
+        @param peakMemory: Peak resident set size of the process during the run in bytes, None if unknown.
+        """
+        self.wallTimes[stageName] = self.wallTimes.get(stageName, 0.0) + wallTime
+        self.cpuTimes[stageName] = self.cpuTimes.get(stageName, 0.0) + cpuTime
+        self.counts[stageName] = self.counts.get(stageName, 0) + 1
+        self.__recordPeakMemory(stageName, peakMemory)
+
+    def __recordPeakMemory(self, stageName: str, peakMemory: int):
+        if peakMemory is not None:
+            self.peakMemories[stageName] = max(self.peakMemories.get(stageName, 0), peakMemory)
+
+    def recordTraceEvent(self, eventName: str, startTime: float, wallTime: float, category: str = "stage", details: dict = None):
+        """
+        Adds a single run of a stage as a trace event, if trace events are recorded. Unlike the accumulated times, the duration of an event
+        includes the time spent in nested stages.
+        @param eventName: Name of the event.
+        @param startTime: Start of the event as a Unix timestamp in seconds.
+        @param wallTime: Elapsed wall clock time in seconds.
+        @param category: Category of the event.
+        @param details: Optional additional information shown with the event.
+        """
+        if self.traceEvents is None:
+            return
+        processId = os.getpid()
+        event = {"name": eventName, "cat": category, "ph": "X", "ts": startTime * 1e6, "dur": wallTime * 1e6, "pid": processId, "tid": processId}
+        if details is not None:
+            event["args"] = details
+        self.traceEvents.append(event)
+
+    def add(self, stages: dict[str, dict[str, float]]):
+        """
+        Adds the times of stages recorded elsewhere, i.e. by another process.
+        @param stages: Dictionary of stage times, as returned by toDict.
+        """
+        for stageName, stage in stages.items():
+            self.wallTimes[stageName] = self.wallTimes.get(stageName, 0.0) + stage["wallTime"]
+            self.cpuTimes[stageName] = self.cpuTimes.get(stageName, 0.0) + stage["cpuTime"]
+            self.counts[stageName] = self.counts.get(stageName, 0) + stage["count"]
+            self.__recordPeakMemory(stageName, stage.get("peakMemory"))
+
+    def toDict(self) -> dict[str, dict[str, float]]:
+        """
+        Converts the recorded times into a dictionary that can be serialized as JSON.
+        @return: Dictionary matching each stage name to its wall time, CPU time, count and peak memory usage in bytes (None if unknown).
+        """
+        return {stageName: {"wallTime": self.wallTimes[stageName], "cpuTime": self.cpuTimes[stageName], "count": self.counts[stageName],
+                            "peakMemory": self.peakMemories.get(stageName)}
+                for stageName in self.wallTimes}
+
+
+# Recorders currently receiving the times of all measured stages.
+_activeRecorders: list[StageRecorder] = []
+
+# Stages currently being measured, as lists of the stage name, start times, the times spent in nested stages and the peak memory usage measured
+# so far (see _startPeakMemoryMeasurement).
+_stageStack: list[list] = []
+
+
+@contextmanager
+def recordingStages(recorder: StageRecorder):
+    """
+    Context manager within which the times of all measured stages are added to the given recorder.
+    @param recorder: The StageRecorder to add the times to. If None, nothing is recorded.
+    """
+    if recorder is None:
+        yield recorder
+        return
+
+    _activeRecorders.append(recorder)
+    try:
+        yield recorder
+    finally:
+        _activeRecorders.remove(recorder)
+
+
+@contextmanager
+def measureStage(stageName: str):
+    """
+    Context manager measuring the time spent within it as a stage of the given name. Does nothing unless a recorder is active (see
+    recordingStages), so stages can be measured in production code at no noticeable cost.
+    @param stageName: Name of the stage.
+    """
+    if len(_activeRecorders) == 0:
+        yield
+        return
+
+    stage = [stageName, time.perf_counter(), time.process_time(), 0.0, 0.0, time.time(), _startPeakMemoryMeasurement()]
+    _stageStack.append(stage)
+    try:
+        yield
+    finally:
+        _stageStack.pop()
+        wallTime = time.perf_counter() - stage[1]
+        cpuTime = time.process_time() - stage[2]
+        peakMemory = _stopPeakMemoryMeasurement(stage[6])
+        if len(_stageStack) > 0:
+            _stageStack[-1][3] += wallTime
+            _stageStack[-1][4] += cpuTime
+        for recorder in _activeRecorders:
+            recorder.record(stageName, wallTime - stage[3], cpuTime - stage[4], peakMemory)
+            recorder.recordTraceEvent(stageName, stage[5], wallTime, details={"peakMemory": peakMemory} if peakMemory is not None else None)
+
+
+def _readPeakMemory() -> int:
+    """
+    Reads the peak resident set size of the process since the last reset.
+    @return: The peak memory usage in bytes, or None if it cannot be reset on this platform.
+    """
+    global _bCanResetPeakMemory
+    if _bCanResetPeakMemory is None:
+        try:
+            with open(_CLEAR_REFS_PATH, 'w'):
+                pass
+            _bCanResetPeakMemory = True
+        except OSError:
+            _bCanResetPeakMemory = False
+    if not _bCanResetPeakMemory:
+        return None
+    with open(_PROCESS_STATUS_PATH) as file:
+        match = re.search(r"VmHWM:\s*(\d+) kB", file.read())
+    return int(match.group(1)) * 1024 if match is not None else None
+
+
+def _resetPeakMemory():
+    """
+    Resets the peak resident set size of the process to its current resident set size, keeping the peak so far for getPeakMemoryUsage.
+    """
+    global _processPeakMemory
+    peakMemory = _readPeakMemory()
+    if peakMemory is None:
+        return
+    _processPeakMemory = max(_processPeakMemory, peakMemory)
+    with open(_CLEAR_REFS_PATH, 'w') as file:
+        file.write("5")
+
+
+def _startPeakMemoryMeasurement() -> int:
+    """
+    Starts measuring the peak memory usage of a new innermost stage. The peak reached so far is attributed to the enclosing stage before the
+    peak of the process is reset, so that nested measurements do not affect each other.
+    @return: The initial peak memory usage of the new stage in bytes, None if peak memory usage cannot be measured.
+    """
+    peakMemory = _readPeakMemory()
+    if peakMemory is None:
+        return None
+    if len(_stageStack) > 0 and _stageStack[-1][6] is not None:
+        _stageStack[-1][6] = max(_stageStack[-1][6], peakMemory)
+    _resetPeakMemory()
+    return _readPeakMemory()
+
+
+def _stopPeakMemoryMeasurement(stagePeakMemory: int) -> int:
+    """
+    Completes measuring the peak memory usage of the innermost stage, which has already been removed from the stage stack, and attributes it to
+    the enclosing stage as well.
+    @param stagePeakMemory: The peak memory usage of the stage measured so far, as returned by _startPeakMemoryMeasurement.
+    @return: The peak memory usage of the stage in bytes, None if peak memory usage cannot be measured.
+    """
+    if stagePeakMemory is None:
+        return None
+    peakMemory = max(stagePeakMemory, _readPeakMemory())
+    if len(_stageStack) > 0 and _stageStack[-1][6] is not None:
+        _stageStack[-1][6] = max(_stageStack[-1][6], peakMemory)
+    _resetPeakMemory()
+    return peakMemory
+
+
+def getPeakMemoryUsage() -> int:
+    """
+    Retrieves the peak resident set size of the current process so far, including the peaks before any reset by the measurement of stages.
+    @return: The peak memory usage in bytes, or None if it cannot be determined on this platform.
+    """
+    if resource is None:
+        return None
+    peakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes everywhere else
+    peakMemory = peakMemory if sys.platform == "darwin" else peakMemory * 1024
+    currentPeakMemory = _readPeakMemory()
+    return max(peakMemory, _processPeakMemory, currentPeakMemory if currentPeakMemory is not None else 0)
+
+
+@contextmanager
+def profilingPiece(sourcePath: os.path, bShouldRecordTrace: bool = True, bShouldRunProfiler: bool = False):
+    """
+    Context manager profiling the processing of a single piece. The times of all stages measured within it are only attributed to the piece,
+    even if other recorders are active. The yielded profile of the piece is filled in once the context is left and only contains built-in types,
+    so it can be passed between processes. Its peak memory usage is the peak resident set size of the process while the piece was processed,
+    which is only known on platforms where the peak can be reset (see _readPeakMemory), whereas the peak memory usage of the process so far is
+    recorded on all platforms except Windows.
+    @param sourcePath: Path to the piece.
+    @param bShouldRecordTrace: Whether every single run of a stage should be kept as a trace event.
+    @param bShouldRunProfiler: Whether the piece should be run under cProfile. The statistics are stored in the profile as marshalled bytes in the
+    format of cProfile.Profile.dump_stats.
+    """
+    recorder = StageRecorder(bShouldRecordTrace)
+    outPieceProfile = {"sourcePath": str(sourcePath), "processId": os.getpid()}
+    savedRecorders, savedStages = _activeRecorders[:], _stageStack[:]
+    startPeakMemory = _startPeakMemoryMeasurement()
+    # The piece acts as the outermost stage, so the peak memory usage of its stages is attributed to it
+    pieceStage = ["piece", time.perf_counter(), time.process_time(), 0.0, 0.0, time.time(), startPeakMemory]
+    _activeRecorders[:] = [recorder]
+    _stageStack[:] = [pieceStage]
+
+    profiler = cProfile.Profile() if bShouldRunProfiler else None
+    startTime, startWallTime, startCpuTime = time.time(), time.perf_counter(), time.process_time()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        yield outPieceProfile
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        wallTime = time.perf_counter() - startWallTime
+        cpuTime = time.process_time() - startCpuTime
+        _activeRecorders[:] = savedRecorders
+        _stageStack[:] = savedStages
+
+        # Resetting the peak memory usage makes the start value the resident set size of the process when the piece started
+        peakMemory = _stopPeakMemoryMeasurement(pieceStage[6])
+        outPieceProfile["startTime"] = startTime
+        outPieceProfile["wallTime"] = wallTime
+        outPieceProfile["cpuTime"] = cpuTime
+        outPieceProfile["peakMemory"] = peakMemory
+        outPieceProfile["memoryIncrease"] = peakMemory - startPeakMemory if peakMemory is not None else None
+        outPieceProfile["processPeakMemory"] = getPeakMemoryUsage()
+        outPieceProfile["stages"] = recorder.toDict()
+        recorder.recordTraceEvent(os.path.basename(sourcePath), startTime, wallTime, "piece",
+                                  {"sourcePath": str(sourcePath), "cpuTime": cpuTime, "peakMemory": peakMemory})
+        outPieceProfile["traceEvents"] = recorder.traceEvents if recorder.traceEvents is not None else []
+        if profiler is not None:
+            profiler.create_stats()
+            outPieceProfile["profilerStats"] = marshal.dumps(profiler.stats)
+
+
+class CorpusProfile:
+    """
+    Collects the profiles of all pieces processed in a run over a corpus, along with the stages of the run itself (such as refreshing the
+    metadata), and exports them as a JSON file in Chrome trace format, which can be viewed in chrome://tracing or Perfetto.
+    """
+    def __init__(self, slowestPiecesToProfile: int = 0):
+        """
+        @param slowestPiecesToProfile: Amount of the slowest pieces that should be run again under cProfile (see getPiecesToRunUnderProfiler).
+        """
+        self.slowestPiecesToProfile: int = slowestPiecesToProfile
+        self.recorder: StageRecorder = StageRecorder(True)
+        self.pieceProfiles: list[dict] = []
+        self.startTime: float = time.time()
+        self.wallTime: float = 0.0
+        self.peakMemory: int = None
+        self.__profiledPieces: list[dict] = []
+
+    def addPieceProfile(self, pieceProfile: dict):
+        """
+        Adds the profile of a single piece.
+        @param pieceProfile: The profile of the piece, as yielded by profilingPiece.
+        """
+        self.pieceProfiles.append(pieceProfile)
+
+    def getPiecesToRunUnderProfiler(self) -> list[dict]:
+        """
+        Retrieves the pieces that should be run again under cProfile. These are ranked by the times of the run itself, which are not slowed down
+        by the overhead of cProfile.
+        @return: List of the profiles of the slowest pieces, ordered by descending wall time.
+        """
+        return self.getSlowestPieces(self.slowestPiecesToProfile)
+
+    def addProfilerStats(self, pieceProfile: dict, profilerStats: bytes):
+        """
+        Adds the cProfile statistics of a piece that was run again under cProfile.
+        @param pieceProfile: The profile of the piece, as returned by getPiecesToRunUnderProfiler.
+        @param profilerStats: The statistics as marshalled bytes, see profilingPiece.
+        """
+        pieceProfile["profilerStats"] = profilerStats
+        self.__profiledPieces.append(pieceProfile)
+
+    def finish(self):
+        """
+        Records the total duration and the peak memory usage of the run. Call this once the run is complete.
+        """
+        self.wallTime = time.time() - self.startTime
+        self.peakMemory = getPeakMemoryUsage()
+
+    def getSlowestPieces(self, count: int) -> list[dict]:
+        """
+        Retrieves the profiles of the slowest pieces.
+        @param count: Maximum amount of pieces to retrieve.
+        @return: List of piece profiles, ordered by descending wall time.
+        """
+        return sorted(self.pieceProfiles, key=lambda piece: piece["wallTime"], reverse=True)[:count]
+
+    def getStageTimes(self) -> dict[str, dict[str, float]]:
+        """
+        Retrieves the total time spent in each stage, across the run itself and all pieces.
+        @return: Dictionary of stage times, as returned by StageRecorder.toDict.
+        """
+        totals = StageRecorder()
+        totals.add(self.recorder.toDict())
+        for pieceProfile in self.pieceProfiles:
+            totals.add(pieceProfile["stages"])
+        return totals.toDict()
+
+    def write(self, filePath: os.path) -> list[os.path]:
+        """
+        Writes the profile as a JSON file in Chrome trace format. In addition to the trace events, the file contains the total stage times and a
+        summary of every piece. The cProfile statistics of the slowest pieces are written next to it, one file per piece, for use with pstats.
+        @param filePath: Path to the JSON file.
+        @return: List of paths to all written files.
+        """
+        mainProcessId = os.getpid()
+        processIds = {mainProcessId} | {pieceProfile["processId"] for pieceProfile in self.pieceProfiles}
+        traceEvents = [{"name": "process_name", "ph": "M", "pid": processId, "tid": processId,
+                        "args": {"name": "Main process" if processId == mainProcessId else "Worker " + str(processId)}}
+                       for processId in sorted(processIds)]
+
+        # Trace events are relative to the start of the run, as their Unix timestamps are too large to be displayed in a readable way
+        for event in self.recorder.traceEvents + [event for pieceProfile in self.pieceProfiles for event in pieceProfile["traceEvents"]]:
+            traceEvents.append(dict(event, ts=event["ts"] - self.startTime * 1e6))
+
+        pieceSummaries = [{key: value for key, value in pieceProfile.items() if key not in ["traceEvents", "profilerStats"]}
+                          for pieceProfile in self.getSlowestPieces(len(self.pieceProfiles))]
+        data = {"traceEvents": traceEvents,
+                "displayTimeUnit": "ms",
+                "wallTime": self.wallTime,
+                "peakMemory": self.peakMemory,
+                "stages": self.getStageTimes(),
+                "pieces": pieceSummaries}
+        with open(filePath, 'w') as file:
+            json.dump(data, file)
+
+        outFilePaths = [filePath]
+        profiledPieces = sorted(self.__profiledPieces, key=lambda piece: piece["wallTime"], reverse=True)
+        for rank, pieceProfile in enumerate(profiledPieces):
+            statsFilePath = (os.path.splitext(filePath)[0] + "_" + str(rank + 1) + "_" +
+                             os.path.splitext(os.path.basename(pieceProfile["sourcePath"]))[0] + ".prof")
+            with open(statsFilePath, 'wb') as file:
+                file.write(pieceProfile["profilerStats"])
+            outFilePaths.append(statsFilePath)
+        return outFilePaths
+
+    def printSummary(self, count: int = 5):
+        """
+        Prints the total time spent in each stage and the slowest pieces.
+        @param count: Amount of the slowest pieces to print.
+        """
+        print("Total time: " + format(self.wallTime, ".2f") + "s" +
+              ("" if self.peakMemory is None else ", peak memory of main process: " + format(self.peakMemory / 1024 ** 2, ".1f") + " MB"))
+        for stageName, stage in sorted(self.getStageTimes().items(), key=lambda item: item[1]["wallTime"], reverse=True):
+            print("  " + stageName + ": " + format(stage["wallTime"], ".2f") + "s wall, " + format(stage["cpuTime"], ".2f") + "s CPU, " +
+                  str(stage["count"]) + " runs" +
+                  ("" if stage.get("peakMemory") is None else ", " + format(stage["peakMemory"] / 1024 ** 2, ".1f") + " MB peak RSS"))
+        print("Slowest pieces:")
+        for pieceProfile in self.getSlowestPieces(count):
+            print("  " + os.path.basename(pieceProfile["sourcePath"]) + ": " + format(pieceProfile["wallTime"], ".2f") + "s wall, " +
+                  format(pieceProfile["cpuTime"], ".2f") + "s CPU" + ("" if pieceProfile["peakMemory"] is None else
+                                                                      ", " + format(pieceProfile["peakMemory"] / 1024 ** 2, ".1f") +
+                                                                      " MB peak RSS while processed"))
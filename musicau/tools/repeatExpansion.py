@@ -0,0 +1,301 @@
+from music21.repeat import ExpanderException
+
+import re
+import string
+
+
+# Maximum amount of passes expanding the innermost repeat, the same safety limit as used by music21 (see Expander._processRecursiveRepeatBars).
+MAX_EXPANSION_PASSES = 100
+
+
+class RepeatStructure:
+    """
+    Repeat barlines and endings (voltas) of the measures of a part, read once while parsing the part. Determines the order in which the measures
+    are played when rolling out the repeats, following the rules of music21's repeat.Expander, so that the playback order matches the order of
+    the measures returned by music21's expandRepeats. Repeat expressions such as D.C. or D.S. are not covered.
+    """
+    def __init__(self):
+        # Repeat barlines on the left and right side of each measure as tuples of the direction ('start' or 'end') and the amount of times the
+        # repeated measures are played (None if not given), None if the barline is not a repeat barline
+        self.leftRepeats: list[tuple[str, int]] = []
+        self.rightRepeats: list[tuple[str, int]] = []
+        # Endings as tuples of the numbers of the passes they are played in and the indices of the measures carrying the ending
+        self.endings: list[tuple[list[int], list[int]]] = []
+
+        self.__openEnding: tuple[list[int], list[int]] = None
+
+    def __len__(self):
+        return len(self.leftRepeats)
+
+    def addMeasure(self):
+        """
+        Adds a measure without any repeat barlines, to which the following barlines are assigned.
+        """
+        self.leftRepeats.append(None)
+        self.rightRepeats.append(None)
+
+    def setBarline(self, location: str, direction: str, times: int):
+        """
+        Sets a barline of the last added measure. Like in music21, a later barline at the same location replaces an earlier one.
+        @param location: 'left' or 'right', other locations are ignored as they do not affect the playback order.
+        @param direction: 'start' or 'end' for repeat barlines, None for other barlines.
+        @param times: The amount of times the measures of an end repeat are played, None if not given.
+        """
+        repeat = (direction, times) if direction is not None else None
+        if location == "left":
+            self.leftRepeats[-1] = repeat
+        elif location == "right":
+            self.rightRepeats[-1] = repeat
+
+    def addEnding(self, number: str, endingType: str, text: str):
+        """
+        Adds the last added measure to the open ending, or starts a new ending if there is none, following the way music21 creates its
+        RepeatBracket spanners when importing a MusicXML file.
+        @param number: The number attribute of the ending, i.e. '1' or '1, 2'.
+        @param endingType: The type attribute of the ending ('start', 'stop' or 'discontinue').
+        @param text: The displayed text of the ending, None if there is none.
+        @raise: ValueError if the number is not valid
+        """
+        measureIndex = len(self.leftRepeats) - 1
+        if self.__openEnding is None:
+            self.__openEnding = ([0], [measureIndex])
+            self.endings.append(self.__openEnding)
+        elif measureIndex not in self.__openEnding[1]:
+            self.__openEnding[1].append(measureIndex)
+
+        if endingType == "start":
+            self.__openEnding[0][:] = _parseEndingNumbers(number)
+            overrideNumber = re.match(r'^(\d+)\.?$', text) if text is not None else None
+            if overrideNumber:
+                self.__openEnding[0][:] = [int(overrideNumber.group(1))]
+        if endingType in ("stop", "discontinue"):
+            self.__openEnding = None
+
+    def getPlaybackOrder(self) -> list[tuple[int, str]]:
+        """
+        Determines the order in which the measures are played with all repeats and endings rolled out.
+        @return: List of the played measures as tuples of the index of the measure within the part and the suffix music21 gives the measure number
+        of the repetition (None if the measure keeps its suffix), or None if the part contains no repeats.
+        @raise: ExpanderException if the repeats or endings of the part are not coherent, in the same cases as music21's expandRepeats, ValueError
+        if the endings of a repeat overlap, where expandRepeats fails with a ValueError as well
+        """
+        if len(self) == 0:
+            raise ExpanderException("no measures found in the source stream to be expanded")
+        # Measures are represented as lists of the index of the measure within the part, its suffix, its left and right repeat barline and the
+        # index of the source measure it is identical to, which is None for copies, as endings only refer to the measures of the source part
+        measures = [[i, None, left, right, i] for i, (left, right) in enumerate(zip(self.leftRepeats, self.rightRepeats))]
+        if not _hasRepeat(measures):
+            return None
+        if not self.__repeatBarsAreCoherent() or not self.__endingsAreCoherent(measures):
+            raise ExpanderException("cannot expand Stream: badly formed repeats or repeat expressions")
+
+        expandedEndings = set()
+        for _ in range(MAX_EXPANSION_PASSES):
+            measures = self.__expandInnermostRepeatAndEndings(measures, expandedEndings)
+            if not _hasRepeat(measures):
+                break
+        return [(measure[0], measure[1]) for measure in measures]
+
+    def __repeatBarsAreCoherent(self) -> bool:
+        # See Expander.repeatBarsAreCoherent, an end repeat without a preceding start repeat implies a start repeat at the first measure
+        startCount = 0
+        endCount = 0
+        countBalance = 0
+        for left, right in zip(self.leftRepeats, self.rightRepeats):
+            for repeat, bIsLeft in [(left, True), (right, False)]:
+                if repeat is None:
+                    continue
+                if repeat[0] == "start":
+                    if not bIsLeft:
+                        raise ExpanderException("a right barline is found that cannot be processed")
+                    startCount += 1
+                    countBalance += 1
+                else:
+                    if countBalance == 0:
+                        startCount += 1
+                        countBalance += 1
+                    endCount += 1
+                    countBalance -= 1
+        return countBalance in (0, 1) and startCount in (endCount, endCount - 1)
+
+    def __endingsAreCoherent(self, measures: list[list]) -> bool:
+        # See Expander._repeatBracketsAreCoherent, including its early return for a group without endings
+        for group in self.__groupEndings(measures):
+            if len(group) == 0:
+                return True
+            if len(group) > 1:
+                numbers = [number for ending in group for number in self.endings[ending][0]]
+                if list(range(1, max(numbers) + 1)) != numbers:
+                    return False
+            spannedMeasures = set()
+            for i, ending in enumerate(group):
+                for measureIndex in self.endings[ending][1]:
+                    if measureIndex in spannedMeasures:
+                        return False
+                    spannedMeasures.add(measureIndex)
+                if self.rightRepeats[self.endings[ending][1][-1]] is None and (len(group) == 1 or i < len(group) - 1):
+                    return False
+        return True
+
+    def __groupEndings(self, measures: list[list]) -> list[list[int]]:
+        # See Expander._groupRepeatBracketIndices, a new group begins whenever the number of an ending repeats one of the current group
+        groups = [[]]
+        foundNumbers = []
+        for measure in measures:
+            for i, (numbers, measureIndices) in enumerate(self.endings):
+                if measure[4] == measureIndices[0]:
+                    if numbers[0] in foundNumbers:
+                        groups.append([])
+                        foundNumbers = []
+                    foundNumbers += numbers
+                    groups[-1].append(i)
+        return groups
+
+    def __expandInnermostRepeatAndEndings(self, measures: list[list], expandedEndings: set[int]) -> list[list]:
+        # See Expander._processInnermostRepeatsAndBrackets
+        innermost = _findInnermostRepeatIndices(measures)
+        focusGroup = None
+        for group in self.__groupEndings(measures) if len(innermost) > 0 else []:
+            for ending in group:
+                if ending in expandedEndings:
+                    break
+                if measures[innermost[0]][4] in self.endings[ending][1] or measures[innermost[-1]][4] in self.endings[ending][1]:
+                    focusGroup = group
+                    break
+            if focusGroup is not None:
+                break
+        if focusGroup is None:
+            return _expandRepeat(measures)
+
+        # Each ending is played after the repeated measures preceding it, leaving out the measures of the previous endings
+        boundaries = []
+        for ending in focusGroup:
+            expandedEndings.add(ending)
+            numbers, endingMeasureIndices = self.endings[ending]
+            sourceIndices = [measure[4] for measure in measures]
+            if endingMeasureIndices[0] not in sourceIndices or endingMeasureIndices[-1] not in sourceIndices:
+                raise ExpanderException("failed to find start or end index of bracket expansion")
+            endIndex = sourceIndices.index(endingMeasureIndices[-1])
+            indices = list(range(innermost[0], endIndex + 1))
+            for _, _, previousEndingIndices in boundaries:
+                indices = [index for index in indices if index not in previousEndingIndices]
+            if len(indices) == 0:
+                raise ValueError("The endings of the repeat starting at measure index " + str(measures[innermost[0]][0]) + " overlap.")
+            boundaries.append((len(numbers), indices, range(sourceIndices.index(endingMeasureIndices[0]), endIndex + 1)))
+
+        outMeasures = measures[:innermost[0]]
+        for times, indices, _ in boundaries:
+            for measure in _expandRepeat(measures, indices, times, True):
+                outMeasures.append(_stripRepeatBarlines(measure))
+        return outMeasures + measures[max(boundaries[-1][1]) + 1:]
+
+
+def _parseEndingNumbers(number: str) -> list[int]:
+    # See RepeatBracket.number, which falls back to 1 for numbers it cannot handle
+    if number is None:
+        return [1]
+    if number == '':
+        return [0]
+    if '-' in number:
+        start, end = number.split('-')
+        return list(range(int(start), int(end) + 1))
+    if ',' in number:
+        return [int(numberText.strip()) for numberText in number.split(',')]
+    if number.isdigit():
+        return [int(number)]
+    return [1]
+
+
+def _hasRepeat(measures: list[list]) -> bool:
+    return any(measure[2] is not None or (measure[3] is not None and measure[3][0] == "end") for measure in measures)
+
+
+def _stripRepeatBarlines(measure: list) -> list:
+    measure[2] = None
+    measure[3] = None
+    return measure
+
+
+def _findInnermostRepeatIndices(measures: list[list]) -> list[int]:
+    # See Expander.findInnermostRepeatIndices
+    startIndices = []
+    for i, (_, _, left, right, _) in enumerate(measures):
+        if left is not None:
+            if left[0] == "start":
+                startIndices.append(i)
+            else:
+                return list(range(startIndices[-1] if len(startIndices) > 0 else 0, i))
+        if right is not None and right[0] == "end":
+            return list(range(startIndices[-1] if len(startIndices) > 0 else 0, i + 1))
+    return []
+
+
+def _expandRepeat(measures: list[list], repeatIndices: list[int] = None, repeatTimes: int = None, bOnlyExpansion: bool = False) -> list[list]:
+    """
+    Rolls out the first innermost repeat, see Expander.processInnermostRepeatBars.
+    @param measures: The measures as represented in RepeatStructure.getPlaybackOrder.
+    @param repeatIndices: Indices of the measures to repeat, the innermost repeat if None.
+    @param repeatTimes: The amount of times the measures are played, given by the end repeat barline if None.
+    @param bOnlyExpansion: Whether only the repeated measures should be returned rather than all measures.
+    @return: List of the resulting measures.
+    @raise: ExpanderException if the end repeat barline of the innermost repeat is missing
+    """
+    bIndicesAreGiven = repeatIndices is not None
+    if not bIndicesAreGiven:
+        repeatIndices = _findInnermostRepeatIndices(measures)
+    if len(repeatIndices) == 0:
+        return []
+
+    outMeasures = []
+    bShouldStripNextMeasure = False
+    i = 0
+    while i < len(measures):
+        if i == repeatIndices[0]:
+            bEndBarlineIsOnNextMeasure = False
+            try:
+                bEndBarlineIsOnNextMeasure, foundTimes = _getEndRepeatBar(measures, repeatIndices[-1])
+            except ExpanderException:
+                if not bIndicesAreGiven:
+                    raise
+                foundTimes = 0
+            if repeatTimes is None:
+                repeatTimes = foundTimes
+            for times in range(repeatTimes):
+                for j in repeatIndices:
+                    # Repetitions are copies of the measures, which are no longer part of any ending
+                    copiedMeasure = measures[j][:4] + [None]
+                    if j in (repeatIndices[0], repeatIndices[-1]):
+                        _stripRepeatBarlines(copiedMeasure)
+                    if times != 0:
+                        copiedMeasure[1] = string.ascii_lowercase[(times - 1) % 26]
+                    outMeasures.append(copiedMeasure)
+            bShouldStripNextMeasure = bEndBarlineIsOnNextMeasure
+            i = repeatIndices[-1] + 1
+        else:
+            if not bOnlyExpansion:
+                if bShouldStripNextMeasure:
+                    _stripRepeatBarlines(measures[i])
+                    bShouldStripNextMeasure = False
+                outMeasures.append(measures[i])
+            i += 1
+    return outMeasures
+
+
+def _getEndRepeatBar(measures: list[list], index: int) -> tuple[bool, int]:
+    """
+    Finds the end repeat barline of a repeat, see Expander._getEndRepeatBar.
+    @param measures: The measures as represented in RepeatStructure.getPlaybackOrder.
+    @param index: Index of the last repeated measure.
+    @return: Tuple containing whether the end repeat barline is on the left side of the following measure, and the amount of times to play the
+    repeated measures.
+    @raise: ExpanderException if there is no end repeat barline on either side
+    """
+    right = measures[index][3]
+    if right is not None and right[0] == "end":
+        return False, right[1] if right[1] is not None else 2
+    if index >= len(measures) - 1:
+        raise ExpanderException("cannot find an end Repeat bar after the given end: " + str(index))
+    left = measures[index + 1][2]
+    if left is not None and left[0] == "end":
+        return True, left[1] if left[1] is not None else 2
+    raise ExpanderException("cannot find an end Repeat bar in the expected position")
@@ -0,0 +1,123 @@
+from datetime import datetime
+import os.path
+import sqlite3
+
+
+# Amount of pieces whose results are inserted within a single transaction.
+PIECES_PER_TRANSACTION = 100
+
+# Columns identifying the piece each result row belongs to, present in every result table.
+PIECE_KEY_COLUMNS = ["catalogue", "pieceNumber", "specifiers"]
+
+
+class ResultDatabase:
+    """
+    SQLite database holding the results of analysis methods in typed columns, one table per analysis method, so that the results of several
+    methods can be combined using SQL joins. Each run of an analysis method replaces its table. The 'runs' table records the method and
+    fingerprint each table was created with, and the 'pieces' table records every analysed piece along with its amount of result rows, including
+    pieces without any results.
+    """
+    def __init__(self, filePath: os.path):
+        """
+        @param filePath: Path to the database file, which is created if it does not exist.
+        """
+        self.filePath: os.path = filePath
+        self.connection: sqlite3.Connection = sqlite3.connect(filePath)
+        self.__pendingPieceCount: int = 0
+        self.__tableColumns: dict[str, list[tuple[str, str]]] = {}
+
+        self.connection.execute("CREATE TABLE IF NOT EXISTS runs (tableName TEXT PRIMARY KEY, methodName TEXT NOT NULL, fingerprint TEXT NOT NULL, "
+                                "timestamp TEXT NOT NULL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS pieces (tableName TEXT NOT NULL, catalogue TEXT NOT NULL, pieceNumber TEXT NOT NULL, "
+                                "specifiers TEXT NOT NULL, sourcePath TEXT, rowCount INTEGER NOT NULL, "
+                                "PRIMARY KEY (tableName, catalogue, pieceNumber, specifiers))")
+        self.connection.commit()
+
+    def createTable(self, tableName: str, methodName: str, fingerprint: str, columns: list[tuple[str, str]]):
+        """
+        Creates the table for the results of an analysis method, replacing any table of the same name.
+        @param tableName: Name of the table.
+        @param methodName: Name of the analysis method.
+        @param fingerprint: The fingerprint of the analysis method, as returned by AnalysisMethod.getFingerprint.
+        @param columns: The result columns as tuples of the column name and its SQLite type, as returned by AnalysisMethod.getResultColumns.
+        @raise: Exception if a result column uses the name of a column identifying the piece
+        """
+        for columnName, _ in columns:
+            if columnName in PIECE_KEY_COLUMNS or columnName == "rowIndex":
+                raise Exception("The result column name " + columnName + " of table " + tableName + " is reserved.")
+
+        columnDefinitions = ", ".join(_quote(columnName) + " " + columnType for columnName, columnType in columns)
+        with self.connection:
+            self.connection.execute("DROP TABLE IF EXISTS " + _quote(tableName))
+            self.connection.execute("CREATE TABLE " + _quote(tableName) + " (catalogue TEXT NOT NULL, pieceNumber TEXT NOT NULL, "
+                                    "specifiers TEXT NOT NULL, rowIndex INTEGER NOT NULL, " + columnDefinitions + ", "
+                                    "PRIMARY KEY (catalogue, pieceNumber, specifiers, rowIndex))")
+            self.connection.execute("DELETE FROM pieces WHERE tableName = ?", (tableName,))
+            self.connection.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?)",
+                                    (tableName, methodName, fingerprint, datetime.now().isoformat(timespec="seconds")))
+        self.__tableColumns[tableName] = columns
+
+    def insertResults(self, tableName: str, catalogue: str, pieceNumber: str, specifiers: str, sourcePath: os.path, rows: list[tuple]):
+        """
+        Inserts the result rows of a piece. Rows are committed in batches of several pieces, and when calling commit or close.
+        @param tableName: Name of the table, which must have been created using createTable.
+        @param catalogue: The catalogue ID of the piece.
+        @param pieceNumber: The number of the piece within the catalogue.
+        @param specifiers: The file specifiers of the piece.
+        @param sourcePath: Path to the analysed MusicXML file.
+        @param rows: The result rows, as returned by AnalysisMethod.createResultRows.
+        @raise: Exception if a row does not match the columns of the table
+        """
+        columns = self.__tableColumns[tableName]
+        for row in rows:
+            if len(row) != len(columns):
+                raise Exception("The result row " + str(row) + " does not match the " + str(len(columns)) + " columns of table " + tableName + ".")
+
+        pieceKey = (catalogue, pieceNumber, specifiers)
+        self.connection.executemany("INSERT INTO " + _quote(tableName) + " VALUES (" + ", ".join(["?"] * (len(columns) + 4)) + ")",
+                                    [pieceKey + (rowIndex,) + tuple(row) for rowIndex, row in enumerate(rows)])
+        self.connection.execute("INSERT OR REPLACE INTO pieces VALUES (?, ?, ?, ?, ?, ?)",
+                                (tableName,) + pieceKey + (str(sourcePath), len(rows)))
+
+        self.__pendingPieceCount += 1
+        if self.__pendingPieceCount >= PIECES_PER_TRANSACTION:
+            self.commit()
+
+    def createIndexes(self, tableName: str, indexedColumns: list[str]):
+        """
+        Creates indexes on result columns of a table, each combined with the columns identifying the piece. Creating the indexes once all rows are
+        inserted is faster than updating them with every insertion.
+        @param tableName: Name of the table.
+        @param indexedColumns: Names of the result columns to index, as returned by AnalysisMethod.getIndexedResultColumns.
+        """
+        with self.connection:
+            for columnName in indexedColumns:
+                self.connection.execute("CREATE INDEX IF NOT EXISTS " + _quote(tableName + "_" + columnName) + " ON " + _quote(tableName) +
+                                        " (" + ", ".join(PIECE_KEY_COLUMNS + [_quote(columnName)]) + ")")
+
+    def commit(self):
+        """
+        Commits all inserted rows.
+        """
+        self.connection.commit()
+        self.__pendingPieceCount = 0
+
+    def query(self, statement: str, parameters: tuple = ()) -> list[tuple]:
+        """
+        Runs an SQL query on the database.
+        @param statement: The SQL statement.
+        @param parameters: Values for the placeholders in the statement.
+        @return: List of the resulting rows.
+        """
+        return self.connection.execute(statement, parameters).fetchall()
+
+    def close(self):
+        """
+        Commits all inserted rows and closes the database.
+        """
+        self.commit()
+        self.connection.close()
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'